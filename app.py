@@ -1,10 +1,43 @@
 from flask import Flask, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
 from routes import api_bp
+from services.supabase_client import init_supabase
+from services.metrics import init_metrics
+from services.log import init_logging
+from services.rate_limit import TRUSTED_PROXY_HOPS, init_rate_limits
+from services.reconciler import init_reconciler
+from services.webhook_queue import init_webhook_queue
+from services.profiling import init_profiling
 import os
 
 def create_app():
     app = Flask(__name__)
 
+    # 🔹 Адрес клиента из X-Forwarded-For (за прокси Render), а не адрес прокси
+    if TRUSTED_PROXY_HOPS:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+    # 🔹 Общий клиент Supabase (создаётся лениво при первом обращении)
+    init_supabase(app)
+
+    # 🔹 JSON-логи через очередь, request id и access-запись на каждый запрос
+    init_logging(app)
+
+    # 🔹 Латентность маршрутов и этапов, /metrics для Prometheus
+    init_metrics(app)
+
+    # 🔹 Лимиты частоты по мерчанту (или адресу) и потолок одновременных запросов — до запросов в БД
+    init_rate_limits(app)
+
+    # 🔹 Профилирование запросов по правилу админа или X-Profile (ADMIN_TOKEN)
+    init_profiling(app)
+
+    # 🔹 Фоновая сверка pending-покупок с Birs (RECONCILE_ENABLED=1)
+    init_reconciler(app)
+
+    # 🔹 Пакетная запись webhook-статусов и подбор журналов умерших воркеров (WEBHOOK_BATCH_MODE=1)
+    init_webhook_queue(app)
+
     # 🔹 Регистрируем все API-маршруты
     app.register_blueprint(api_bp, url_prefix="/api")
 
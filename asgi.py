@@ -0,0 +1,68 @@
+import asyncio
+import contextlib
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount, Route
+
+from app import app as flask_app
+from routes.operations import qr_async
+from services.http_client import async_outbound
+from services.idempotency import idempotent_async
+from services.log import log_requests
+from services.metrics import instrument_async
+from services.rate_limit import rate_limited
+from services.status_cache import status_listeners
+from services.status_hub import status_hub
+from services.supabase_client import AsyncPostgrestRegistry
+
+# ⚡ ASGI-режим: горячие пути /qr-code и /qr-status обслуживаются асинхронно,
+# всё остальное уходит в обычное Flask-приложение.
+# Запуск: uvicorn asgi:app --workers 4 (Flask/gunicorn-режим через app:app не меняется);
+# для общих метрик воркеров задайте PROMETHEUS_MULTIPROC_DIR (пустой каталог) перед запуском
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.postgrest = AsyncPostgrestRegistry()
+    app.state.supabase = flask_app.extensions["supabase"]
+
+    # Webhook'и (Flask, пул потоков) будят long-poll и SSE через hub
+    status_hub.bind(asyncio.get_running_loop())
+    status_listeners.append(status_hub.publish)
+    yield
+    status_listeners.remove(status_hub.publish)
+    await app.state.postgrest.aclose()
+    await async_outbound.aclose()
+
+
+# Метрики, access-лог и лимиты частоты под тем же шаблоном маршрута, что и во Flask
+def endpoint(route, handler, long_lived=None):
+    return instrument_async(route, log_requests(route, rate_limited(route, handler, long_lived)))
+
+
+app = Starlette(
+    routes=[
+        Route(
+            "/api/operations/qr-code/",
+            endpoint("/api/operations/qr-code/", idempotent_async("qr-code", qr_async.qr_code)),
+            methods=["POST"],
+        ),
+        Route(
+            "/api/operations/{opId}/qr-status",
+            endpoint(
+                "/api/operations/<opId>/qr-status",
+                qr_async.get_qr_status,
+                long_lived=lambda request: bool(request.query_params.get("wait")),
+            ),
+            methods=["GET"],
+        ),
+        Route(
+            "/api/operations/status-stream",
+            endpoint("/api/operations/status-stream", qr_async.status_stream, long_lived=lambda request: True),
+            methods=["GET"],
+        ),
+        Mount("/", WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+
+from bench import mock_backend
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Нагрузочный тест: sync gunicorn против ASGI (uvicorn) на /qr-code и /qr-status
+# python -m bench.bench_asgi --workers 2 --concurrency 10 100 500
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_HEADERS = {"X-Api-Login": "bench", "X-Api-Key": "bench-key"}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed(backend_url, clients):
+    return {
+        "api_clients": [
+            {"id": 1, "api_login": "bench", "api_key": "bench-key", "second_server_url": backend_url, "test": False}
+        ],
+        "clients": [
+            {"id": i, "client_id": f"c{i}", "api_login": "bench", "steam_login": f"login{i}", "total_amount": 0, "period_amount": 0}
+            for i in range(clients)
+        ],
+        "purchases": [
+            {"id": f"op{i}", "api_login": "bench", "status": "pending", "commit": None} for i in range(clients)
+        ],
+    }
+
+
+# Заглушки живут в отдельном процессе, чтобы не делить GIL с генератором нагрузки
+def run_stand_ins(backend_port, db_port, db_latency, backend_latency, clients):
+    mock_backend.serve(backend_latency, port=backend_port)
+    stub = PostgrestStub(seed(f"http://127.0.0.1:{backend_port}/", clients), latency=db_latency)
+    serve(stub, port=db_port)
+    threading.Event().wait()
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"port {port} did not open")
+
+
+def start_server(mode, port, workers, env):
+    if mode == "sync":
+        # Нагрузка от одного мерчанта: bulkhead backend'а (четверть потоков) не режет её —
+        # изоляцию мерчантов меряет bench_breaker
+        env = dict(env)
+        env.setdefault("BACKEND_MAX_CONCURRENCY", str(workers))
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "app:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        proc.kill()
+        raise
+    return proc
+
+
+async def load(base_url, route, concurrency, total, clients):
+    timings, errors = [], 0
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    if route == "qr-code":
+                        resp = await client.post("/api/operations/qr-code/", headers=API_HEADERS, json={"sum": 100, "client_id": f"c{i % clients}"})
+                    else:
+                        resp = await client.get(f"/api/operations/op{i % clients}/qr-status", headers=API_HEADERS)
+                    if resp.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                timings.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(timings),
+        "p99_ms": timings[int(len(timings) * 0.99) - 1],
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2, help="процессов у каждого сервера")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    parser.add_argument("--backend-latency-ms", type=float, default=100)
+    parser.add_argument("--routes", nargs="+", default=["qr-code", "qr-status"])
+    args = parser.parse_args()
+
+    clients = 1000
+    backend_port, db_port = free_port(), free_port()
+    stand_ins = multiprocessing.Process(
+        target=run_stand_ins,
+        args=(backend_port, db_port, args.db_latency_ms / 1000, args.backend_latency_ms / 1000, clients),
+        daemon=True,
+    )
+    stand_ins.start()
+    wait_for_port(backend_port)
+    wait_for_port(db_port)
+    # Замер пропускной способности, а не лимитов частоты
+    env = dict(
+        os.environ, SUPABASE_URL=f"http://127.0.0.1:{db_port}", SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY, RATE_LIMIT_ENABLED="0"
+    )
+
+    for mode in ("sync", "asgi"):
+        port = free_port()
+        proc = start_server(mode, port, args.workers, env)
+        try:
+            for route in args.routes:
+                for concurrency in args.concurrency:
+                    result = asyncio.run(load(f"http://127.0.0.1:{port}", route, concurrency, args.requests, clients))
+                    print(
+                        f"{mode:<5} {route:<10} c={concurrency:<5} {result['rps']:8.1f} req/s "
+                        f"p50={result['p50_ms']:.1f}ms p99={result['p99_ms']:.1f}ms errors={result['errors']}"
+                    )
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    stand_ins.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from bench import fakes, mock_backend
+from bench.bench_asgi import ROOT, free_port, wait_for_port
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Один backend мерчанта зависает: что остаётся от пропускной способности остальных
+# python -m bench.bench_breaker --duration 20
+# Сначала только здоровый мерчант, потом здоровый + зависший: с предохранителем и без него.
+# С предохранителем (настройки по умолчанию) здоровый мерчант должен терять не больше --max-drop
+# пропускной способности, иначе прогон завершается с ошибкой.
+
+HANG_HEADERS = {"X-Api-Login": "hang", "X-Api-Key": "hang-key"}
+
+
+def run_stand_ins(db_port, healthy_port, hang_port, healthy_latency, hang_latency):
+    mock_backend.serve(healthy_latency, responder=fakes.second_server_responder(), port=healthy_port)
+    mock_backend.serve(hang_latency, responder=fakes.second_server_responder(), port=hang_port)
+    tables = fakes.seed(f"http://127.0.0.1:{healthy_port}/", clients=1000, purchases=0)
+    tables["api_clients"].append(
+        {"id": 2, "api_login": "hang", "api_key": "hang-key", "second_server_url": f"http://127.0.0.1:{hang_port}/", "test": False}
+    )
+    serve(PostgrestStub(tables), port=db_port)
+    threading.Event().wait()
+
+
+async def load(base_url, headers, client_ids, concurrency, duration):
+    stats = {"ok": 0, "rejected": 0, "failed": 0, "latencies": []}
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60, headers=headers) as client:
+
+        async def worker():
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    resp = await client.post(
+                        "/api/operations/qr-code/", json={"sum": 100, "client_id": next(client_ids)}
+                    )
+                    key = "ok" if resp.status_code == 200 else "rejected" if resp.status_code == 503 else "failed"
+                except httpx.HTTPError:
+                    resp, key = None, "failed"
+                stats[key] += 1
+                stats["latencies"].append(time.monotonic() - started)
+                # Клиенты мерчанта выполняют Retry-After, как обещает API (без него — секунда)
+                if key == "rejected":
+                    await asyncio.sleep(min(float(resp.headers.get("Retry-After", 1)), max(0.0, deadline - time.monotonic())))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return stats
+
+
+def describe(label, stats, duration):
+    latencies = sorted(stats["latencies"]) or [0.0]
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    return (
+        f"{label:<9} {stats['ok'] / duration:7.1f} ok/s  p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  "
+        f"ok {stats['ok']}  503 {stats['rejected']}  failed {stats['failed']}"
+    )
+
+
+async def scenario(base_url, args, with_hang):
+    healthy_ids = (f"c{i % 1000}" for i in itertools.count())
+    tasks = [load(base_url, fakes.API_HEADERS, healthy_ids, args.concurrency, args.duration)]
+    if with_hang:
+        hang_ids = (f"hang{i}" for i in itertools.count())
+        tasks.append(load(base_url, HANG_HEADERS, hang_ids, args.hang_concurrency, args.duration))
+    return await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных запросов здорового мерчанта")
+    parser.add_argument("--hang-concurrency", type=int, default=64, help="одновременных запросов к зависшему backend'у")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--healthy-latency-ms", type=float, default=50)
+    parser.add_argument("--max-drop", type=float, default=0.2, help="допустимая потеря ok/s здорового мерчанта")
+    args = parser.parse_args()
+
+    db_port, healthy_port, hang_port = free_port(), free_port(), free_port()
+    stand_ins = multiprocessing.Process(
+        target=run_stand_ins,
+        args=(db_port, healthy_port, hang_port, args.healthy_latency_ms / 1000, 3600),
+        daemon=True,
+    )
+    stand_ins.start()
+    for port in (db_port, healthy_port, hang_port):
+        wait_for_port(port)
+
+    configurations = [
+        # Без предохранителя: порог недостижим, bulkhead шире числа потоков, таймаут как у прочих запросов
+        ("no breaker", {
+            "BACKEND_BREAKER_MIN_CALLS": "1000000", "BACKEND_MAX_CONCURRENCY": "1000", "BACKEND_READ_TIMEOUT": "15",
+        }),
+        # Настройки по умолчанию: bulkhead — от -w × --threads, таймауты backend'а — 2 с
+        ("breaker", {}),
+    ]
+    drops = {}
+
+    for label, overrides in configurations:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(
+                os.environ,
+                SUPABASE_URL=f"http://127.0.0.1:{db_port}",
+                SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+                # Замер пропускной способности, а не лимитов частоты
+                RATE_LIMIT_ENABLED="0",
+                OUTBOUND_RETRIES="0",
+                LIMITS_DB_PATH=os.path.join(directory, "limits.sqlite"),
+                IDEMPOTENCY_DB_PATH=os.path.join(directory, "idempotency.sqlite"),
+                BACKEND_BULKHEAD_DIR=os.path.join(directory, "bulkheads"),
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+                **overrides,
+            )
+            port = free_port()
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-k", "gthread", "-w", str(args.workers), "--threads",
+                 str(args.threads), "-b", f"127.0.0.1:{port}", "app:app"],
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                wait_for_port(port)
+                base_url = f"http://127.0.0.1:{port}"
+                (alone,) = asyncio.run(scenario(base_url, args, with_hang=False))
+                healthy, hang = asyncio.run(scenario(base_url, args, with_hang=True))
+            finally:
+                proc.terminate()
+                proc.wait()
+
+        print(f"== {label} (gunicorn gthread -w {args.workers} --threads {args.threads})")
+        print("  " + describe("alone", alone, args.duration))
+        print("  " + describe("healthy", healthy, args.duration) + "   <- while another backend hangs")
+        print("  " + describe("hanging", hang, args.duration))
+        drops[label] = 1 - healthy["ok"] / max(1, alone["ok"])
+        print(f"  healthy throughput drop {drops[label]:.0%}")
+
+    stand_ins.terminate()
+    if drops["breaker"] > args.max_drop:
+        sys.exit(f"FAIL: with the breaker healthy throughput dropped {drops['breaker']:.0%} > {args.max_drop:.0%}")
+
+
+if __name__ == "__main__":
+    main()
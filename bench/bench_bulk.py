@@ -0,0 +1,93 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench import mock_backend
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 500 заказов: по одному через /qr-code против одного POST /qr-code/bulk
+# python -m bench.bench_bulk --orders 500 --concurrency 32 --backend-latency-ms 100
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--sequential", type=int, default=50, help="сколько заказов прогнать по одному (дальше — экстраполяция)")
+    parser.add_argument("--concurrency", type=int, default=None, help="QR_BULK_CONCURRENCY")
+    parser.add_argument("--backend-latency-ms", type=float, default=100)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    latency = args.backend_latency_ms / 1000
+    slowest = 0.0
+
+    def responder(method, path, body):
+        nonlocal slowest
+        # Разброс ±50%: итог bulk-пачки упирается в самый медленный вызов
+        delay = random.uniform(latency * 0.5, latency * 1.5)
+        slowest = max(slowest, delay)
+        time.sleep(delay)
+        return mock_backend.default_responder(method, path, body)
+
+    backend, backend_url = mock_backend.serve(responder=responder)
+    total = args.orders + args.sequential
+    stub = PostgrestStub(
+        {
+            "api_clients": [{"id": 1, "api_login": "bench", "api_key": "bench-key", "second_server_url": backend_url, "test": False}],
+            "clients": [],
+            "available_logins": [{"login": f"login{i}", "used": False} for i in range(total * 2)],
+        },
+        latency=args.db_latency_ms / 1000,
+    )
+    server, url = serve(stub)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(
+            SUPABASE_URL=url,
+            SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+            # Замер пропускной способности, а не лимитов частоты
+            RATE_LIMIT_ENABLED="0",
+            LIMITS_DB_PATH=os.path.join(directory, "limits.sqlite"),
+        )
+        if args.concurrency:
+            os.environ["QR_BULK_CONCURRENCY"] = str(args.concurrency)
+
+        from app import app
+        from routes.operations.qr_bulk import QR_BULK_CONCURRENCY
+
+        client = app.test_client()
+        headers = {"X-Api-Login": "bench", "X-Api-Key": "bench-key"}
+
+        requests_before = stub.requests
+        started = time.perf_counter()
+        for i in range(args.sequential):
+            resp = client.post("/api/operations/qr-code/", json={"sum": 10000, "client_id": f"s{i}"}, headers=headers)
+            assert resp.status_code == 200, resp.json
+        per_order = (time.perf_counter() - started) / args.sequential
+        print(
+            f"single: {per_order * 1000:.0f} ms/order, {(stub.requests - requests_before) / args.sequential:.1f} DB requests/order "
+            f"→ {args.orders} orders ≈ {per_order * args.orders:.1f}s"
+        )
+
+        slowest = 0.0
+        requests_before = stub.requests
+        orders = [{"sum": 10000, "client_id": f"b{i}"} for i in range(args.orders)]
+        started = time.perf_counter()
+        resp = client.post("/api/operations/qr-code/bulk", json={"orders": orders}, headers=headers)
+        elapsed = time.perf_counter() - started
+
+        ok = sum(1 for item in resp.json["results"] if "results" in item)
+        print(
+            f"bulk:   {args.orders} orders in {elapsed:.2f}s (concurrency {QR_BULK_CONCURRENCY}, slowest backend call "
+            f"{slowest * 1000:.0f} ms), ok {ok}, DB requests {stub.requests - requests_before}"
+        )
+        assert ok == args.orders
+
+    server.shutdown()
+    backend.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import random
+import statistics
+import time
+
+from supabase import create_client
+
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+from services import credentials
+from services.credentials import find_api_client, find_api_client_by_key
+
+# 📊 Латентность проверки API-ключей с кэшем и без (python -m bench.bench_credentials)
+
+
+def run(supabase, requests_count, logins, cached):
+    credentials.credentials_cache.clear()
+    credentials.credentials_cache.reset_stats()
+    credentials.credentials_cache.ttl = credentials.CREDENTIALS_CACHE_TTL if cached else 0
+    credentials.credentials_cache.negative_ttl = credentials.CREDENTIALS_NEGATIVE_TTL if cached else 0
+
+    timings = []
+    for _ in range(requests_count):
+        login = random.choice(logins)
+        started = time.perf_counter()
+        if login is None:
+            # Битый ключ — проверяем отрицательный кэш
+            find_api_client_by_key(supabase, "bad-key")
+        else:
+            find_api_client(supabase, login, f"key-{login}")
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1]
+    print(f"{name:<10} mean={statistics.mean(timings):.3f}ms p50={statistics.median(timings):.3f}ms p99={p99:.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="искусственная задержка заглушки")
+    args = parser.parse_args()
+
+    logins = [f"merchant{i}" for i in range(args.clients)]
+    stub = PostgrestStub(
+        tables={
+            "api_clients": [
+                {"id": i, "api_login": login, "api_key": f"key-{login}", "second_server_url": "http://127.0.0.1:1/", "test": False}
+                for i, login in enumerate(logins)
+            ]
+        },
+        latency=args.latency_ms / 1000,
+    )
+    server, url = serve(stub)
+    supabase = create_client(url, FAKE_SERVICE_KEY)
+
+    pool = logins + [None]
+    uncached = run(supabase, args.requests, pool, cached=False)
+    db_before = stub.requests
+    cached = run(supabase, args.requests, pool, cached=True)
+
+    report("no cache", uncached)
+    report("cache", cached)
+    print(f"DB requests: no cache={db_before}, cache={stub.requests - db_before}")
+    print("cache stats:", credentials.credentials_cache.stats())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
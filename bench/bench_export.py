@@ -0,0 +1,225 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import httpx
+
+from bench import fakes
+from bench.bench_asgi import free_port, wait_for_port
+from bench.bench_rate_limit import start
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, _matches, serve
+
+# 📊 GET /api/operations/export на синтетической истории покупок
+# python -m bench.bench_export --rows 10000,100000,1000000 --db-latency-ms 2
+# Строки purchases не хранятся: i-я строка вычисляется по номеру, поэтому заглушка держит
+# и 10M строк. Страница по курсору (created_at, id) — бинарный поиск, как индекс в Postgres.
+# Меряем время до первого байта, строки/с и RSS воркера во время выгрузки.
+
+BASE = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+TIES = 3  # строк на одну секунду created_at: курсор должен проходить одинаковые created_at
+STATUSES = ("success", "pending", "cancelled", "success", "refund", "success", "pending", "success", "success", "success")
+
+
+def purchase(i):
+    return {
+        "id": f"op{i:010d}",
+        "api_login": fakes.API_LOGIN,
+        "created_at": (BASE + datetime.timedelta(seconds=i // TIES)).isoformat(),
+        "amount": 100 + i % 900,
+        "status": STATUSES[i % len(STATUSES)],
+        "steam_login": f"login{i % 20000}",
+        "qr_id": f"qr{i}",
+        "qr_payload": f"https://qr.example/{i}",
+        "commit": None,
+    }
+
+
+# 🧪 purchases из формулы, остальные таблицы — как в обычной заглушке
+class SyntheticPurchases(PostgrestStub):
+    def __init__(self, count, **kwargs):
+        super().__init__(fakes.seed("http://127.0.0.1:9/", clients=0, purchases=0, logins=0), **kwargs)
+        self.count = count
+
+    def select_rows(self, table, params):
+        if table != "purchases":
+            return super().select_rows(table, params)
+
+        assert dict(params).get("order") == "created_at,id" and "offset" not in dict(params)
+        filters = [(k, v) for k, v in params if k not in ("select", "limit", "order")]
+        lower = [(k, v) for k, v in filters if k == "or" or (k == "created_at" and v.startswith(("gt.", "gte.")))]
+        upper = [(k, v) for k, v in filters if k == "created_at" and v.startswith(("lt.", "lte."))]
+        rest = [f for f in filters if f not in lower and f not in upper]
+
+        # Первая строка, прошедшая нижние границы (строки упорядочены по (created_at, id))
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = purchase(mid)
+            if all(_matches(row, column, expr) for column, expr in lower):
+                hi = mid
+            else:
+                lo = mid + 1
+
+        limit = int(dict(params).get("limit", self.count))
+        result = []
+        for i in range(lo, self.count):
+            row = purchase(i)
+            if not all(_matches(row, column, expr) for column, expr in upper):
+                break
+            if all(_matches(row, column, expr) for column, expr in rest):
+                result.append(row)
+                if len(result) == limit:
+                    break
+        return result
+
+
+def run_stand_in(port, count, latency):
+    serve(SyntheticPurchases(count, latency=latency), port=port)
+    threading.Event().wait()
+
+
+def rss_mib(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def worker_pid(master_pid, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        if int(f.read().rsplit(")", 1)[1].split()[1]) == master_pid:
+                            return int(entry)
+                except (OSError, IndexError):
+                    continue
+        time.sleep(0.05)
+    raise RuntimeError("gunicorn worker not found")
+
+
+def expected_ids(count, params):
+    statuses = set(params["status"].split(",")) if "status" in params else None
+    start_at, end_at = params.get("from"), params.get("to")
+    ids = []
+    for i in range(count):
+        row = purchase(i)
+        if start_at and row["created_at"] < start_at:
+            continue
+        if end_at and row["created_at"] >= end_at:
+            break
+        if statuses is None or row["status"] in statuses:
+            ids.append(row["id"])
+    return ids
+
+
+def export(base_url, params, pid):
+    peak, stop = [rss_mib(pid)], threading.Event()
+
+    def sample():
+        while not stop.wait(0.05):
+            peak.append(rss_mib(pid))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    ids, size = [], 0
+    started = time.perf_counter()
+    first_byte = None
+    with httpx.stream("GET", f"{base_url}/api/operations/export", params=params,
+                      headers=fakes.API_HEADERS, timeout=600) as resp:
+        assert resp.status_code == 200, resp.read()
+        pending = ""
+        for chunk in resp.iter_text():
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            size += len(chunk)
+            lines = (pending + chunk).split("\n")
+            pending = lines.pop()
+            ids.extend(line.split(",", 1)[0] if params["format"] == "csv" else json.loads(line)["id"] for line in lines)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+
+    if params["format"] == "csv":
+        assert ids[0] == "id", ids[:1]
+        ids = ids[1:]
+    return ids, size, first_byte, elapsed, max(peak)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", default="10000,100000,1000000")
+    parser.add_argument("--db-latency-ms", type=float, default=2)
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    for count in (int(n) for n in args.rows.split(",")):
+        port = free_port()
+        stand_in = multiprocessing.Process(target=run_stand_in, args=(port, count, args.db_latency_ms / 1000), daemon=True)
+        stand_in.start()
+        wait_for_port(port)
+
+        # Одна страница напрямую из заглушки — ориентир для времени до первого байта
+        started = time.perf_counter()
+        httpx.get(
+            f"http://127.0.0.1:{port}/rest/v1/purchases",
+            params={"select": "*", "api_login": f"eq.{fakes.API_LOGIN}", "order": "created_at,id", "limit": args.page_size},
+        )
+        page_fetch = time.perf_counter() - started
+
+        last_day = (BASE + datetime.timedelta(seconds=count // TIES)).date()
+        scenarios = [
+            ("csv", {"format": "csv"}),
+            ("ndjson", {"format": "ndjson"}),
+            # Окно из середины истории и фильтр статуса — курсор стартует не с начала таблицы
+            ("csv window", {
+                "format": "csv",
+                "status": "success,refund",
+                "from": (BASE + datetime.timedelta(seconds=count // TIES // 4)).isoformat(),
+                "to": (BASE + datetime.timedelta(seconds=count // TIES // 2)).isoformat(),
+            }),
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(
+                os.environ,
+                SUPABASE_URL=f"http://127.0.0.1:{port}",
+                SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+                RATE_LIMIT_ENABLED="0",
+                EXPORT_PAGE_SIZE=str(args.page_size),
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+            )
+            proc, base_url = start(1, 4, env)
+            try:
+                pid = worker_pid(proc.pid)
+                httpx.get(f"{base_url}/api/operations/export", params={"format": "csv", "to": "2000-01-01"},
+                          headers=fakes.API_HEADERS)  # импорт supabase и прогрев пула — не в замер
+                idle = rss_mib(pid)
+
+                print(f"== {count} rows (history up to {last_day}), page {args.page_size}, "
+                      f"DB RTT {args.db_latency_ms:.0f} ms, one page fetch {page_fetch * 1000:.1f} ms, idle RSS {idle:.1f} MiB")
+                for label, params in scenarios:
+                    ids, size, first_byte, elapsed, peak = export(base_url, params, pid)
+                    expected = expected_ids(count, params)
+                    print(
+                        f"  {label:<10} {len(ids):>9} rows  {size / 2 ** 20:7.1f} MiB  first byte {first_byte * 1000:6.1f} ms  "
+                        f"{len(ids) / elapsed:8.0f} rows/s  peak RSS +{peak - idle:5.1f} MiB  "
+                        f"{'complete, ordered' if ids == expected else 'MISMATCH'}"
+                    )
+            finally:
+                proc.terminate()
+                proc.wait()
+                stand_in.terminate()
+
+
+if __name__ == "__main__":
+    main()
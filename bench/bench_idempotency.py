@@ -0,0 +1,107 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import fakes, mock_backend
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Повторы с Idempotency-Key: сохранённый ответ вместо второго внешнего вызова и второй записи в БД
+# python -m bench.bench_idempotency --retries 50 --duplicates 20 --upstream-latency-ms 1000
+
+
+def counting(responder, counter):
+    lock = threading.Lock()
+
+    def respond(method, path, body):
+        with lock:
+            counter[0] += 1
+        return responder(method, path, body)
+
+    return respond
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--retries", type=int, default=50)
+    parser.add_argument("--duplicates", type=int, default=20, help="одновременных дубликатов одного запроса")
+    parser.add_argument("--upstream-latency-ms", type=float, default=1000)
+    args = parser.parse_args()
+
+    latency = args.upstream_latency_ms / 1000
+    birs_calls, backend_calls = [0], [0]
+    birs, birs_url = mock_backend.serve(latency, responder=counting(fakes.birs_responder, birs_calls))
+    backend, backend_url = mock_backend.serve(latency, responder=counting(fakes.second_server_responder(), backend_calls))
+    stub = PostgrestStub(fakes.seed(backend_url, clients=0, purchases=0, logins=1000))
+    server, url = serve(stub)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(
+            SUPABASE_URL=url,
+            SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+            # Повторы идут подряд — лимиты частоты здесь не проверяем
+            RATE_LIMIT_ENABLED="0",
+            BIRS_API_URL=birs_url,
+            LIMITS_DB_PATH=os.path.join(directory, "limits.sqlite"),
+            IDEMPOTENCY_DB_PATH=os.path.join(directory, "idempotency.sqlite"),
+        )
+
+        from app import app
+        from services.limits import limit_engine
+
+        client = app.test_client()
+        order = {"steamId": "steam", "amount": 10000, "api_login": fakes.API_LOGIN, "api_key": fakes.API_KEY}
+
+        # =============== 1️⃣ /api/order: оригинал и последовательные повторы ===============
+        started = time.perf_counter()
+        first = client.post("/api/order/", json=order, headers={"Idempotency-Key": "order-1"})
+        original = time.perf_counter() - started
+        assert first.status_code == 200, first.json
+
+        started = time.perf_counter()
+        for _ in range(args.retries):
+            retry = client.post("/api/order/", json=order, headers={"Idempotency-Key": "order-1"})
+            assert retry.get_data() == first.get_data() and retry.headers.get("Idempotent-Replayed") == "true"
+        per_retry = (time.perf_counter() - started) / args.retries
+        print(
+            f"/api/order:   original {original * 1000:.0f} ms, retry {per_retry * 1000:.2f} ms "
+            f"({args.retries} retries) — Birs calls {birs_calls[0]}, purchases rows {len(stub.tables['purchases'])}"
+        )
+
+        # =============== 2️⃣ /qr-code: одновременные дубликаты ждут оригинал ===============
+        def duplicate(_):
+            resp = client.post(
+                "/api/operations/qr-code/",
+                json={"sum": 10000, "client_id": "dup-client"},
+                headers={**fakes.API_HEADERS, "Idempotency-Key": "qr-1"},
+            )
+            return resp.status_code, resp.get_data()
+
+        reserved_before = limit_engine.reserved
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.duplicates) as pool:
+            responses = list(pool.map(duplicate, range(args.duplicates)))
+        elapsed = time.perf_counter() - started
+        assert len(set(responses)) == 1 and responses[0][0] == 200, responses[:2]
+        print(
+            f"/qr-code:     {args.duplicates} concurrent duplicates in {elapsed * 1000:.0f} ms — backend calls "
+            f"{backend_calls[0]}, limit reservations {limit_engine.reserved - reserved_before}, identical responses"
+        )
+
+        # Для сравнения: те же дубликаты без ключа
+        backend_before = backend_calls[0]
+        with ThreadPoolExecutor(args.duplicates) as pool:
+            list(pool.map(lambda _: client.post(
+                "/api/operations/qr-code/", json={"sum": 10000, "client_id": "dup-client"}, headers=fakes.API_HEADERS,
+            ), range(args.duplicates)))
+        print(f"without key:  {args.duplicates} duplicates → backend calls {backend_calls[0] - backend_before}")
+
+    server.shutdown()
+    birs.shutdown()
+    backend.shutdown()
+
+
+if __name__ == "__main__":
+    main()
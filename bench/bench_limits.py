@@ -0,0 +1,193 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import mock_backend
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Лимиты под конкурентной нагрузкой: 1000 параллельных заказов одного клиента
+# python -m bench.bench_limits --orders 1000 --processes 4
+# 1) прежняя схема select → проверка в Python → update (гонка потерянных обновлений);
+# 2) LimitEngine из нескольких процессов на общем SQLite-файле, часть резервов откатывается;
+# 3) весь путь POST /qr-code (Flask) + пакетная запись сумм в clients.
+
+DAY_LIMIT = 10000
+CLIENT = {"id": 1, "client_id": "c1", "api_login": "bench", "steam_login": "login1", "total_amount": 0, "period_amount": 0}
+
+
+def legacy(url, orders, amount):
+    from supabase import create_client
+
+    supabase = create_client(url, FAKE_SERVICE_KEY)
+    accepted = 0
+    lock = threading.Lock()
+
+    def order(_):
+        nonlocal accepted
+        row = supabase.table("clients").select("*").eq("client_id", "c1").maybe_single().execute().data
+        new_period = (row["period_amount"] or 0) + amount
+        if new_period > DAY_LIMIT:
+            return
+        supabase.table("clients").update({"period_amount": new_period}).eq("client_id", "c1").execute()
+        with lock:
+            accepted += 1
+
+    with ThreadPoolExecutor(max_workers=100) as pool:
+        list(pool.map(order, range(orders)))
+
+    stored = supabase.table("clients").select("period_amount").eq("client_id", "c1").single().execute().data
+    spent = accepted * amount
+    print(
+        f"legacy: accepted {accepted} orders = {spent:.0f} RUB (limit {DAY_LIMIT}), "
+        f"clients.period_amount={stored['period_amount']:.0f}, overspend {max(0, spent - DAY_LIMIT):.0f} RUB"
+    )
+
+
+def _engine_worker(path, orders, threads, amount, fail_every, barrier, results):
+    from services.limits import LimitEngine
+
+    engine = LimitEngine(path=path)
+    counts = {"accepted": 0, "rejected": 0, "released": 0}
+    lock = threading.Lock()
+
+    def order(i):
+        reservation, cancelled = engine.reserve(None, "c1", amount)
+        with lock:
+            if cancelled:
+                counts["rejected"] += 1
+            elif fail_every and i % fail_every == 0:
+                engine.release(reservation)  # backend упал — откатываем резерв
+                counts["released"] += 1
+            else:
+                counts["accepted"] += 1
+
+    barrier.wait()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(order, range(orders)))
+    results.put(counts)
+
+
+def engine(orders, processes, amount, fail_every):
+    from services.limits import LimitEngine
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "limits.sqlite")
+        LimitEngine(path=path).seed(CLIENT)
+
+        barrier = multiprocessing.Barrier(processes)
+        results = multiprocessing.Queue()
+        per_process = orders // processes
+        workers = [
+            multiprocessing.Process(
+                target=_engine_worker,
+                args=(path, per_process, max(1, 250 // processes), amount, fail_every, barrier, results),
+            )
+            for _ in range(processes)
+        ]
+
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        counts = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        accepted = sum(c["accepted"] for c in counts)
+        day, _ = LimitEngine(path=path).usage("c1")
+
+    print(
+        f"engine: {per_process * processes} orders from {processes} processes in {elapsed:.2f}s, "
+        f"accepted {accepted} = {accepted * amount:.0f} RUB, released {sum(c['released'] for c in counts)}, "
+        f"rejected {sum(c['rejected'] for c in counts)}, window usage {day:.0f}/{DAY_LIMIT}"
+    )
+    assert accepted * amount <= DAY_LIMIT and abs(day - accepted * amount) < 1e-6
+    assert accepted == int(DAY_LIMIT // amount), "лимит должен выбираться полностью"
+
+
+def end_to_end(url, stub, orders, amount, fail_every):
+    counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+
+    def responder(method, path, body):
+        with counter_lock:
+            n = next(counter)
+        if fail_every and n % fail_every == 0:
+            return 502, {"error": "bench failure"}
+        return mock_backend.default_responder(method, path, body)
+
+    backend, backend_url = mock_backend.serve(responder=responder)
+    stub.tables["api_clients"][0]["second_server_url"] = backend_url
+
+    from app import app
+    from services.limits import limit_engine
+
+    client = app.test_client()
+    headers = {"X-Api-Login": "bench", "X-Api-Key": "bench-key"}
+    outcomes = {"ok": 0, "cancelled": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def order(_):
+        resp = client.post("/api/operations/qr-code/", json={"sum": amount * 100, "client_id": "c1"}, headers=headers)
+        kind = "failed" if resp.status_code != 200 else "ok" if "results" in resp.json else "cancelled"
+        with lock:
+            outcomes[kind] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=100) as pool:
+        list(pool.map(order, range(orders)))
+    elapsed = time.perf_counter() - started
+
+    limit_engine.flush()
+    stored = next(row for row in stub.tables["clients"] if row["client_id"] == "c1")
+    print(
+        f"qr-code: {orders} orders in {elapsed:.2f}s, ok {outcomes['ok']}, cancelled {outcomes['cancelled']}, "
+        f"backend failures {outcomes['failed']}; clients.period_amount={stored['period_amount']:.0f}"
+    )
+    assert outcomes["ok"] * amount <= DAY_LIMIT
+    assert abs(stored["period_amount"] - outcomes["ok"] * amount) < 1e-6
+    backend.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--amount", type=float, default=37, help="рублей в заказе")
+    parser.add_argument("--fail-every", type=int, default=10, help="каждый N-й вызов backend'а падает")
+    parser.add_argument("--latency-ms", type=float, default=2)
+    args = parser.parse_args()
+
+    stub = PostgrestStub(
+        {
+            "api_clients": [{"id": 1, "api_login": "bench", "api_key": "bench-key", "second_server_url": "", "test": False}],
+            "clients": [dict(CLIENT)],
+        },
+        latency=args.latency_ms / 1000,
+    )
+    server, url = serve(stub)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # До импорта services.limits: файл счётчиков роутов — временный
+        os.environ.update(
+            SUPABASE_URL=url,
+            SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+            # Замер пропускной способности, а не лимитов частоты
+            RATE_LIMIT_ENABLED="0",
+            LIMITS_DB_PATH=os.path.join(directory, "limits.sqlite"),
+        )
+        legacy(url, args.orders, args.amount)
+        engine(args.orders, args.processes, args.amount, args.fail_every)
+
+        stub.tables["clients"] = [dict(CLIENT)]
+        end_to_end(url, stub, args.orders, args.amount, args.fail_every)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from bench.bench_asgi import ROOT
+
+# 📊 Цена логирования на запрос: прежние print тел запроса/ответа против очереди + JSON-записей
+# python -m bench.bench_logging --requests 5000
+# stdout дочернего процесса — pipe, который родитель читает быстро или медленно (как забитый лог-коллектор).
+
+CHILD = """
+import json, logging, statistics, sys, time
+from services import log
+
+mode, total = sys.argv[1], int(sys.argv[2])
+body = {"steamId": "76561198000000000", "amount": 10000, "api_login": "bench", "api_key": "bench-key"}
+payload = {"result": {"operation_id": "3f1c0b52-5c1e-4c57-9a67-1d3c2f0f7a11", "qr_id": "e2b8", "qr_payload": "https://fake-qr.com/e2b8"}}
+
+if mode != "print":
+    log.configure_logging()
+logger = logging.getLogger("routes.test")
+
+def before():
+    # Так test_order писал каждый запрос
+    print("📥 Incoming request body:", body)
+    print("📤 Response payload:", payload)
+
+def after():
+    ctx, token = log.start_request("/api/test/")
+    logger.debug("📥 Incoming request body", extra={"body": body})
+    log.add_stage("db", "purchases_test.insert", 0.004)
+    logger.debug("📤 Response payload", extra={"body": payload})
+    log.finish_request(ctx, token, "POST", 201)
+
+call = before if mode == "print" else after
+timings = []
+for _ in range(total):
+    started = time.perf_counter()
+    call()
+    timings.append((time.perf_counter() - started) * 1e6)
+timings.sort()
+stats = {"mean": statistics.fmean(timings), "p99": timings[int(len(timings) * 0.99)], "max": timings[-1]}
+if mode != "print":
+    stats.update(log.stats())
+print(json.dumps(stats), file=sys.stderr)
+"""
+
+
+def drain(stream, slow):
+    while True:
+        chunk = stream.read(4096) if slow else stream.read(1 << 20)
+        if not chunk:
+            return
+        if slow:
+            # ~400 KB/s: pipe быстро заполняется, запись в него блокирует
+            time.sleep(0.01)
+
+
+def run(label, mode, total, slow, env):
+    proc = subprocess.Popen(
+        [sys.executable, "-c", CHILD, mode, str(total)],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    reader = threading.Thread(target=drain, args=(proc.stdout, slow), daemon=True)
+    reader.start()
+    err = proc.stderr.read()
+    proc.wait()
+    stats = json.loads(err.decode().strip().splitlines()[-1])
+    extra = ""
+    if "dropped" in stats:
+        extra = f"  dropped {stats['dropped']}  sampled out {stats['sampled_out']}"
+    print(
+        f"{label:<34} {'slow' if slow else 'fast'} stdout  "
+        f"mean {stats['mean']:7.1f} us  p99 {stats['p99']:8.1f} us  max {stats['max'] / 1000:7.1f} ms{extra}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    base = dict(os.environ, PYTHONUNBUFFERED="1")
+    for slow in (False, True):
+        run("before: print body/response", "print", args.requests, slow, base)
+        run("after: queue, INFO sampled 10%", "log", args.requests, slow, dict(base, LOG_SAMPLE_RATES="INFO=0.1"))
+        run("after: queue, every access record", "log", args.requests, slow, dict(base, LOG_SAMPLE_RATES="INFO=1"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from bench.bench_asgi import ROOT, free_port, wait_for_port
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Цена инструментирования и сборка метрик с нескольких воркеров
+# python -m bench.bench_metrics --workers 3 --requests 600
+# 1) микробенч: observe/timed/Flask-хуки в одном процессе и в multiprocess-режиме (mmap-файлы);
+# 2) gunicorn -w N: сумма phantom_request_duration_seconds_count в /metrics = число запросов.
+
+MICRO = """
+import time, flask
+from services import metrics
+
+def per_call(fn, n=20000):
+    fn()
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - started) / n * 1e6
+
+def with_timed():
+    with metrics.timed("bench", "stage"):
+        pass
+
+plain = flask.Flask("plain")
+instrumented = flask.Flask("instrumented")
+for app in (plain, instrumented):
+    app.add_url_rule("/ping", "ping", lambda: "ok")
+metrics.init_metrics(instrumented)
+plain_client, instrumented_client = plain.test_client(), instrumented.test_client()
+
+# Шум test_client больше самих хуков: берём минимум из нескольких чередующихся прогонов
+request_overhead = min(per_call(lambda: instrumented_client.get("/ping"), 2000) for _ in range(5)) - min(
+    per_call(lambda: plain_client.get("/ping"), 2000) for _ in range(5)
+)
+print(f"{'multiprocess' if metrics.MULTIPROCESS else 'single':<12}  "
+      f"observe_stage {per_call(lambda: metrics.observe_stage('bench', 'stage', time.perf_counter())):.1f} us  "
+      f"timed() {per_call(with_timed):.1f} us  Flask hooks {request_overhead:.1f} us/request")
+"""
+
+
+def micro():
+    env = dict(os.environ)
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    subprocess.run([sys.executable, "-c", MICRO], cwd=ROOT, env=env, check=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([sys.executable, "-c", MICRO], cwd=ROOT, env=dict(env, PROMETHEUS_MULTIPROC_DIR=directory), check=True)
+
+
+def aggregation(workers, total):
+    stub = PostgrestStub({"purchases": []})
+    server, url = serve(stub)
+
+    with tempfile.TemporaryDirectory() as directory:
+        port = free_port()
+        env = dict(os.environ, SUPABASE_URL=url, SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY, PROMETHEUS_MULTIPROC_DIR=directory)
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "app:app"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(port)
+            base = f"http://127.0.0.1:{port}"
+            for i in range(total):
+                # Новое соединение на каждый запрос — так запросы расходятся по воркерам
+                requests.post(f"{base}/api/webhook/", json={"id": f"p{i}", "status": "settlement"},
+                              headers={"Connection": "close"})
+            time.sleep(0.2)
+            text = requests.get(f"{base}/metrics").text
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    server.shutdown()
+    counted = sum(
+        float(value)
+        for value in re.findall(r'phantom_request_duration_seconds_count\{[^}]*route="/api/webhook/"[^}]*\} (\S+)', text)
+    )
+    db = re.findall(r'phantom_stage_duration_seconds_count\{stage="db",target="purchases.update"\} (\S+)', text)
+    print(
+        f"gunicorn -w {workers}: {total} webhook requests, /metrics counts {counted:.0f} "
+        f"(db purchases.update observations: {db[0] if db else 0})"
+    )
+    assert counted == total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=600)
+    args = parser.parse_args()
+
+    micro()
+    aggregation(args.workers, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench import mock_backend
+from services.http_client import OutboundClient
+
+# 📊 Голый requests.post против пула keep-alive (python -m bench.bench_outbound [--tls])
+
+
+def self_signed_cert(directory):
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+def drive(send, url, total, rate, workers):
+    # Открытая модель нагрузки: запросы стартуют с фиксированным темпом
+    interval = 1.0 / rate
+    timings = []
+
+    def one():
+        started = time.perf_counter()
+        send(url)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for i in range(total):
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(one))
+        for future in futures:
+            future.result()
+    return timings, time.perf_counter() - started
+
+
+def report(name, timings, elapsed, server, connections_before):
+    timings = sorted(timings)
+    print(
+        f"{name:<10} {len(timings) / elapsed:7.1f} req/s  mean={statistics.mean(timings):.2f}ms "
+        f"p99={timings[int(len(timings) * 0.99) - 1]:.2f}ms  new connections={server.connections - connections_before}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200, help="запросов в секунду")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--tls", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert = key = None
+        if args.tls:
+            cert, key = self_signed_cert(tmp)
+        server, url = mock_backend.serve(args.latency_ms / 1000, certfile=cert, keyfile=key)
+        verify = cert or True
+        payload = {"steamId": "login", "amount": 100, "api_login": "bench", "api_key": "bench"}
+
+        bare = lambda u: requests.post(u, json=payload, timeout=20, verify=verify)
+        before = server.connections
+        timings, elapsed = drive(bare, url, args.requests, args.rate, args.workers)
+        report("bare", timings, elapsed, server, before)
+
+        client = OutboundClient(pool_size=args.workers)
+        pooled = lambda u: client.post(u, json=payload, verify=verify)
+        before = server.connections
+        timings, elapsed = drive(pooled, url, args.requests, args.rate, args.workers)
+        report("pooled", timings, elapsed, server, before)
+        print("target stats:", client.stats())
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import io
+import multiprocessing
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from bench import fakes, mock_backend
+from bench.bench_asgi import free_port, wait_for_port
+from bench.bench_rate_limit import start
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Цена хуков профилирования: выключено (нет ADMIN_TOKEN), включено без правил,
+# правило на другой маршрут, и активный профиль cProfile / сэмплер на каждый запрос
+# python -m bench.bench_profiling --requests 2000 --concurrency 16
+# 1) Отдельный процесс: сами хуки профилирования на маршруте без БД — чистая цена на запрос
+# 2) gunicorn: POST /api/operations/qr-code/ со stand-in'ами БД и backend'а
+# 3) Одновременные запросы с X-Profile: cprofile в потоках gthread — второй и следующие уходят в сэмплер,
+#    ни один запрос не падает.
+# В конце — профиль скачивается и читается pstats.Stats, collapsed stacks непустые.
+
+TOKEN = "bench-admin-token"
+ADMIN = {"X-Admin-Token": TOKEN}
+QR_ROUTE = "/api/operations/qr-code/"
+
+# (название, ADMIN_TOKEN, правило или None)
+CONFIGS = (
+    ("disabled", "", None),
+    ("enabled, no rules", TOKEN, None),
+    ("rule on other route", TOKEN, {"route": "/api/order/", "mode": "cprofile"}),
+    ("cprofile every request", TOKEN, {"route": QR_ROUTE, "mode": "cprofile"}),
+    ("sample every request", TOKEN, {"route": QR_ROUTE, "mode": "sample"}),
+)
+
+# Цена хуков в отдельном процессе (PROFILING_* читаются при импорте): тест-клиент Flask шумит на сотни мкс,
+# поэтому вызываем сами хуки профилирования в контексте запроса — то, что Flask добавляет к каждому запросу
+HOOK_COST = """
+import sys, time
+from flask import Flask
+from services.profiling import init_profiling, profiler
+
+app = Flask(__name__)
+init_profiling(app)
+
+@app.route("/api/ping")
+def ping():
+    return "ok"
+
+if sys.argv[2] != "-":
+    profiler.add_rule(sys.argv[2], None, 1.0, "cprofile", 600)
+
+hooks = app.before_request_funcs.get(None, []) + app.teardown_request_funcs.get(None, [])
+response = app.response_class("ok")
+after = app.after_request_funcs.get(None, [])
+count = int(sys.argv[1])
+best = None
+with app.test_request_context("/api/ping", headers={"X-Api-Login": "merchant"}):
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(count):
+            for hook in app.before_request_funcs.get(None, []):
+                hook()
+            for hook in after:
+                hook(response)
+            for hook in app.teardown_request_funcs.get(None, []):
+                hook(None)
+        elapsed = (time.perf_counter() - started) / count
+        best = elapsed if best is None else min(best, elapsed)
+print(len(hooks) + len(after), best * 1e9)
+"""
+
+
+def hook_cost(requests, token, rule_route, directory):
+    env = dict(os.environ, ADMIN_TOKEN=token, PROFILING_DB_PATH=os.path.join(directory, "hooks.sqlite"),
+               PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    out = subprocess.run([sys.executable, "-c", HOOK_COST, str(requests), rule_route or "-"],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    hooks, ns = out.strip().splitlines()[-1].split()
+    return int(hooks), float(ns)
+
+
+# Одновременные профилируемые запросы в одном процессе: все 200, cProfile не больше одного за раз
+CONCURRENT = """
+import collections, sys, threading, time
+from flask import Flask
+from services.profiling import init_profiling, profiler
+
+app = Flask(__name__)
+init_profiling(app)
+
+@app.route("/api/slow")
+def slow():
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+    time.sleep(0.05)
+    return "ok"
+
+threads, per_thread = int(sys.argv[1]), int(sys.argv[2])
+codes = collections.Counter()
+lock = threading.Lock()
+
+def run():
+    client = app.test_client()
+    for _ in range(per_thread):
+        code = client.get("/api/slow", headers={"X-Profile": "cprofile", "X-Admin-Token": sys.argv[3]}).status_code
+        with lock:
+            codes[code] += 1
+
+workers = [threading.Thread(target=run) for _ in range(threads)]
+for worker in workers:
+    worker.start()
+for worker in workers:
+    worker.join()
+
+modes = collections.Counter(profile["mode"] for profile in profiler.list_profiles())
+stats = profiler.stats()
+print(dict(codes), dict(modes), stats["profiled"], stats["cprofile_fallbacks"])
+"""
+
+
+def concurrent_profiles(threads, per_thread, directory):
+    env = dict(os.environ, ADMIN_TOKEN=TOKEN, PROFILING_DB_PATH=os.path.join(directory, "concurrent.sqlite"),
+               PROFILING_RING_SIZE=str(threads * per_thread),
+               PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    out = subprocess.run([sys.executable, "-c", CONCURRENT, str(threads), str(per_thread), TOKEN],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    return out.strip().splitlines()[-1]
+
+
+def run_stand_ins(db_port, backend_port, backend_latency):
+    mock_backend.serve(backend_latency, responder=fakes.second_server_responder(), port=backend_port)
+    serve(PostgrestStub(fakes.seed(f"http://127.0.0.1:{backend_port}/", clients=1000, purchases=0)), port=db_port)
+    threading.Event().wait()
+
+
+def percentile(values, q):
+    values = sorted(values) or [0.0]
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+async def load(base_url, requests, concurrency):
+    latencies, codes = [], {}
+    remaining = list(range(requests))
+
+    async def worker(client):
+        while remaining:
+            i = remaining.pop()
+            started = time.monotonic()
+            resp = await client.post(QR_ROUTE, json={"sum": 100, "client_id": f"c{i % 1000}"}, headers=fakes.API_HEADERS)
+            latencies.append(time.monotonic() - started)
+            codes[resp.status_code] = codes.get(resp.status_code, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return latencies, codes, time.monotonic() - started
+
+
+def check_downloads(base_url):
+    profiles = httpx.get(f"{base_url}/api/profiling/profiles", headers=ADMIN).json()["profiles"]
+    by_mode = {profile["mode"]: profile for profile in profiles}
+    result = []
+
+    if "cprofile" in by_mode:
+        resp = httpx.get(f"{base_url}/api/profiling/profiles/{by_mode['cprofile']['id']}", headers=ADMIN)
+        with tempfile.NamedTemporaryFile(suffix=".pstats") as f:
+            f.write(resp.content)
+            f.flush()
+            stats = pstats.Stats(f.name, stream=io.StringIO())
+        merged = httpx.get(f"{base_url}/api/profiling/profiles/all", params={"format": "pstats", "route": QR_ROUTE},
+                           headers=ADMIN)
+        with tempfile.NamedTemporaryFile(suffix=".pstats") as f:
+            f.write(merged.content)
+            f.flush()
+            total = pstats.Stats(f.name, stream=io.StringIO())
+        result.append(f"pstats: {len(stats.stats)} functions in one profile, {total.total_calls} calls across ring")
+
+    if "sample" in by_mode:
+        text = httpx.get(f"{base_url}/api/profiling/profiles/all", params={"format": "collapsed"}, headers=ADMIN).text
+        lines = text.splitlines()
+        result.append(f"collapsed: {len(lines)} stacks, {sum(int(line.rsplit(' ', 1)[1]) for line in lines)} samples")
+
+    denied = httpx.get(f"{base_url}/api/profiling/profiles", headers={"X-Admin-Token": "wrong"}).status_code
+    result.append(f"{len(profiles)} profiles in ring, wrong token -> {denied}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--hook-requests", type=int, default=100000)
+    parser.add_argument("--backend-latency-ms", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ring-size", type=int, default=50)
+    parser.add_argument("--profile-threads", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"== profiling hooks per request (best of 5 x {args.hook_requests})")
+        for label, token, rule in CONFIGS[:3]:
+            hooks, cost = hook_cost(args.hook_requests, token, rule and rule["route"], directory)
+            print(f"  {label:<22} {hooks} hooks  {cost:8.0f} ns/request")
+
+        print(f"== {args.profile_threads} threads x 10 requests with X-Profile: cprofile (codes, profiles by mode, "
+              f"profiled, fell back to sampler)")
+        print(f"  {concurrent_profiles(args.profile_threads, 10, directory)}")
+
+    db_port, backend_port = free_port(), free_port()
+    stand_ins = multiprocessing.Process(
+        target=run_stand_ins, args=(db_port, backend_port, args.backend_latency_ms / 1000), daemon=True,
+    )
+    stand_ins.start()
+    wait_for_port(db_port)
+    wait_for_port(backend_port)
+
+    print(f"== {args.requests} x POST {QR_ROUTE}, {args.concurrency} concurrent, "
+          f"backend {args.backend_latency_ms:.0f} ms, gunicorn {args.workers}x{args.threads}")
+    base = None
+    for label, token, rule in CONFIGS:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(
+                os.environ,
+                SUPABASE_URL=f"http://127.0.0.1:{db_port}",
+                SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+                RATE_LIMIT_ENABLED="0",
+                LIMITS_DB_PATH=os.path.join(directory, "limits.sqlite"),
+                IDEMPOTENCY_DB_PATH=os.path.join(directory, "idempotency.sqlite"),
+                BACKEND_BULKHEAD_DIR=os.path.join(directory, "bulkheads"),
+                ADMIN_TOKEN=token,
+                PROFILING_DB_PATH=os.path.join(directory, "profiling.sqlite"),
+                PROFILING_RING_SIZE=str(args.ring_size),
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+            )
+            proc, base_url = start(args.workers, args.threads, env)
+            try:
+                if rule:
+                    resp = httpx.post(f"{base_url}/api/profiling/rules", json={**rule, "sample_rate": 1, "duration": 600},
+                                      headers=ADMIN)
+                    assert resp.status_code == 201, resp.text
+                asyncio.run(load(base_url, 100, args.concurrency))  # прогрев
+                latencies, codes, wall = asyncio.run(load(base_url, args.requests, args.concurrency))
+                rps = len(latencies) / wall
+                base = base or rps
+                print(
+                    f"  {label:<22} {rps:7.1f} req/s ({rps / base - 1:+6.1%})  p50 {percentile(latencies, 0.5):6.1f} ms  "
+                    f"p99 {percentile(latencies, 0.99):6.1f} ms  codes {codes}"
+                )
+                if rule and rule["route"] == QR_ROUTE:
+                    for line in check_downloads(base_url):
+                        print(f"    {line}")
+            finally:
+                proc.terminate()
+                proc.wait()
+
+    stand_ins.terminate()
+
+
+if __name__ == "__main__":
+    main()
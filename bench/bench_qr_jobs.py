@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import httpx
+
+from bench import fakes, mock_backend
+from bench.bench_asgi import free_port, wait_for_port
+from bench.bench_rate_limit import start
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 /qr-code синхронно против Prefer: respond-async (202 + задание в очереди)
+# python -m bench.bench_qr_jobs --orders 400 --concurrency 64 --backend-latency-ms 500
+# Синхронно ответ ждёт backend; асинхронно — только проверку и резерв лимита,
+# а результат мерчант забирает опросом GET /qr-jobs/<id>. Часть заказов — от новых клиентов (выдача логина).
+# --fail-every N: backend отвечает 502 на каждый N-й вызов. Запрос до backend'а дошёл (QR мог быть создан),
+# поэтому задание не повторяется, а завершается failed с откатом резерва; повторяются только вызовы,
+# которые в сеть не ушли (предохранитель, bulkhead, соединение не установлено).
+
+ASYNC_HEADERS = {**fakes.API_HEADERS, "Prefer": "respond-async"}
+
+
+def flaky_responder(fail_every):
+    respond = fakes.second_server_responder()
+    calls = itertools.count(1)
+
+    def responder(method, path, body):
+        if fail_every and next(calls) % fail_every == 0:
+            return 502, {"error": "bad gateway"}
+        return respond(method, path, body)
+
+    return responder
+
+
+def run_stand_ins(db_port, backend_port, backend_latency, fail_every):
+    mock_backend.serve(backend_latency, responder=flaky_responder(fail_every), port=backend_port)
+    serve(PostgrestStub(fakes.seed(f"http://127.0.0.1:{backend_port}/", clients=1000, purchases=0)), port=db_port)
+    threading.Event().wait()
+
+
+def percentile(values, q):
+    values = sorted(values) or [0.0]
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+
+def orders(count, new_share):
+    every = round(1 / new_share) if new_share else 0
+    return [
+        {"sum": 100, "client_id": f"new{i}" if every and i % every == 0 else f"c{i % 1000}"}
+        for i in range(count)
+    ]
+
+
+async def run_sync(client, batch, concurrency):
+    latencies, codes = [], {}
+    queue = list(batch)
+
+    async def worker():
+        while queue:
+            order = queue.pop()
+            started = time.monotonic()
+            resp = await client.post("/api/operations/qr-code/", json=order, headers=fakes.API_HEADERS)
+            latencies.append(time.monotonic() - started)
+            codes[resp.status_code] = codes.get(resp.status_code, 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, latencies, codes, 0
+
+
+async def run_async(client, batch, concurrency, poll_interval):
+    accepted, completed, codes = [], [], {}
+    retried = 0
+    queue = list(batch)
+
+    async def worker():
+        nonlocal retried
+        while queue:
+            order = queue.pop()
+            started = time.monotonic()
+            resp = await client.post("/api/operations/qr-code/", json=order, headers=ASYNC_HEADERS)
+            accepted.append(time.monotonic() - started)
+            if resp.status_code != 202:
+                codes[resp.status_code] = codes.get(resp.status_code, 0) + 1
+                continue
+
+            # Мерчант опрашивает задание до результата
+            status_url = resp.headers["Location"]
+            while True:
+                await asyncio.sleep(poll_interval)
+                job = (await client.get(status_url, headers=fakes.API_HEADERS)).json()
+                if job["status"] in ("done", "failed"):
+                    break
+            completed.append(time.monotonic() - started)
+            key = 200 if job["status"] == "done" else job["status"]
+            codes[key] = codes.get(key, 0) + 1
+            retried += job["attempts"] > 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return accepted, completed, codes, retried
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--backend-latency-ms", type=float, default=500)
+    parser.add_argument("--new-share", type=float, default=0.2, help="доля заказов от новых клиентов")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--job-concurrency", type=int, default=16, help="QR_JOBS_CONCURRENCY на воркер")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+
+    db_port, backend_port = free_port(), free_port()
+    stand_ins = multiprocessing.Process(
+        target=run_stand_ins,
+        args=(db_port, backend_port, args.backend_latency_ms / 1000, args.fail_every),
+        daemon=True,
+    )
+    stand_ins.start()
+    wait_for_port(db_port)
+    wait_for_port(backend_port)
+
+    print(
+        f"== {args.orders} orders, {args.concurrency} concurrent, backend {args.backend_latency_ms:.0f} ms, "
+        f"{args.new_share:.0%} new clients, gunicorn {args.workers}x{args.threads}"
+        + (f", backend 502 every {args.fail_every} calls" if args.fail_every else "")
+    )
+    runners = (("sync", run_sync), ("async", functools.partial(run_async, poll_interval=args.poll_interval)))
+    for label, runner in runners:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(
+                os.environ,
+                SUPABASE_URL=f"http://127.0.0.1:{db_port}",
+                SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+                RATE_LIMIT_ENABLED="0",
+                LIMITS_DB_PATH=os.path.join(directory, "limits.sqlite"),
+                IDEMPOTENCY_DB_PATH=os.path.join(directory, "idempotency.sqlite"),
+                BACKEND_BULKHEAD_DIR=os.path.join(directory, "bulkheads"),
+                QR_JOBS_MODE="prefer",
+                QR_JOBS_DB_PATH=os.path.join(directory, "qr-jobs.sqlite"),
+                QR_JOBS_CONCURRENCY=str(args.job_concurrency),
+                QR_JOBS_RETRY_DELAY="0.2",
+                # Сбои по расписанию — не повод открывать предохранитель
+                BACKEND_BREAKER_MIN_CALLS="1000000",
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+            )
+            proc, base_url = start(args.workers, args.threads, env)
+            try:
+                limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+                # Новые клиенты в каждом прогоне свои: префикс не пересекается с прошлым прогоном
+                batch = [dict(order, client_id=f"{label}-{order['client_id']}") if order["client_id"].startswith("new")
+                         else order for order in orders(args.orders, args.new_share)]
+
+                async def measure():
+                    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+                        started = time.monotonic()
+                        result = await runner(client, batch, args.concurrency)
+                        return result, time.monotonic() - started
+
+                (accepted, completed, codes, retried), wall = asyncio.run(measure())
+            finally:
+                proc.terminate()
+                proc.wait()
+
+        done = codes.get(200, 0)
+        print(
+            f"  {label:<5} response p50 {percentile(accepted, 0.5):7.1f} ms  p99 {percentile(accepted, 0.99):7.1f} ms | "
+            f"QR ready p50 {percentile(completed, 0.5):7.1f} ms  p99 {percentile(completed, 0.99):7.1f} ms | "
+            f"{done / wall:6.1f} QR/s  codes {dict(sorted(codes.items(), key=str))}"
+            + (f"  retried {retried}" if label == "async" else "")
+        )
+
+    stand_ins.terminate()
+
+
+if __name__ == "__main__":
+    main()
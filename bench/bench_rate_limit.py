@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench import fakes, mock_backend
+from bench.bench_asgi import ROOT, free_port, wait_for_port
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Лимит частоты общий для воркеров и отказ до запросов в БД
+# python -m bench.bench_rate_limit --workers 2 --rate 20 --duration 5
+# 1) один api_login заваливает /qr-status: допущено ≈ burst + rate * duration на все воркеры, отказы не ходят в БД;
+#    второй мерчант в это время не получает ни одного 429;
+# 2) потолок одновременных запросов: медленный backend, лишние /qr-code сразу получают 503.
+
+OTHER_HEADERS = {"X-Api-Login": "other", "X-Api-Key": "other-key"}
+
+
+async def flood(base_url, method, path, headers, concurrency, duration, pause=0.0, **kwargs):
+    counts, latencies = {}, {}
+    deadline = time.monotonic() + duration
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, headers=headers,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+
+        async def worker():
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                resp = await client.request(method, path, **kwargs)
+                counts[resp.status_code] = counts.get(resp.status_code, 0) + 1
+                latencies.setdefault(resp.status_code, []).append(time.monotonic() - started)
+                if pause:
+                    await asyncio.sleep(pause)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    p50 = {status: sorted(values)[len(values) // 2] * 1000 for status, values in latencies.items()}
+    return counts, p50
+
+
+def start(workers, threads, env):
+    # Нагрузка от одного мерчанта: bulkhead backend'а (четверть потоков) не должен её резать —
+    # изоляцию мерчантов меряет bench_breaker
+    env = dict(env)
+    env.setdefault("BACKEND_MAX_CONCURRENCY", str(workers * threads))
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-k", "gthread", "-w", str(workers), "--threads", str(threads),
+         "-b", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for_port(port)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=20, help="токенов в секунду на /qr-status")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    backend, backend_url = mock_backend.serve(1.0, responder=fakes.second_server_responder())
+    tables = fakes.seed(backend_url, clients=100, purchases=100)
+    tables["api_clients"].append(
+        {"id": 2, "api_login": "other", "api_key": "other-key", "second_server_url": backend_url, "test": False}
+    )
+    tables["purchases"].append({"id": "other-op", "api_login": "other", "status": "pending", "commit": None})
+    stub = PostgrestStub(tables, latency=0.005)
+    server, url = serve(stub)
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            SUPABASE_URL=url,
+            SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+            RATE_LIMIT_DB_PATH=os.path.join(directory, "rate.sqlite"),
+            LIMITS_DB_PATH=os.path.join(directory, "limits.sqlite"),
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+            RATE_LIMITS=f"/api/operations/<opId>/qr-status={args.rate}:{args.rate}",
+            CREDENTIALS_CACHE_TTL="0",
+            STATUS_CACHE_TERMINAL_TTL="0",
+            STATUS_CACHE_PENDING_TTL="0",
+        )
+
+        # =============== 1️⃣ Лимит частоты на весь хост ===============
+        proc, base_url = start(args.workers, args.threads, env)
+        try:
+            db_before = stub.requests
+
+            async def both():
+                return await asyncio.gather(
+                    flood(base_url, "GET", "/api/operations/op1/qr-status", fakes.API_HEADERS, args.concurrency, args.duration),
+                    flood(base_url, "GET", "/api/operations/other-op/qr-status", OTHER_HEADERS, 1, args.duration, pause=0.1),
+                )
+
+            (counts, p50), (other_counts, _) = asyncio.run(both())
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        allowed = counts.get(200, 0)
+        expected = args.rate + args.rate * args.duration
+        print(
+            f"flood  {args.workers} workers: {sum(counts.values())} requests, admitted {allowed} "
+            f"(bucket allows ≈ {expected:.0f}), 429: {counts.get(429, 0)} (p50 {p50.get(429, 0):.1f} ms, "
+            f"admitted p50 {p50.get(200, 0):.1f} ms)"
+        )
+        print(
+            f"       DB requests {stub.requests - db_before} for {allowed + sum(other_counts.values())} admitted requests "
+            f"(caches off); other merchant: {other_counts}"
+        )
+
+        # =============== 2️⃣ Потолок одновременных запросов ===============
+        cap = 2
+        proc, base_url = start(1, args.threads, dict(env, ADMISSION_MAX_IN_FLIGHT=str(cap)))
+        try:
+            counts, p50 = asyncio.run(flood(
+                base_url, "POST", "/api/operations/qr-code/", fakes.API_HEADERS, args.concurrency, args.duration,
+                json={"sum": 100, "client_id": "c1"},
+            ))
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(
+            f"shed   1 worker, {args.threads} threads, cap {cap}, backend 1 s: 200: {counts.get(200, 0)} "
+            f"(p50 {p50.get(200, 0):.0f} ms), 503: {counts.get(503, 0)} (p50 {p50.get(503, 0):.1f} ms), "
+            f"429: {counts.get(429, 0)}"
+        )
+
+    server.shutdown()
+    backend.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import httpx
+
+from bench import mock_backend
+from bench.bench_asgi import free_port, wait_for_port
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Сверка зависших pending-покупок: 100k строк, фейковый Birs
+# python -m bench.bench_reconciler --rows 100000 --rate 5000 --concurrency 8 [--trace-memory]
+# Каждая 4-я покупка у провайдера ещё pending, остальные settlement/failed/expired.
+# Память — одна страница keyset-выборки, сколько бы строк ни было.
+
+PROVIDER_STATUSES = ["settlement", "failed", "expired", "pending"]
+EXPECTED = {"settlement": "success", "failed": "cancelled", "expired": "cancelled", "pending": "pending"}
+
+
+def provider_status(payment_id):
+    return PROVIDER_STATUSES[int(payment_id[1:]) % 4]
+
+
+def provider_responder(method, path, body):
+    payment_id = path.rstrip("/").rsplit("/", 1)[-1]
+    return 200, {"success": True, "data": {"id": payment_id, "status": provider_status(payment_id)}}
+
+
+def run_stand_ins(db_port, provider_port, rows, provider_latency):
+    mock_backend.serve(provider_latency, responder=provider_responder, port=provider_port)
+    # Все строки pending уже час — старше порога сверки, моложе RECONCILE_MAX_AGE
+    created_at = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+    purchases = [
+        {"id": f"p{i:07d}", "api_login": "bench", "status": "pending", "commit": None, "created_at": created_at}
+        for i in range(rows)
+    ]
+    serve(PostgrestStub({"purchases": purchases}), port=db_port)
+    threading.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--page-size", type=int, default=2000)
+    parser.add_argument("--update-chunk", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=5000, help="запросов к провайдеру в секунду")
+    parser.add_argument("--provider-latency-ms", type=float, default=2)
+    parser.add_argument("--trace-memory", action="store_true", help="пик Python-аллокаций (tracemalloc, в разы медленнее)")
+    args = parser.parse_args()
+
+    db_port, provider_port = free_port(), free_port()
+    stand_ins = multiprocessing.Process(
+        target=run_stand_ins, args=(db_port, provider_port, args.rows, args.provider_latency_ms / 1000), daemon=True,
+    )
+    stand_ins.start()
+    wait_for_port(db_port)
+    wait_for_port(provider_port)
+
+    db_url = f"http://127.0.0.1:{db_port}"
+    os.environ.update(SUPABASE_URL=db_url, SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY)
+
+    from services.reconciler import Reconciler
+    from services.supabase_client import SupabaseRegistry
+
+    supabase = SupabaseRegistry().client
+    reconciler = Reconciler(
+        page_size=args.page_size, concurrency=args.concurrency, rate=args.rate, update_chunk=args.update_chunk,
+        status_url=f"http://127.0.0.1:{provider_port}/payment/{{id}}",
+    )
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    summary = reconciler.run_once(supabase)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Проверка: каждая строка получила статус по той же таблице, что у webhook
+    rows = httpx.get(f"{db_url}/rest/v1/purchases", params={"select": "id,status"}, timeout=60).json()
+    wrong = [row for row in rows if row["status"] != EXPECTED[provider_status(row["id"])]]
+    stats = reconciler.stats()
+
+    print(
+        f"{args.rows} pending rows: scanned {summary['scanned']}, updated {summary['updated']}, "
+        f"still pending {stats['still_pending']}, errors {stats['errors']}, wrong statuses {len(wrong)}"
+    )
+    traced = f", traced peak {peak / 1024 / 1024:.1f} MiB" if peak is not None else ""
+    print(
+        f"time {elapsed:.1f} s ({summary['scanned'] / elapsed:.0f} rows/s, rate cap {args.rate:.0f}/s), "
+        f"max RSS growth {(rss_after - rss_before) / 1024:.1f} MiB{traced} "
+        f"(page {args.page_size}, concurrency {args.concurrency})"
+    )
+
+    stand_ins.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from bench import fakes
+from bench.bench_rate_limit import start
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Тестовый режим мерчанта: /api/test + /qr-status + webhook — запросы в БД и задержка
+# python -m bench.bench_sandbox --orders 300 --db-latency-ms 5
+# host-local — sandbox в /dev/shm (общий для воркеров одного хоста), table — purchases_test в Supabase
+
+TEST_HEADERS = {"X-Api-Login": "sandbox", "X-Api-Key": "sandbox-key"}
+
+
+async def merchant_flow(base_url, orders, polls, concurrency):
+    timings = {"create": [], "status": [], "webhook": []}
+    statuses = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=httpx.Limits(max_connections=concurrency)) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(kind, method, path, **kwargs):
+            async with semaphore:
+                started = time.perf_counter()
+                resp = await client.request(method, path, **kwargs)
+                timings[kind].append(time.perf_counter() - started)
+                return resp
+
+        async def one(n):
+            resp = await timed("create", "POST", "/api/test/", json={
+                "steamId": f"steam{n}", "amount": 10000, "api_login": "sandbox", "api_key": "sandbox-key",
+            })
+            op_id = resp.json()["result"]["operation_id"]
+            for _ in range(polls):
+                resp = await timed("status", "GET", f"/api/operations/{op_id}/qr-status", headers=TEST_HEADERS)
+            if n % 2:
+                await timed("webhook", "POST", "/api/webhook/", json={"id": op_id, "status": "settlement"})
+                resp = await timed("status", "GET", f"/api/operations/{op_id}/qr-status", headers=TEST_HEADERS)
+            statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+        await asyncio.gather(*(one(n) for n in range(orders)))
+
+    p50 = {kind: sorted(values)[len(values) // 2] * 1000 if values else 0 for kind, values in timings.items()}
+    return p50, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--orders", type=int, default=300)
+    parser.add_argument("--polls", type=int, default=3, help="/qr-status на каждую покупку")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    tables = fakes.seed("http://127.0.0.1:9/", clients=0, purchases=0, logins=0)
+    tables["api_clients"].append(
+        {"id": 2, "api_login": "sandbox", "api_key": "sandbox-key", "second_server_url": None, "test": True}
+    )
+    stub = PostgrestStub(tables, latency=args.db_latency_ms / 1000)
+    server, url = serve(stub)
+
+    for backend in ("table", "host-local"):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(
+                os.environ,
+                SUPABASE_URL=url,
+                SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+                RATE_LIMIT_ENABLED="0",
+                SANDBOX_BACKEND=backend,
+                SANDBOX_DB_PATH=os.path.join(directory, "sandbox.sqlite"),
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+                # Кэш статусов не прячет запросы table-режима в БД
+                STATUS_CACHE_PENDING_TTL="0",
+                STATUS_CACHE_TERMINAL_TTL="0",
+            )
+            proc, base_url = start(args.workers, args.threads, env)
+            try:
+                db_before = stub.requests
+                started = time.perf_counter()
+                p50, statuses = asyncio.run(merchant_flow(base_url, args.orders, args.polls, args.concurrency))
+                elapsed = time.perf_counter() - started
+            finally:
+                proc.terminate()
+                proc.wait()
+
+        # api_clients читаются и для тестовых клиентов — это не sandbox-трафик
+        print(
+            f"{backend:<10} {args.orders} orders in {elapsed:.2f} s, DB requests {stub.requests - db_before}, "
+            f"purchases_test rows {len(stub.tables['purchases_test'])}; p50 create {p50['create']:.1f} ms, "
+            f"status {p50['status']:.1f} ms, webhook {p50['webhook']:.1f} ms; final status codes {statuses}"
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# ⏱ Время импорта app и первого запроса в свежем процессе (python -m bench.bench_startup)
+
+CHILD = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+resp = client.post("/api/operations/qr-code/", headers={"X-Api-Login": "nobody", "X-Api-Key": "bad"}, json={})
+first = time.perf_counter()
+resp = client.post("/api/operations/qr-code/", headers={"X-Api-Login": "nobody", "X-Api-Key": "bad2"}, json={})
+second = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "first_request_ms": (first - imported) * 1000,
+                  "second_request_ms": (second - first) * 1000, "status": resp.status_code}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    server, url = serve(PostgrestStub({"api_clients": []}))
+    env = dict(os.environ, SUPABASE_URL=url, SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    results = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", CHILD], cwd=root, env=env, capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    for key in ("import_ms", "first_request_ms", "second_request_ms"):
+        values = [r[key] for r in results]
+        print(f"{key:<18} median={statistics.median(values):.1f}ms min={min(values):.1f}ms max={max(values):.1f}ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import os
+import threading
+import time
+import tracemalloc
+
+import httpx
+
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+from services.status_hub import StatusHub
+
+# 📊 10k одновременных наблюдателей за статусами (python -m bench.bench_status_hub)
+# 1) сам hub: 10k long-poll ожиданий, публикация из стороннего потока (как Flask-webhook);
+# 2) весь путь через ASGI: 10k запросов ?wait=N на сотню opId + webhook'и по ним.
+
+
+async def hub_only(watchers):
+    hub = StatusHub()
+    hub.bind(asyncio.get_running_loop())
+
+    tracemalloc.start()
+    woken = []
+
+    async def watcher(i):
+        queue = hub.subscribe("purchases", [f"op{i}"])
+        try:
+            purchase = await asyncio.wait_for(queue.get(), 30)
+            woken.append(time.perf_counter() - purchase["published_at"])
+        finally:
+            hub.unsubscribe("purchases", [f"op{i}"], queue)
+
+    tasks = [asyncio.create_task(watcher(i)) for i in range(watchers)]
+    await asyncio.sleep(0.1)
+    memory, _ = tracemalloc.get_traced_memory()
+
+    def publisher():
+        for i in range(watchers):
+            hub.publish("purchases", {"id": f"op{i}", "status": "success", "published_at": time.perf_counter()})
+
+    started = time.perf_counter()
+    threading.Thread(target=publisher).start()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    tracemalloc.stop()
+
+    woken.sort()
+    print(
+        f"hub:  {watchers} watchers, {memory / watchers:.0f} B/watcher, all woken in {elapsed:.2f}s, "
+        f"wake latency p50={woken[len(woken) // 2] * 1000:.1f}ms p99={woken[int(len(woken) * 0.99)] * 1000:.1f}ms"
+    )
+    assert len(woken) == watchers and hub.stats()["watched_ids"] == 0
+
+
+async def end_to_end(watchers, ops):
+    import asgi
+
+    headers = {"X-Api-Login": "bench", "X-Api-Key": "bench-key"}
+    transport = httpx.ASGITransport(app=asgi.app)
+    async with asgi.lifespan(asgi.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            polls = [
+                asyncio.create_task(client.get(f"/api/operations/op{i % ops}/qr-status", params={"wait": 30}, headers=headers))
+                for i in range(watchers)
+            ]
+            while asgi.status_hub.stats()["subscriptions"] < watchers:
+                await asyncio.sleep(0.2)
+
+            started = time.perf_counter()
+            for i in range(ops):
+                await client.post("/api/webhook/", json={"id": f"op{i}", "status": "settlement"})
+            responses = await asyncio.gather(*polls)
+            elapsed = time.perf_counter() - started
+
+    settled = sum(1 for r in responses if r.status_code == 200 and r.json()["results"]["operation_status_code"] == 5)
+    print(f"asgi: {watchers} long-polls on {ops} opIds, {settled} settled, all answered {elapsed:.2f}s after first webhook")
+    assert settled == watchers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--watchers", type=int, default=10000)
+    parser.add_argument("--ops", type=int, default=100)
+    args = parser.parse_args()
+
+    asyncio.run(hub_only(args.watchers))
+
+    stub = PostgrestStub({
+        "api_clients": [{"id": 1, "api_login": "bench", "api_key": "bench-key", "second_server_url": "", "test": False}],
+        "purchases": [{"id": f"op{i}", "api_login": "bench", "status": "pending", "commit": None} for i in range(args.ops)],
+    })
+    server, url = serve(stub)
+    os.environ.update(SUPABASE_URL=url, SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY, RATE_LIMIT_ENABLED="0")
+    asyncio.run(end_to_end(args.watchers, args.ops))
+    print(f"db:   {stub.requests} PostgREST requests for {args.watchers} watchers")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
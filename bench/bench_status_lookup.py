@@ -0,0 +1,131 @@
+import argparse
+import os
+import tempfile
+import time
+
+import httpx
+
+from bench import fakes
+from bench.bench_asgi import free_port, start_server
+from bench.bench_rate_limit import start
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 /qr-status без кэшей: три последовательных запроса к БД против одного вызова qr_status_lookup
+# python -m bench.bench_status_lookup --polls 300 --db-latency-ms 5 [--asgi]
+# Задержка заглушки — сетевой RTT до PostgREST; кэши выключены, каждый опрос "холодный".
+
+CLIENT_COLUMNS = ("id", "api_login", "api_key", "second_server_url", "test")
+PURCHASE_COLUMNS = ("id", "status", "commit", "api_login")
+
+OTHER = {"id": 2, "api_login": "other", "api_key": "other-key", "second_server_url": None, "test": False}
+
+# Ожидаемые коды: одинаковые в обоих режимах
+CASES = [
+    ("no credentials", {}, "op1", 400),
+    ("unknown key", {"X-Api-Key": "nope"}, "op1", 401),
+    ("wrong pair", {"X-Api-Login": fakes.API_LOGIN, "X-Api-Key": "nope"}, "op1", 403),
+    ("login only", {"X-Api-Login": fakes.API_LOGIN}, "op1", 403),
+    ("no purchase", fakes.API_HEADERS, "missing-op", 404),
+    ("foreign purchase", fakes.API_HEADERS, "other-op", 404),
+    ("login + key", fakes.API_HEADERS, "op1", 200),
+    ("key only", {"X-Api-Key": fakes.API_KEY}, "op1", 200),
+]
+
+
+# 🐘 То же, что sql/qr_status_lookup.sql, над таблицами заглушки
+def qr_status_lookup(stub, params):
+    api_login, api_key = params.get("p_api_login"), params.get("p_api_key")
+
+    def result(error=None, client=None, purchase=None):
+        return [{"error": error, "client": client, "purchase": purchase}]
+
+    if api_login is None and api_key is None:
+        return result("missing_credentials")
+
+    clients = stub.tables["api_clients"]
+    if api_login is None:
+        client = next((c for c in clients if c["api_key"] == api_key), None)
+        if client is None:
+            return result("invalid_key")
+    else:
+        client = next((c for c in clients if c["api_login"] == api_login and c["api_key"] == api_key), None)
+        if client is None:
+            return result("forbidden")
+
+    purchase = None
+    if not client.get("test") or params.get("p_read_test", True):
+        table = "purchases_test" if client.get("test") else "purchases"
+        row = next((p for p in stub.tables.get(table, []) if str(p["id"]) == params["p_op_id"]), None)
+        purchase = {column: row.get(column) for column in PURCHASE_COLUMNS} if row else None
+    return result(client={column: client.get(column) for column in CLIENT_COLUMNS}, purchase=purchase)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--polls", type=int, default=300)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    parser.add_argument("--asgi", action="store_true", help="uvicorn asgi:app вместо gunicorn app:app")
+    args = parser.parse_args()
+
+    tables = fakes.seed("http://127.0.0.1:9/", clients=0, purchases=1000, logins=0)
+    tables["api_clients"].append(OTHER)
+    tables["purchases"].append({"id": "other-op", "api_login": "other", "status": "pending", "commit": None})
+    stub = PostgrestStub(tables, latency=args.db_latency_ms / 1000, functions={"qr_status_lookup": qr_status_lookup})
+    server, url = serve(stub)
+
+    for label, rpc in (("3 calls", "0"), ("rpc", "1")):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(
+                os.environ,
+                SUPABASE_URL=url,
+                SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+                RATE_LIMIT_ENABLED="0",
+                STATUS_LOOKUP_RPC=rpc,
+                CREDENTIALS_CACHE_TTL="0",
+                CREDENTIALS_NEGATIVE_TTL="0",
+                STATUS_CACHE_PENDING_TTL="0",
+                STATUS_CACHE_TERMINAL_TTL="0",
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+            )
+            if args.asgi:
+                # Каталог метрик создаёт gunicorn.conf.py, uvicorn — нет
+                os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+                port = free_port()
+                proc, base_url = start_server("asgi", port, 1, env), f"http://127.0.0.1:{port}"
+            else:
+                proc, base_url = start(1, 4, env)
+            try:
+                with httpx.Client(base_url=base_url, timeout=30) as client:
+                    mismatched = []
+                    for name, headers, op_id, expected in CASES:
+                        resp = client.get(f"/api/operations/{op_id}/qr-status", headers=headers)
+                        if resp.status_code != expected:
+                            mismatched.append(f"{name}: {resp.status_code} {resp.text.strip()}")
+
+                    lines = []
+                    for name, headers in (("login + key", fakes.API_HEADERS), ("key only", {"X-Api-Key": fakes.API_KEY})):
+                        latencies, db_before = [], stub.requests
+                        for i in range(args.polls):
+                            started = time.perf_counter()
+                            resp = client.get(f"/api/operations/op{i % 1000}/qr-status", headers=headers)
+                            latencies.append(time.perf_counter() - started)
+                            assert resp.status_code == 200, resp.text
+                        latencies.sort()
+                        lines.append(
+                            f"  {name:<12} p50 {latencies[len(latencies) // 2] * 1000:6.1f} ms  "
+                            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.1f} ms  "
+                            f"DB requests/poll {(stub.requests - db_before) / args.polls:.1f}"
+                        )
+            finally:
+                proc.terminate()
+                proc.wait()
+
+        print(f"== {label} ({'asgi' if args.asgi else 'wsgi'}, DB RTT {args.db_latency_ms:.0f} ms, caches off)")
+        print("\n".join(lines))
+        print(f"  error semantics: {'same as before' if not mismatched else mismatched}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
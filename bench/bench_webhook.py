@@ -0,0 +1,68 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench.postgrest_stub import FAKE_SERVICE_KEY, PostgrestStub, serve
+
+# 📊 Пропускная способность webhook: синхронный UPDATE против пакетного режима
+# python -m bench.bench_webhook --events 2000
+
+
+def run(client, stub, events, batch):
+    from services.webhook_queue import webhook_queue
+
+    webhook_queue.enabled = batch
+    requests_before = stub.requests
+
+    started = time.perf_counter()
+    for payment_id, status in events:
+        client.post("/api/webhook/", json={"id": payment_id, "status": status})
+    acked = time.perf_counter() - started
+
+    if batch:
+        webhook_queue.flush()
+    done = time.perf_counter() - started
+
+    print(
+        f"{'batch' if batch else 'sync':<6} ack {len(events) / acked:8.1f} ev/s  "
+        f"applied in {done:.2f}s  DB requests={stub.requests - requests_before}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--purchases", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    stub = PostgrestStub(
+        {"purchases": [{"id": f"p{i}", "status": "pending"} for i in range(args.purchases)]},
+        latency=args.latency_ms / 1000,
+    )
+    server, url = serve(stub)
+
+    with tempfile.TemporaryDirectory() as queue_dir:
+        os.environ.update(SUPABASE_URL=url, SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY, WEBHOOK_QUEUE_DIR=queue_dir)
+        from app import app
+        from services.webhook_queue import webhook_queue
+
+        webhook_queue.directory = queue_dir
+        client = app.test_client()
+
+        # Повторы и "чужие" id, как при реальных пачках от провайдера
+        events = [
+            (f"p{random.randrange(int(args.purchases * 1.05))}", random.choice(["settlement", "failed", "expired"]))
+            for _ in range(args.events)
+        ]
+        run(client, stub, events, batch=False)
+        run(client, stub, events, batch=True)
+        print("queue stats:", webhook_queue.stats())
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import itertools
+import threading
+import uuid
+
+from bench import mock_backend
+from bench.postgrest_stub import PostgrestStub, serve
+
+# 🧪 Локальные заменители внешних сервисов для нагрузочных прогонов:
+# PostgREST (api_clients / clients / available_logins / purchases), Birs и second_server_url
+
+API_LOGIN = "bench"
+API_KEY = "bench-key"
+API_HEADERS = {"X-Api-Login": API_LOGIN, "X-Api-Key": API_KEY}
+
+
+def seed(second_server_url, clients=1000, purchases=1000, logins=20000):
+    return {
+        "api_clients": [
+            {"id": 1, "api_login": API_LOGIN, "api_key": API_KEY, "second_server_url": second_server_url, "test": False},
+        ],
+        "clients": [
+            {
+                "id": i, "client_id": f"c{i}", "api_login": API_LOGIN, "steam_login": f"seeded{i}",
+                "total_amount": 0, "period_amount": 0,
+            }
+            for i in range(clients)
+        ],
+        "available_logins": [{"login": f"login{i}", "used": False} for i in range(logins)],
+        "purchases": [
+            {"id": f"op{i}", "api_login": API_LOGIN, "status": "pending", "commit": None} for i in range(purchases)
+        ],
+        "purchases_test": [],
+    }
+
+
+# 💳 Birs: create-link-payment отвечает как настоящий API
+def birs_responder(method, path, body):
+    payment_id = str(uuid.uuid4())
+    return 200, {"success": True, "data": {"id": payment_id, "payment_url": f"https://pay.example/{payment_id}"}}
+
+
+# 🖥 second_server_url мерчанта: каждый QR со своим operation_id
+def second_server_responder():
+    counter = itertools.count()
+
+    def respond(method, path, body):
+        n = next(counter)
+        return 200, {"result": {"operation_id": f"qr-op{n}", "qr_id": f"qr{n}", "qr_payload": f"https://qr.example/{n}"}}
+
+    return respond
+
+
+# 🚀 Все заменители в одном процессе (цель multiprocessing.Process), чтобы не делить GIL с нагрузкой
+def run(db_port, birs_port, second_port, db_latency=0.0, birs_latency=0.0, second_latency=0.0,
+        clients=1000, purchases=1000):
+    mock_backend.serve(birs_latency, responder=birs_responder, port=birs_port)
+    mock_backend.serve(second_latency, responder=second_server_responder(), port=second_port)
+    stub = PostgrestStub(
+        seed(f"http://127.0.0.1:{second_port}/", clients=clients, purchases=purchases),
+        latency=db_latency,
+    )
+    serve(stub, port=db_port)
+    threading.Event().wait()
@@ -0,0 +1,69 @@
+import json
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 🧪 Заглушка внешнего backend'а (second_server_url / Birs) с настраиваемой задержкой
+
+
+class CountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+        self.requests = 0
+        self.counter_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self.counter_lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+
+def _make_handler(latency, responder):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self):
+            with self.server.counter_lock:
+                self.server.requests += 1
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            if latency:
+                time.sleep(latency)
+
+            status, payload = responder(self.command, self.path, body)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = _reply
+        do_POST = _reply
+
+    return Handler
+
+
+def default_responder(method, path, body):
+    return 200, {"result": {"operation_id": "op-1", "qr_id": "qr-1", "qr_payload": "https://qr.example/1"}}
+
+
+# 🚀 Запуск в фоне; certfile/keyfile включают TLS
+def serve(latency=0.0, responder=default_responder, certfile=None, keyfile=None, host="127.0.0.1", port=0):
+    server = CountingServer((host, port), _make_handler(latency, responder))
+    scheme = "http"
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://{host}:{server.server_address[1]}"
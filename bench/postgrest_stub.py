@@ -0,0 +1,254 @@
+import functools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# 🧪 Минимальная in-memory замена PostgREST для бенчмарков.
+# Понимает то подмножество запросов, которое шлёт supabase-py из наших маршрутов.
+
+OBJECT_MIME = "application/vnd.pgrst.object+json"
+
+
+def _parse_value(raw):
+    if raw == "null":
+        return None
+    if raw == "true":
+        return True
+    if raw == "false":
+        return False
+    return raw
+
+
+def _compare(value, raw):
+    # В запросе всё строки — сравниваем как числа, если получится
+    try:
+        return float(value), float(raw)
+    except (TypeError, ValueError):
+        return str(value), str(raw)
+
+
+# Список из in.(...) разбираем один раз на запрос, а не на каждую строку
+@functools.lru_cache(maxsize=64)
+def _in_items(raw):
+    return frozenset(item.strip('"') for item in raw.strip("()").split(",") if item)
+
+
+# Части or=(...)/and(...) через запятую верхнего уровня; запятые в кавычках и скобках не делят
+def _split_top(raw):
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(raw):
+        if char == '"' and raw[i - 1:i] != "\\":
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and char == "," and depth == 0:
+            parts.append(raw[start:i])
+            start = i + 1
+    parts.append(raw[start:])
+    return parts
+
+
+def _condition(row, part):
+    if part.startswith(("or(", "and(")):
+        op, _, rest = part.partition("(")
+        return _logic(row, op, "(" + rest)
+    column, _, expr = part.partition(".")
+    op, _, raw = expr.partition(".")
+    if raw.startswith('"') and raw.endswith('"'):
+        raw = raw[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return _matches(row, column, f"{op}.{raw}")
+
+
+# 🌳 Логические фильтры PostgREST: or=(a.gt.1,and(b.eq.2,c.gt.3))
+def _logic(row, op, raw):
+    results = (_condition(row, part) for part in _split_top(raw[1:-1]))
+    return any(results) if op == "or" else all(results)
+
+
+def _matches(row, column, expr):
+    if column in ("or", "and"):
+        return _logic(row, column, expr)
+    op, _, raw = expr.partition(".")
+    value = row.get(column)
+
+    if op == "eq":
+        target = _parse_value(raw)
+        if isinstance(target, bool) or target is None:
+            return value == target
+        return str(value) == raw
+    if op == "neq":
+        return str(value) != raw
+    if op == "is":
+        return value is _parse_value(raw)
+    if op == "in":
+        return str(value) in _in_items(raw)
+    if op in ("gt", "gte", "lt", "lte"):
+        if value is None:
+            return False
+        a, b = _compare(value, raw)
+        return {"gt": a > b, "gte": a >= b, "lt": a < b, "lte": a <= b}[op]
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class PostgrestStub:
+    def __init__(self, tables=None, latency=0.0, primary_keys=None, functions=None):
+        self.tables = {name: list(rows) for name, rows in (tables or {}).items()}
+        self.primary_keys = primary_keys or {}
+        # POST /rpc/<name>: name -> function(stub, params) -> строки результата
+        self.functions = functions or {}
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    # 🔍 Фильтрация строк по query-параметрам PostgREST
+    def select_rows(self, table, params):
+        rows = self.tables.setdefault(table, [])
+        filters = [(k, v) for k, v in params if k not in ("select", "limit", "offset", "order", "on_conflict", "columns")]
+        result = [row for row in rows if all(_matches(row, column, expr) for column, expr in filters)]
+
+        order = dict(params).get("order")
+        if order:
+            for part in reversed(order.split(",")):
+                column, _, direction = part.partition(".")
+                result.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=direction.startswith("desc"))
+
+        offset = int(dict(params).get("offset", 0))
+        limit = dict(params).get("limit")
+        result = result[offset:]
+        if limit is not None:
+            result = result[: int(limit)]
+        return result
+
+    @staticmethod
+    def project(rows, params):
+        columns = dict(params).get("select", "*")
+        if columns == "*":
+            return [dict(row) for row in rows]
+        names = [c.strip() for c in columns.split(",")]
+        return [{name: row.get(name) for name in names} for row in rows]
+
+    def handle(self, method, table, params, body, headers):
+        with self.lock:
+            self.requests += 1
+
+            if method == "GET":
+                return 200, self.project(self.select_rows(table, params), params)
+
+            if method == "POST":
+                rows = body if isinstance(body, list) else [body]
+                prefer = headers.get("Prefer", "")
+                key = dict(params).get("on_conflict") or self.primary_keys.get(table, "id")
+                stored = self.tables.setdefault(table, [])
+                result = []
+                for row in rows:
+                    existing = next((r for r in stored if key in row and r.get(key) == row[key]), None)
+                    if existing is not None:
+                        if "merge-duplicates" not in prefer:
+                            return 409, {"code": "23505", "message": "duplicate key value violates unique constraint"}
+                        existing.update(row)
+                        result.append(dict(existing))
+                    else:
+                        stored.append(dict(row))
+                        result.append(dict(row))
+                return 201, result
+
+            if method == "PATCH":
+                rows = self.select_rows(table, params)
+                for row in rows:
+                    row.update(body)
+                return 200, [dict(row) for row in rows]
+
+            if method == "DELETE":
+                rows = self.select_rows(table, params)
+                stored = self.tables.setdefault(table, [])
+                self.tables[table] = [row for row in stored if row not in rows]
+                return 200, [dict(row) for row in rows]
+
+        return 405, {"message": f"Unsupported method {method}"}
+
+    def call(self, name, params):
+        with self.lock:
+            self.requests += 1
+            function = self.functions.get(name)
+            if function is None:
+                return 404, {"code": "PGRST202", "message": f"Could not find the function public.{name}"}
+            return 200, function(self, params or {})
+
+
+def _make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _dispatch(self, method):
+            if stub.latency:
+                time.sleep(stub.latency)
+
+            parts = urlsplit(self.path)
+            path = parts.path.rstrip("/")
+            table = path.rsplit("/", 1)[-1]
+            params = parse_qsl(parts.query, keep_blank_values=True)
+
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"null") if length else None
+
+            if "/rpc/" in path:
+                status, payload = stub.call(table, body)
+            else:
+                status, payload = stub.handle(method, table, params, body, self.headers)
+
+            if status < 300 and OBJECT_MIME in self.headers.get("Accept", ""):
+                if len(payload) != 1:
+                    status, payload = 406, {
+                        "code": "PGRST116",
+                        "message": "JSON object requested, multiple (or no) rows returned",
+                        "details": f"The result contains {len(payload)} rows",
+                        "hint": None,
+                    }
+                else:
+                    payload = payload[0]
+
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def do_PATCH(self):
+            self._dispatch("PATCH")
+
+        def do_DELETE(self):
+            self._dispatch("DELETE")
+
+    return Handler
+
+
+# 🚀 Запуск заглушки в фоновом потоке; возвращает (server, base_url для create_client)
+# Длинная очередь accept: пул клиента открывает десятки соединений разом
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+def serve(stub, host="127.0.0.1", port=0):
+    server = _Server((host, port), _make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+# Фиктивный service-role ключ: supabase-py проверяет только формат JWT
+FAKE_SERVICE_KEY = "bench.service.role"
@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench import fakes
+from bench.bench_asgi import ROOT, free_port, start_server, wait_for_port
+from bench.postgrest_stub import FAKE_SERVICE_KEY
+
+# 📊 Нагрузочный набор: приложение против локальных заменителей Supabase, Birs и second_server_url.
+# python -m bench.suite --modes sync asgi --save bench/baselines/local.json
+# python -m bench.suite --compare bench/baselines/local.json   # exit 1 при регрессии
+
+QR_CODE = "/api/operations/qr-code/"
+QR_STATUS = "/api/operations/<opId>/qr-status"
+QR_STATUS_BATCH = "/api/operations/qr-status/batch"
+WEBHOOK = "/api/webhook/"
+ORDER = "/api/order/"
+TEST_ORDER = "/api/test/"
+
+
+# =============== Сценарии: бесконечный поток (маршрут, метод, путь, kwargs) ===============
+
+def qr_burst(ctx):
+    # Лавина заказов от новых клиентов: логин из резерва, insert в clients, вызов second server
+    for i in itertools.count():
+        yield QR_CODE, "POST", QR_CODE, {"json": {"sum": 10000, "client_id": f"{ctx['run']}-new{i}"}}
+
+
+def status_storm(ctx):
+    for i in itertools.count():
+        op_id = f"op{i % ctx['purchases']}"
+        yield QR_STATUS, "GET", f"/api/operations/{op_id}/qr-status", {}
+
+
+def webhook_flood(ctx):
+    rng = random.Random(1)
+    while True:
+        op_id = f"op{rng.randrange(ctx['purchases'])}"
+        yield WEBHOOK, "POST", WEBHOOK, {"json": {"id": op_id, "status": rng.choice(["settlement", "failed"])}}
+
+
+def mixed(ctx):
+    rng = random.Random(2)
+    statuses, orders, webhooks = status_storm(ctx), qr_burst(ctx), webhook_flood(ctx)
+    order_body = {"steamId": "steam", "amount": 10000, "api_login": fakes.API_LOGIN, "api_key": fakes.API_KEY}
+
+    while True:
+        roll = rng.random()
+        if roll < 0.5:
+            yield next(statuses)
+        elif roll < 0.6:
+            yield next(orders)
+        elif roll < 0.7:
+            # Повторные заказы существующих клиентов (лимиты, без insert)
+            client_id = f"c{rng.randrange(ctx['clients'])}"
+            yield QR_CODE, "POST", QR_CODE, {"json": {"sum": 10000, "client_id": client_id}}
+        elif roll < 0.8:
+            ids = [f"op{rng.randrange(ctx['purchases'])}" for _ in range(50)]
+            yield QR_STATUS_BATCH, "POST", QR_STATUS_BATCH, {"json": {"ids": ids}}
+        elif roll < 0.9:
+            yield next(webhooks)
+        elif roll < 0.95:
+            yield ORDER, "POST", ORDER, {"json": order_body}
+        else:
+            yield TEST_ORDER, "POST", TEST_ORDER, {"json": order_body}
+
+
+SCENARIOS = {
+    "qr_burst": qr_burst,
+    "status_storm": status_storm,
+    "webhook_flood": webhook_flood,
+    "mixed": mixed,
+}
+
+
+# =============== Нагрузка и отчёт ===============
+
+def _percentile(timings, q):
+    return timings[min(len(timings) - 1, int(len(timings) * q))]
+
+
+async def drive(base_url, requests, concurrency, total):
+    timings, errors = {}, {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    plan = itertools.islice(requests, total)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60, headers=fakes.API_HEADERS) as client:
+
+        async def worker():
+            for route, method, path, kwargs in plan:
+                started = time.perf_counter()
+                try:
+                    resp = await client.request(method, path, **kwargs)
+                    failed = resp.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                timings.setdefault(route, []).append((time.perf_counter() - started) * 1000)
+                if failed:
+                    errors[route] = errors.get(route, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    report = {}
+    for route, values in timings.items():
+        values.sort()
+        report[route] = {
+            "count": len(values),
+            "rps": len(values) / elapsed,
+            "p50_ms": statistics.median(values),
+            "p99_ms": _percentile(values, 0.99),
+            "errors": errors.get(route, 0),
+        }
+    return report
+
+
+def print_report(mode, scenario, report):
+    for route, row in sorted(report.items()):
+        print(
+            f"{mode:<5} {scenario:<14} {route:<34} {row['rps']:8.1f} req/s  "
+            f"p50 {row['p50_ms']:7.1f} ms  p99 {row['p99_ms']:7.1f} ms  errors {row['errors']}"
+        )
+
+
+# 📉 Регрессия: p99 вырос или req/s упал больше чем на threshold (доля)
+def compare(baseline, results, threshold):
+    regressions = []
+    for mode, scenarios in results.items():
+        for scenario, routes in scenarios.items():
+            for route, row in routes.items():
+                base = baseline.get("results", {}).get(mode, {}).get(scenario, {}).get(route)
+                if not base:
+                    continue
+                p99_change = row["p99_ms"] / base["p99_ms"] - 1 if base["p99_ms"] else 0.0
+                rps_change = row["rps"] / base["rps"] - 1 if base["rps"] else 0.0
+                flag = p99_change > threshold or rps_change < -threshold
+                print(
+                    f"{'REGRESSION' if flag else 'ok':<10} {mode:<5} {scenario:<14} {route:<34} "
+                    f"p99 {p99_change:+.0%}  req/s {rps_change:+.0%}"
+                )
+                if flag:
+                    regressions.append((mode, scenario, route))
+    return regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", default=["sync", "asgi"], choices=["sync", "asgi"])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на сценарий")
+    parser.add_argument("--warmup", type=int, default=100, help="запросов на прогрев перед замером (не учитываются)")
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    parser.add_argument("--birs-latency-ms", type=float, default=150)
+    parser.add_argument("--second-latency-ms", type=float, default=100)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--purchases", type=int, default=1000)
+    parser.add_argument("--save", help="записать результаты в JSON (baseline)")
+    parser.add_argument("--compare", help="сравнить с сохранённым baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    db_port, birs_port, second_port = free_port(), free_port(), free_port()
+    stand_ins = multiprocessing.Process(
+        target=fakes.run,
+        args=(db_port, birs_port, second_port, args.db_latency_ms / 1000, args.birs_latency_ms / 1000,
+              args.second_latency_ms / 1000, args.clients, args.purchases),
+        daemon=True,
+    )
+    stand_ins.start()
+    for port in (db_port, birs_port, second_port):
+        wait_for_port(port)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in args.modes:
+            # Своё локальное состояние (лимиты, метрики, журнал webhook'ов) на каждый режим
+            state = os.path.join(directory, mode)
+            os.makedirs(os.path.join(state, "metrics"))
+            env = dict(
+                os.environ,
+                SUPABASE_URL=f"http://127.0.0.1:{db_port}",
+                SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY,
+                # Замер пропускной способности, а не лимитов частоты
+                RATE_LIMIT_ENABLED="0",
+                BIRS_API_URL=f"http://127.0.0.1:{birs_port}/v2.1/payment-test/create-link-payment",
+                LIMITS_DB_PATH=os.path.join(state, "limits.sqlite"),
+                WEBHOOK_QUEUE_DIR=os.path.join(state, "webhooks"),
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(state, "metrics"),
+            )
+
+            port = free_port()
+            proc = start_server(mode, port, args.workers, env)
+            try:
+                for scenario in args.scenarios:
+                    ctx = {"run": f"{mode}-{scenario}", "clients": args.clients, "purchases": args.purchases}
+                    requests = SCENARIOS[scenario](ctx)
+                    # Прогрев: соединения, импорты в воркерах, кэши — иначе p99 первого сценария шумит
+                    if args.warmup:
+                        asyncio.run(drive(f"http://127.0.0.1:{port}", requests, args.concurrency, args.warmup))
+                    report = asyncio.run(drive(f"http://127.0.0.1:{port}", requests, args.concurrency, args.requests))
+                    results.setdefault(mode, {})[scenario] = report
+                    print_report(mode, scenario, report)
+            finally:
+                proc.terminate()
+                proc.wait()
+
+    stand_ins.terminate()
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump({
+                "meta": {
+                    "revision": _git_revision(),
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "python": platform.python_version(),
+                    "cpus": os.cpu_count(),
+                    "args": vars(args),
+                },
+                "results": results,
+            }, file, indent=2, sort_keys=True)
+        print(f"💾 baseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regressions over {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
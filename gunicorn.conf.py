@@ -0,0 +1,28 @@
+import os
+import shutil
+import tempfile
+
+# ⚙️ gunicorn подхватывает этот файл сам (gunicorn app:app из корня проекта)
+
+# 📈 Каталог, куда воркеры пишут метрики Prometheus; /metrics любого воркера отдаёт сумму по всем.
+# Задаём до загрузки приложения — prometheus_client читает переменную при импорте
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "phantom-metrics"))
+
+
+def on_starting(server):
+    # Файлы прошлого запуска дали бы задвоенные счётчики
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def post_fork(server, worker):
+    # 🧵 Потоков обработки запросов на хосте (с учётом -w/--threads): по ним services/circuit_breaker.py
+    # считает, сколько из них может занять один backend мерчанта
+    os.environ.setdefault("SERVER_THREADS", str(server.cfg.workers * server.cfg.threads))
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
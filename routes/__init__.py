@@ -3,6 +3,8 @@ from .operations import operations_bp
 from .pikmi import pikmi_bp
 from .webhook import webhook_bp
 from .test import test_bp
+from .stats import stats_bp
+from .profiling import profiling_bp
 
 # Основной blueprint для всех маршрутов
 api_bp = Blueprint("api", __name__)
@@ -12,3 +14,5 @@ api_bp.register_blueprint(operations_bp, url_prefix="/operations")
 api_bp.register_blueprint(pikmi_bp, url_prefix="/order")
 api_bp.register_blueprint(webhook_bp, url_prefix="/webhook")
 api_bp.register_blueprint(test_bp, url_prefix="/test")
+api_bp.register_blueprint(stats_bp, url_prefix="/stats")
+api_bp.register_blueprint(profiling_bp, url_prefix="/profiling")
@@ -1,8 +1,16 @@
 from flask import Blueprint
 from .qr_code import qr_code_bp
+from .qr_bulk import qr_bulk_bp
 from .qr_status import qr_status_bp
+from .qr_status_batch import qr_status_batch_bp
+from .qr_jobs import qr_jobs_bp
+from .export import export_bp
 
 operations_bp = Blueprint("operations", __name__)
 
 operations_bp.register_blueprint(qr_code_bp, url_prefix="/qr-code")
-operations_bp.register_blueprint(qr_status_bp, url_prefix="/qr-status")
+operations_bp.register_blueprint(qr_bulk_bp, url_prefix="/qr-code/bulk")
+operations_bp.register_blueprint(qr_status_bp, url_prefix="/<opId>/qr-status")
+operations_bp.register_blueprint(qr_status_batch_bp, url_prefix="/qr-status/batch")
+operations_bp.register_blueprint(qr_jobs_bp, url_prefix="/qr-jobs")
+operations_bp.register_blueprint(export_bp, url_prefix="/export")
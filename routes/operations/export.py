@@ -0,0 +1,183 @@
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import re
+
+import httpx
+from flask import Blueprint, Response, request, jsonify
+from postgrest.exceptions import APIError
+from services.supabase_client import get_supabase
+from services.sandbox import SANDBOX_TABLE, sandbox_store
+from .qr_status import authenticate_status
+
+export_bp = Blueprint("export", __name__)
+logger = logging.getLogger(__name__)
+
+# 📤 Выгрузка истории покупок мерчанта потоком (CSV или NDJSON).
+# purchases читаем страницами по ключу (created_at, id) — каждая страница одним индексным
+# запросом (sql/purchases_export.sql), память воркера не зависит от размера выгрузки.
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", 1000))
+
+EXPORT_COLUMNS = ("id", "created_at", "amount", "status", "steam_login", "qr_id", "qr_payload", "commit")
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+_STATUS = re.compile(r"^[a-z_]+$")
+
+
+# 📋 Фильтры из query-параметров: (filters, None) или (None, текст ошибки)
+def parse_export_filters(args):
+    filters = {"from": None, "to": None, "statuses": None}
+    bounds = {}
+
+    for name in ("from", "to"):
+        value = args.get(name)
+        if not value:
+            continue
+        try:
+            parsed = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None, f"Invalid '{name}': expected ISO 8601 date or datetime"
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)  # created_at хранится в UTC
+        bounds[name] = parsed
+        filters[name] = parsed.isoformat()
+
+    if len(bounds) == 2 and bounds["from"] >= bounds["to"]:
+        return None, "Invalid range: 'from' must be earlier than 'to'"
+
+    status = args.get("status")
+    if status:
+        statuses = [s.strip().lower() for s in status.split(",") if s.strip()]
+        if not statuses or not all(_STATUS.match(s) for s in statuses):
+            return None, "Invalid 'status': expected comma-separated statuses"
+        filters["statuses"] = statuses
+
+    return filters, None
+
+
+# PostgREST: значения с зарезервированными символами (, . : ()) внутри or=(...) — в кавычках
+def _quote(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+# 📄 Следующая страница после (created_at, id) последней строки предыдущей
+def fetch_export_page(supabase, table, api_login, filters, after=None, page_size=EXPORT_PAGE_SIZE):
+    query = supabase.table(table).select(",".join(EXPORT_COLUMNS)).eq("api_login", api_login)
+    if filters["from"]:
+        query = query.gte("created_at", filters["from"])
+    if filters["to"]:
+        query = query.lt("created_at", filters["to"])
+    if filters["statuses"]:
+        query = query.in_("status", filters["statuses"])
+
+    if after is not None:
+        created_at, last_id = after
+        # (created_at, id) > (X, Y); в postgrest-py 0.13 нет or_ — параметр добавляем сами
+        query.params = query.params.add(
+            "or",
+            f"(created_at.gt.{_quote(created_at)},and(created_at.eq.{_quote(created_at)},id.gt.{_quote(last_id)}))",
+        )
+
+    return _execute_page(query.order("created_at,id").limit(page_size))
+
+
+# Страницу запрашиваем сами, а не query.execute(): httpx.Response и его поток (BoundSyncStream) ссылаются
+# друг на друга, и такой цикл вместе с телом ответа (~200 КБ на страницу) освобождает только полная сборка
+# мусора, которая при долгой выгрузке почти не наступает. Разобрав тело, отцепляем поток — ответ
+# освобождается сразу, по счётчику ссылок
+def _execute_page(query):
+    response = query.session.request(query.http_method, query.path, params=query.params, headers=query.headers)
+    try:
+        if not 200 <= response.status_code <= 299:
+            raise APIError(response.json())
+        return response.json() or []
+    finally:
+        response.close()
+        response.stream = httpx.ByteStream(b"")
+
+
+def _csv_chunk(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([row.get(column) for column in EXPORT_COLUMNS] for row in rows)
+    return buffer.getvalue()
+
+
+def _ndjson_chunk(rows, header=False):  # заголовка у NDJSON нет
+    return "".join(json.dumps({column: row.get(column) for column in EXPORT_COLUMNS}) + "\n" for row in rows)
+
+
+# 🔁 Страницы одна за другой; первая уже прочитана (её ошибки — обычный ответ 500)
+def export_chunks(supabase, table, api_login, filters, first_page, fmt, page_size=EXPORT_PAGE_SIZE):
+    encode = _csv_chunk if fmt == "csv" else _ndjson_chunk
+    # Генератор живёт всю выгрузку: держим только текущую страницу
+    page, first_page = first_page, None
+    exported = len(page)
+    yield encode(page, header=True)
+
+    try:
+        while len(page) == page_size:
+            last = page[-1]
+            page = fetch_export_page(supabase, table, api_login, filters, (last["created_at"], last["id"]), page_size)
+            exported += len(page)
+            if page:
+                yield encode(page)
+    except Exception:
+        # Статус уже отправлен: обрываем поток, клиент увидит незавершённый chunked-ответ
+        logger.exception("💥 Ошибка выгрузки покупок", extra={"api_login": api_login})
+        raise
+
+    logger.info("📤 Выгрузка покупок завершена", extra={"api_login": api_login, "rows": exported})
+
+
+# GET /export?format=csv|ndjson&from=2024-01-01&to=2024-02-01&status=success,pending
+@export_bp.route("", methods=["GET"])
+def export_purchases():
+    try:
+        supabase = get_supabase()
+
+        client, api_login, error = authenticate_status(supabase)
+        if error:
+            return error
+
+        fmt = request.args.get("format", "csv").lower()
+        if fmt not in FORMATS:
+            return jsonify({"error": f"Invalid 'format': expected one of {', '.join(FORMATS)}"}), 400
+
+        filters, error = parse_export_filters(request.args)
+        if error:
+            return jsonify({"error": error}), 400
+
+        if client.get("test"):
+            # Тестовые покупки в памяти хоста (sandbox) не выгружаются — только таблица purchases_test
+            if not sandbox_store.persistent:
+                return jsonify({"error": "Export is not available for sandbox purchases"}), 400
+            table = SANDBOX_TABLE
+        else:
+            table = "purchases"
+
+        # Первая страница до ответа: первый байт уходит через одно чтение из БД
+        first_page = fetch_export_page(supabase, table, api_login, filters)
+
+        filename = f"purchases-{api_login}.{fmt}"
+        return Response(
+            export_chunks(supabase, table, api_login, filters, first_page, fmt),
+            content_type=FORMATS[fmt],
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            },
+        )
+
+    except Exception as e:
+        logger.exception("❌ Ошибка выгрузки покупок")
+        return jsonify({"error": str(e)}), 500
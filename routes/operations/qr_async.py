@@ -0,0 +1,378 @@
+import asyncio
+import datetime
+import json
+import logging
+
+from starlette.responses import JSONResponse, StreamingResponse
+
+from services.credentials import find_api_client_async, find_api_client_by_key_async
+from services.http_client import async_outbound
+from services.circuit_breaker import BACKEND_TIMEOUT, BackendUnavailable, backend_breakers
+from services.limits import limit_engine
+from services.qr_jobs import wants_async
+from services.statuses import operation_status
+from services.status_cache import get_purchase_async, is_terminal
+from services.sandbox import SANDBOX_TABLE, sandbox_store
+from services.status_lookup import STATUS_LOOKUP_RPC, lookup_status_async
+from services.status_hub import LONGPOLL_MAX_WAIT, SSE_HEARTBEAT_INTERVAL, SSE_MAX_IDS, STATUS_RECHECK_INTERVAL, status_hub
+from .qr_code import BackendRejected, create_client, enqueue_qr_job, job_accepted, qr_results, validate_order_body
+
+# ⚡ Async-версии /qr-code и /<opId>/qr-status для ASGI-режима (см. asgi.py).
+# Логика и ответы те же, что у Flask-blueprint'ов — общие части берём из qr_code.py.
+# Только здесь: long-poll (?wait=N) и SSE-поток статусов — без потока на ожидающего.
+
+logger = logging.getLogger(__name__)
+
+
+def _error(message, status):
+    return JSONResponse({"error": message}, status_code=status)
+
+
+async def _read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# 📤 Async-отправка запроса на Steam backend
+async def send_to_steam_backend_async(login, amount, api_login, api_key, backend_url):
+    request_data = {
+        "steamId": login,
+        "amount": amount,
+        "api_login": api_login,
+        "api_key": api_key,
+    }
+
+    # Слот bulkhead'а не ждём (wait=0): event loop не блокируется
+    with backend_breakers.call(backend_url):
+        res = await async_outbound.post(
+            backend_url,
+            headers={"Content-Type": "application/json"},
+            json=request_data,
+            timeout=BACKEND_TIMEOUT,
+        )
+        if res.status_code >= 500:
+            raise Exception(f"Backend error: {res.status_code} {res.text}")
+
+    if res.status_code >= 400:
+        raise BackendRejected(f"Backend error: {res.status_code} {res.text}")
+
+    return res.json()
+
+
+# Задача больше не нужна (например, ключи не прошли проверку)
+def _discard(task):
+    if task is None:
+        return
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+
+async def _fetch_client_row(postgrest, client_id):
+    resp = await postgrest.table("clients").select("*").eq("client_id", client_id).maybe_single().execute()
+    return resp.data if resp else None
+
+
+# 🧠 POST /api/operations/qr-code/
+async def qr_code(request):
+    state = request.app.state
+    postgrest = state.postgrest.client
+    client_task = None
+
+    try:
+        api_key = request.headers.get("X-Api-Key")
+        api_login = request.headers.get("X-Api-Login")
+
+        if not api_key and not api_login:
+            return _error("Missing API credentials", 400)
+
+        body = await _read_json(request)
+        body_error = validate_order_body(body)
+
+        # Пока проверяем ключи — параллельно читаем строку клиента (если движок лимитов её не знает)
+        known_client = None
+        if not body_error:
+            known_client = limit_engine.client(body["client_id"])
+            if known_client is None:
+                client_task = asyncio.ensure_future(_fetch_client_row(postgrest, body["client_id"]))
+
+        # Если есть только ключ — ищем логин
+        if not api_login and api_key:
+            client_by_key = await find_api_client_by_key_async(postgrest, api_key)
+            if not client_by_key:
+                return _error("Invalid API key", 401)
+            api_login = client_by_key["api_login"]
+
+        client = await find_api_client_async(postgrest, api_login, api_key)
+        if not client:
+            return _error("Invalid API credentials", 401)
+
+        if body_error:
+            return _error(body_error, 400)
+
+        backend_breakers.check(client["second_server_url"])
+
+        amount = body["sum"]
+        client_id = body["client_id"]
+        now = datetime.datetime.utcnow().isoformat()
+        respond_async = wants_async(request.headers)
+
+        if client_task is not None:
+            existing_client = await client_task
+            if existing_client:
+                known_client = await asyncio.to_thread(limit_engine.seed, existing_client)
+
+        supabase = state.supabase
+        # =============== 1️⃣ Клиент существует (или None — новый) ===============
+        steam_login = known_client["steam_login"] if known_client else None
+
+        # 💳 Резерв до выдачи логина: заказ сверх лимита не тратит логин и не оставляет строку в clients.
+        # Резерв в общем SQLite может ждать блокировку другого воркера — не в event loop
+        reservation, cancelled = await asyncio.to_thread(
+            lambda: limit_engine.reserve(supabase.client, client_id, amount / 100)
+        )
+        if cancelled:
+            return JSONResponse(cancelled)
+
+        if respond_async:
+            try:
+                job_id = await asyncio.to_thread(
+                    enqueue_qr_job, supabase, api_login, client_id, amount, steam_login, reservation, now,
+                )
+            except Exception:
+                await asyncio.to_thread(limit_engine.release, reservation)
+                raise
+            accepted, headers = job_accepted(job_id)
+            return JSONResponse(accepted, status_code=202, headers=headers)
+
+        try:
+            if steam_login is None:
+                # =============== 2️⃣ Клиента нет — создаём (в асинхронном режиме это делает задание) ===============
+                # Логин из пула, insert и seed (с разбором гонки за client_id) — одним заходом в поток
+                steam_login = await asyncio.to_thread(create_client, supabase.client, client_id, api_login, now)
+
+            backend_data = await send_to_steam_backend_async(
+                steam_login, amount, api_login, api_key, client["second_server_url"]
+            )
+        except Exception:
+            await asyncio.to_thread(limit_engine.release, reservation)
+            raise
+
+        return JSONResponse(qr_results(backend_data))
+
+    except BackendUnavailable as e:
+        headers = {"Retry-After": str(max(1, round(e.retry_after)))} if e.retry_after is not None else None
+        return JSONResponse({"error": str(e)}, status_code=503, headers=headers)
+
+    except Exception as e:
+        logger.exception("💥 Ошибка создания QR")
+        return _error(str(e), 500)
+
+    finally:
+        _discard(client_task)
+
+
+# 🔐 Проверка ключей для status-путей: (client, api_login, None) или (None, None, ответ с ошибкой)
+async def _authenticate_status(postgrest, request):
+    api_key = request.headers.get("X-Api-Key")
+    api_login = request.headers.get("X-Api-Login")
+
+    if not api_key and not api_login:
+        return None, None, _error("Missing API credentials", 400)
+
+    if not api_login and api_key:
+        client_by_key = await find_api_client_by_key_async(postgrest, api_key)
+        if not client_by_key:
+            return None, None, _error("Invalid API key", 401)
+        api_login = client_by_key["api_login"]
+
+    client = await find_api_client_async(postgrest, api_login, api_key)
+    if not client:
+        return None, None, _error("Forbidden: invalid API credentials", 403)
+
+    return client, api_login, None
+
+
+# 🧪 Откуда читать покупки клиента: (таблица для подписки в status_hub, загрузчик по opId)
+def _purchase_source(postgrest, client):
+    if client.get("test"):
+        return SANDBOX_TABLE, lambda op_id: sandbox_store.get_async(postgrest, op_id)
+    return "purchases", lambda op_id: get_purchase_async(postgrest, "purchases", op_id)
+
+
+def _wait_seconds(request):
+    try:
+        wait = float(request.query_params.get("wait", 0))
+    except ValueError:
+        return 0
+    return max(0.0, min(wait, LONGPOLL_MAX_WAIT))
+
+
+# ⏳ Ждём смены статуса: webhook этого воркера будит сразу,
+# изменения из других воркеров ловим периодической перепроверкой
+async def _wait_for_change(load, op_id, purchase, queue, wait):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    initial_status = purchase.get("status")
+
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return purchase
+
+        try:
+            purchase = await asyncio.wait_for(queue.get(), min(remaining, STATUS_RECHECK_INTERVAL))
+        except asyncio.TimeoutError:
+            purchase = await load(op_id) or purchase
+
+        if purchase.get("status") != initial_status:
+            return purchase
+
+
+# 🔍 GET /api/operations/{opId}/qr-status[?wait=N]
+async def get_qr_status(request):
+    postgrest = request.app.state.postgrest.client
+    op_id = request.path_params["opId"]
+    queue = None
+
+    try:
+        wait = _wait_seconds(request)
+
+        if STATUS_LOOKUP_RPC:
+            # ⚡ Ключи, таблица и покупка одним запросом (sql/qr_status_lookup.sql).
+            # Подписка — после чтения: webhook этого воркера между ними уже лежит в кэше статусов
+            client, purchase, error = await lookup_status_async(
+                postgrest, request.headers.get("X-Api-Login"), request.headers.get("X-Api-Key"), op_id
+            )
+            if error:
+                status, message = error
+                return _error(message, status)
+
+            table_name, load = _purchase_source(postgrest, client)
+            if wait and not is_terminal(purchase):
+                queue = status_hub.subscribe(table_name, [op_id])
+                purchase = await load(op_id) or purchase
+        else:
+            client, api_login, error = await _authenticate_status(postgrest, request)
+            if error:
+                return error
+
+            table_name, load = _purchase_source(postgrest, client)
+
+            # Подписываемся до чтения, чтобы не пропустить webhook между ними
+            if wait:
+                queue = status_hub.subscribe(table_name, [op_id])
+
+            purchase = await load(op_id)
+            if not purchase or purchase.get("api_login") != api_login:
+                return _error("Purchase not found", 404)
+
+        if queue is not None and not is_terminal(purchase):
+            purchase = await _wait_for_change(load, op_id, purchase, queue, wait)
+
+        return JSONResponse({"results": operation_status(purchase)})
+
+    except Exception as e:
+        logger.exception("❌ Ошибка проверки статуса")
+        return _error(str(e), 500)
+
+    finally:
+        if queue is not None:
+            status_hub.unsubscribe(table_name, [op_id], queue)
+
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def _status_event(op_id, purchase):
+    return _sse("status", {"operation_id": op_id, **operation_status(purchase)})
+
+
+# 📡 GET /api/operations/status-stream?ids=a,b,c — SSE-поток смены статусов
+async def status_stream(request):
+    postgrest = request.app.state.postgrest.client
+
+    try:
+        client, api_login, error = await _authenticate_status(postgrest, request)
+        if error:
+            return error
+
+        ids = list(dict.fromkeys(i.strip() for i in request.query_params.get("ids", "").split(",") if i.strip()))
+        if not ids:
+            return _error("Missing ids", 400)
+        if len(ids) > SSE_MAX_IDS:
+            return _error(f"Too many ids: max {SSE_MAX_IDS}", 400)
+
+        table_name, load = _purchase_source(postgrest, client)
+
+        queue = status_hub.subscribe(table_name, ids)
+        try:
+            purchases = await asyncio.gather(*(load(op_id) for op_id in ids))
+        except Exception:
+            status_hub.unsubscribe(table_name, ids, queue)
+            raise
+
+    except Exception as e:
+        logger.exception("❌ Ошибка подписки на статусы")
+        return _error(str(e), 500)
+
+    known = {
+        op_id: purchase
+        for op_id, purchase in zip(ids, purchases)
+        if purchase and purchase.get("api_login") == api_login
+    }
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        try:
+            for op_id in ids:
+                if op_id in known:
+                    yield _status_event(op_id, known[op_id])
+                else:
+                    yield _sse("not_found", {"operation_id": op_id})
+
+            last_status = {op_id: purchase.get("status") for op_id, purchase in known.items()}
+            pending = {op_id for op_id, purchase in known.items() if not is_terminal(purchase)}
+            next_recheck = loop.time() + STATUS_RECHECK_INTERVAL
+            next_heartbeat = loop.time() + SSE_HEARTBEAT_INTERVAL
+
+            while pending:
+                timeout = max(0.0, min(next_recheck, next_heartbeat) - loop.time())
+                try:
+                    updates = [await asyncio.wait_for(queue.get(), timeout)]
+                except asyncio.TimeoutError:
+                    updates = []
+
+                if loop.time() >= next_recheck:
+                    rechecked = await asyncio.gather(
+                        *(load(op_id) for op_id in pending)
+                    )
+                    updates.extend(purchase for purchase in rechecked if purchase)
+                    next_recheck = loop.time() + STATUS_RECHECK_INTERVAL
+
+                if loop.time() >= next_heartbeat:
+                    yield ": ping\n\n"
+                    next_heartbeat = loop.time() + SSE_HEARTBEAT_INTERVAL
+
+                for purchase in updates:
+                    op_id = str(purchase["id"])
+                    if op_id not in pending or purchase.get("status") == last_status[op_id]:
+                        continue
+                    last_status[op_id] = purchase.get("status")
+                    yield _status_event(op_id, purchase)
+                    if is_terminal(purchase):
+                        pending.discard(op_id)
+
+            yield _sse("end", {})
+        finally:
+            status_hub.unsubscribe(table_name, ids, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
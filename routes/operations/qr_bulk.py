@@ -0,0 +1,174 @@
+from flask import Blueprint, request, jsonify
+from services.supabase_client import get_supabase
+from services.login_allocator import login_allocator
+from services.http_client import OUTBOUND_POOL_SIZE
+from services.limits import limit_engine
+from services.idempotency import idempotent
+from services.circuit_breaker import BackendUnavailable, backend_breakers
+from concurrent.futures import ThreadPoolExecutor
+from .qr_code import (
+    authenticate_order, backend_unavailable, new_client_row, qr_results, send_to_steam_backend, validate_order_body,
+)
+import datetime
+import logging
+import os
+
+# ⚙️ Размер пачки и сколько вызовов backend'а идут параллельно
+QR_BULK_MAX_ORDERS = int(os.environ.get("QR_BULK_MAX_ORDERS", 500))
+QR_BULK_CONCURRENCY = int(os.environ.get("QR_BULK_CONCURRENCY", OUTBOUND_POOL_SIZE))
+# Пачка не отказывает сразу при занятом bulkhead'е backend'а, а ждёт слот
+QR_BULK_BULKHEAD_WAIT = float(os.environ.get("QR_BULK_BULKHEAD_WAIT", 30))
+
+# Общий пул воркера: сколько бы bulk-запросов ни пришло, к backend'ам не больше QR_BULK_CONCURRENCY вызовов
+_backend_pool = ThreadPoolExecutor(max_workers=QR_BULK_CONCURRENCY, thread_name_prefix="qr-bulk")
+
+qr_bulk_bp = Blueprint("qr_bulk", __name__)
+logger = logging.getLogger(__name__)
+
+# 🆕 Новые клиенты одним insert; если пачка не прошла (например, клиента с тем же client_id успел создать
+# параллельный запрос) — по одному. Строки, которые так и не вставились: логин возвращаем в пул,
+# клиента, созданного другим запросом, берём из clients, иначе ошибка в errors[client_id].
+# Возвращает строки clients для seed
+def insert_new_clients(supabase, new_clients, errors):
+    if not new_clients:
+        return []
+    try:
+        supabase.table("clients").insert(new_clients).execute()
+        return new_clients
+    except Exception:
+        logger.warning("⚠️ Пакетный insert клиентов не прошёл, вставляем по одному", exc_info=True)
+
+    inserted, failed = [], []
+    for row in new_clients:
+        try:
+            supabase.table("clients").insert(row).execute()
+            inserted.append(row)
+        except Exception as e:
+            failed.append(row)
+            errors[str(row["client_id"])] = f"Failed to create client: {getattr(e, 'message', e)}"
+
+    if failed:
+        login_allocator.return_logins(supabase, [row["steam_login"] for row in failed])
+        existing = supabase.table("clients").select("*").in_("client_id", [row["client_id"] for row in failed]).execute()
+        for row in existing.data:
+            errors.pop(str(row["client_id"]), None)
+            inserted.append(row)
+    return inserted
+
+# 📦 POST /qr-code/bulk  {"orders": [{"sum": ..., "client_id": ...}, ...]}
+# Одна проверка ключей, один запрос в clients, лимиты одной транзакцией,
+# один insert новых клиентов, вызовы backend'а — параллельно
+@qr_bulk_bp.route("", methods=["POST"])
+@idempotent("qr-code-bulk")
+def qr_code_bulk():
+    try:
+        supabase = get_supabase()
+
+        client, api_login, api_key, error = authenticate_order(supabase)
+        if error:
+            return error
+        backend_breakers.check(client["second_server_url"])
+
+        body = request.get_json(silent=True) or {}
+        orders = body.get("orders")
+        if not isinstance(orders, list) or not orders:
+            return jsonify({"error": "Field 'orders' must be a non-empty list"}), 400
+        if len(orders) > QR_BULK_MAX_ORDERS:
+            return jsonify({"error": f"Too many orders: max {QR_BULK_MAX_ORDERS}"}), 400
+
+        results = [None] * len(orders)
+        valid = []
+        for index, order in enumerate(orders):
+            error = validate_order_body(order if isinstance(order, dict) else None)
+            if error:
+                results[index] = {"error": error}
+            else:
+                valid.append(index)
+
+        # =============== 1️⃣ Клиенты: известные движку — локально, остальные одним запросом ===============
+        client_ids = {}
+        for index in valid:
+            client_ids.setdefault(str(orders[index]["client_id"]), orders[index]["client_id"])
+
+        known = {key: limit_engine.client(key) for key in client_ids}
+        unknown = [client_ids[key] for key, row in known.items() if row is None]
+        if unknown:
+            for row in supabase.table("clients").select("*").in_("client_id", unknown).execute().data:
+                known[str(row["client_id"])] = limit_engine.seed(row)
+
+        # =============== 2️⃣ Лимиты: одна транзакция, заказы одного клиента — по порядку ===============
+        # Резерв до выдачи логинов: клиенту, все заказы которого сверх лимита, логин не нужен
+        reservations = limit_engine.reserve_many(
+            supabase, [(orders[index]["client_id"], orders[index]["sum"] / 100) for index in valid]
+        )
+
+        accepted = []
+        for index, (reservation, cancelled) in zip(valid, reservations):
+            if cancelled:
+                results[index] = cancelled
+            else:
+                accepted.append((index, reservation))
+
+        # =============== 3️⃣ Новые клиенты: логины пачкой, один insert ===============
+        missing = list(dict.fromkeys(
+            str(orders[index]["client_id"]) for index, _ in accepted if known[str(orders[index]["client_id"])] is None
+        ))
+        insert_errors = {}
+        if missing:
+            now = datetime.datetime.utcnow().isoformat()
+            try:
+                logins = login_allocator.acquire_many(supabase, len(missing))
+                new_clients = [
+                    new_client_row(client_ids[key], api_login, login, now)
+                    for key, login in zip(missing, logins)
+                ]
+                for row in insert_new_clients(supabase, new_clients, insert_errors):
+                    known[str(row["client_id"])] = limit_engine.seed(row)
+            except Exception:
+                limit_engine.release(*(reservation for _, reservation in accepted))
+                raise
+
+        calls = {}
+        unplaced = []
+        for index, reservation in accepted:
+            order = orders[index]
+            key = str(order["client_id"])
+            if known[key] is None:
+                # Клиента создать не удалось — резерв откатываем
+                results[index] = {"error": insert_errors.get(key, "No available logins left")}
+                unplaced.append(reservation)
+                continue
+            steam_login = known[key]["steam_login"]
+            calls[index] = reservation, _backend_pool.submit(
+                send_to_steam_backend, steam_login, order["sum"], api_login, api_key, client["second_server_url"],
+                QR_BULK_BULKHEAD_WAIT,
+            )
+
+        if unplaced:
+            limit_engine.release(*unplaced)
+
+        # =============== 4️⃣ Ответы backend'а; неудачные резервы откатываем ===============
+        failed = []
+        for index, (reservation, call) in calls.items():
+            try:
+                results[index] = qr_results(call.result())
+            except Exception as e:
+                failed.append(reservation)
+                results[index] = {"error": str(e)}
+
+        if failed:
+            limit_engine.release(*failed)
+
+        return jsonify({
+            "results": [
+                {"index": index, "client_id": order.get("client_id") if isinstance(order, dict) else None, **result}
+                for index, (order, result) in enumerate(zip(orders, results))
+            ]
+        }), 200
+
+    except BackendUnavailable as e:
+        return backend_unavailable(e)
+
+    except Exception as e:
+        logger.exception("💥 Ошибка пакетного создания QR")
+        return jsonify({"error": str(e)}), 500
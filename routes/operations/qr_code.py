@@ -1,23 +1,33 @@
-from flask import Blueprint, request, jsonify
-from supabase import create_client, Client
-import requests
+from flask import Blueprint, current_app, request, jsonify
+from services.supabase_client import get_supabase
+from services.credentials import find_api_client, find_api_client_by_key, find_api_client_by_login
+from services.login_allocator import login_allocator
+from services.http_client import outbound, request_not_sent
+from services.limits import limit_engine
+from services.idempotency import idempotent
+from services.circuit_breaker import BACKEND_TIMEOUT, BackendUnavailable, backend_breakers
+from services.qr_jobs import QR_JOBS_BULKHEAD_WAIT, QR_JOBS_MODE, JobFailed, qr_jobs, wants_async
 import random
 import datetime
-import os
+import logging
 
 qr_code_bp = Blueprint("qr_code", __name__)
+logger = logging.getLogger(__name__)
 
-# 🔑 Инициализация Supabase
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# Код ошибки PostgreSQL: строка с таким ключом уже есть
+UNIQUE_VIOLATION = "23505"
+
+# ⛔ Backend отклонил заказ (4xx): повтор с теми же данными не поможет
+class BackendRejected(Exception):
+    pass
 
 # 🔢 Генерация 8-значного ID
 def generate_numeric_id():
     return random.randint(10000000, 99999999)
 
-# 📤 Синхронная отправка запроса на Steam backend
-def send_to_steam_backend(login, amount, api_login, api_key, backend_url):
+# 📤 Синхронная отправка запроса на Steam backend.
+# Через предохранитель backend'а: недоступный отказывает сразу (BackendUnavailable), 5xx и таймауты — его ошибки
+def send_to_steam_backend(login, amount, api_login, api_key, backend_url, wait=0.0, idempotency_key=None):
     request_data = {
         "steamId": login,
         "amount": amount,
@@ -25,148 +35,257 @@ def send_to_steam_backend(login, amount, api_login, api_key, backend_url):
         "api_key": api_key,
     }
 
-    res = requests.post(
-        backend_url,
-        headers={"Content-Type": "application/json"},
-        json=request_data,
-        timeout=20
-    )
+    headers = {"Content-Type": "application/json"}
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+
+    # Пул keep-alive соединений на каждый second_server_url, раздельные таймауты
+    with backend_breakers.call(backend_url, wait):
+        res = outbound.post(
+            backend_url,
+            headers=headers,
+            json=request_data,
+            timeout=BACKEND_TIMEOUT,
+        )
+        if res.status_code >= 500:
+            raise Exception(f"Backend error: {res.status_code} {res.text}")
 
     if res.status_code >= 400:
-        raise Exception(f"Backend error: {res.status_code} {res.text}")
+        raise BackendRejected(f"Backend error: {res.status_code} {res.text}")
 
     return res.json()
 
-# 🔑 Получение свободного steam_login
-def get_available_login():
-    logins_resp = supabase.table("available_logins").select("login").eq("used", False).execute()
-    logins = logins_resp.data
-
-    if not logins:
-        raise Exception("No available logins left")
-
-    while logins:
-        chosen = random.choice(logins)["login"]
+# 🔑 Получение свободного steam_login (из локального резерва, обычно без запросов в БД)
+def get_available_login(supabase):
+    return login_allocator.acquire(supabase)
 
-        exists = supabase.table("clients").select("steam_login").eq("steam_login", chosen).maybe_single().execute().data
-        if not exists:
-            mark = supabase.table("available_logins").update({"used": True}).eq("login", chosen).execute()
-            if mark.error:
-                raise Exception(mark.error.message)
-            return chosen
+# 🆕 Новый клиент с логином из пула -> steam_login. Если клиента с тем же client_id успел создать
+# параллельный запрос или задание — логин возвращаем в пул и берём строку, которая уже в clients
+def create_client(supabase, client_id, api_login, now):
+    steam_login = get_available_login(supabase)
+    new_client = new_client_row(client_id, api_login, steam_login, now)
+    try:
+        supabase.table("clients").insert(new_client).execute()
+    except Exception as e:
+        if getattr(e, "code", None) != UNIQUE_VIOLATION:
+            raise
+        login_allocator.return_logins(supabase, [steam_login])
+        existing_client = supabase.table("clients").select("*").eq("client_id", client_id).maybe_single().execute()
+        if not existing_client or not existing_client.data:
+            raise
+        return limit_engine.seed(existing_client.data)["steam_login"]
+    return limit_engine.seed(new_client)["steam_login"]
+
+# 📋 Проверка тела запроса: текст ошибки или None
+def validate_order_body(body):
+    if not body:
+        return "Missing JSON body"
+
+    sum_value = body.get("sum")
+    if not isinstance(sum_value, (int, float)) or sum_value <= 0:
+        return "Invalid sum: must be positive number"
+
+    if not body.get("client_id"):
+        return "Missing client_id in request body"
+
+    return None
+
+# 🆕 Строка нового клиента для таблицы clients (суммы допишет движок лимитов)
+def new_client_row(client_id, api_login, steam_login, now):
+    return {
+        "id": generate_numeric_id(),
+        "client_id": client_id,
+        "api_login": api_login,
+        "created_at": now,
+        "updated_at": now,
+        "total_amount": 0,
+        "period_amount": 0,
+        "month_amount": 0,
+        "steam_login": steam_login,
+    }
 
-        logins = [l for l in logins if l["login"] != chosen]
+# ⛔ 503 с Retry-After, когда backend мерчанта отключён предохранителем
+def backend_unavailable(e):
+    headers = {"Retry-After": str(max(1, round(e.retry_after)))} if e.retry_after is not None else {}
+    return jsonify({"error": str(e)}), 503, headers
+
+# 📦 Ответ мерчанту по данным backend'а
+def qr_results(backend_data):
+    result = backend_data["result"]
+    return {
+        "results": {
+            "operation_id": result["operation_id"],
+            "qr_id": result["qr_id"],
+            "qr_link": result["qr_payload"]
+        }
+    }
 
-    raise Exception("No available logins left after checking clients")
+# 📬 Заказ в очередь фоновых заданий (лимит уже зарезервирован). steam_login=None — логин выдаст исполнитель.
+# Ключ мерчанта и адрес backend'а в очередь не пишем — исполнитель берёт их из api_clients по api_login
+def enqueue_qr_job(supabase_registry, api_login, client_id, amount, steam_login, reservation, now):
+    qr_jobs.start(supabase_registry, run_qr_job, release_qr_job)
+    return qr_jobs.enqueue(api_login, {
+        "client_id": client_id,
+        "amount": amount,
+        "steam_login": steam_login,
+        "reservation": reservation,
+        "created_at": now,
+    })
+
+# 📨 Ответ 202: id задания и где смотреть результат
+def job_accepted(job_id):
+    status_url = f"/api/operations/qr-jobs/{job_id}"
+    body = {"job_id": job_id, "status": "queued", "status_url": status_url}
+    return body, {"Location": status_url, "Preference-Applied": "respond-async"}
+
+# ⚙️ Исполнитель задания: логин (для нового клиента) и вызов backend'а -> results для GET /qr-jobs/<id>.
+# Повтор после сбоя находит клиента, созданного прошлой попыткой, и берёт его логин.
+# Backend получает Idempotency-Key = id задания: повтор после падения воркера посреди вызова не создаст второй QR
+def run_qr_job(supabase, job):
+    payload = job["payload"]
+    client_id = payload["client_id"]
+
+    steam_login = payload["steam_login"]
+    if steam_login is None:
+        known_client = limit_engine.client(client_id)
+        if known_client is None:
+            existing_client = supabase.table("clients").select("*").eq("client_id", client_id).maybe_single().execute()
+            existing_client = existing_client.data if existing_client else None
+            if existing_client:
+                known_client = limit_engine.seed(existing_client)
+
+        if known_client:
+            steam_login = known_client["steam_login"]
+        else:
+            steam_login = create_client(supabase, client_id, job["api_login"], payload["created_at"])
+
+    merchant = find_api_client_by_login(supabase, job["api_login"])
+    if merchant is None:
+        raise JobFailed("Merchant not found")
 
-# 🧠 Основная логика (синхронная)
+    try:
+        # Слот bulkhead'а ждём: очередь сама сглаживает всплеск, отказ сразу только сжёг бы попытку
+        backend_data = send_to_steam_backend(
+            steam_login, payload["amount"], job["api_login"], merchant["api_key"], merchant["second_server_url"],
+            QR_JOBS_BULKHEAD_WAIT, idempotency_key=job["id"],
+        )
+    except BackendRejected as e:
+        raise JobFailed(str(e))
+    except BackendUnavailable:
+        raise  # предохранитель или bulkhead: в сеть не ходили, повторим
+    except Exception as e:
+        if request_not_sent(e):
+            raise
+        # Ответ 5xx или обрыв после отправки: backend мог создать QR, повтор дал бы второй
+        raise JobFailed(str(e))
+
+    return qr_results(backend_data)["results"]
+
+# ↩️ Задание не выполнено — сумма не должна съедать лимит
+def release_qr_job(supabase, job, error):
+    limit_engine.release(job["payload"]["reservation"])
+
+# 🌐 Исполнители асинхронного /qr-code (QR_JOBS_MODE=prefer|always) стартуют с первым запросом воркера —
+# так они переживают fork при gunicorn --preload, а задания, оставшиеся в очереди после перезапуска,
+# не ждут нового заказа
+@qr_code_bp.before_app_request
+def _start_qr_jobs():
+    if QR_JOBS_MODE != "off":
+        qr_jobs.start(current_app.extensions["supabase"], run_qr_job, release_qr_job)
+
+# 🔐 Проверка ключей мерчанта: (client, api_login, api_key, None) или (..., ответ с ошибкой)
+def authenticate_order(supabase):
+    api_key = request.headers.get("X-Api-Key")
+    api_login = request.headers.get("X-Api-Login")
+
+    if not api_key and not api_login:
+        return None, None, None, (jsonify({"error": "Missing API credentials"}), 400)
+
+    # Если есть только ключ — ищем логин
+    if not api_login and api_key:
+        client_by_key = find_api_client_by_key(supabase, api_key)
+        if not client_by_key:
+            return None, None, None, (jsonify({"error": "Invalid API key"}), 401)
+        api_login = client_by_key["api_login"]
+
+    # Проверяем клиента (через общий кэш api_clients)
+    client = find_api_client(supabase, api_login, api_key)
+    if not client:
+        return None, None, None, (jsonify({"error": "Invalid API credentials"}), 401)
+
+    return client, api_login, api_key, None
+
+# 🧠 Основная логика (синхронная). Повтор с тем же Idempotency-Key — сохранённый ответ.
+# С Prefer: respond-async (или QR_JOBS_MODE=always) — проверка и резерв лимита здесь, ответ 202 с id задания,
+# выдача логина и вызов backend'а — в фоновом задании (services/qr_jobs.py)
 @qr_code_bp.route("/", methods=["POST"])
+@idempotent("qr-code")
 def qr_code():
     try:
-        api_key = request.headers.get("X-Api-Key")
-        api_login = request.headers.get("X-Api-Login")
+        supabase = get_supabase()
 
-        if not api_key and not api_login:
-            return jsonify({"error": "Missing API credentials"}), 400
-
-        # Если есть только ключ — ищем логин
-        if not api_login and api_key:
-            client_by_key = supabase.table("api_clients").select("api_login, second_server_url").eq("api_key", api_key).maybe_single().execute().data
-            if not client_by_key:
-                return jsonify({"error": "Invalid API key"}), 401
-            api_login = client_by_key["api_login"]
-
-        # Проверяем клиента
-        client = supabase.table("api_clients").select("id, api_login, api_key, second_server_url").eq("api_login", api_login).eq("api_key", api_key).maybe_single().execute().data
-        if not client:
-            return jsonify({"error": "Invalid API credentials"}), 401
+        client, api_login, api_key, error = authenticate_order(supabase)
+        if error:
+            return error
 
         SECOND_SERVER_URL = client["second_server_url"]
+        # Backend мерчанта отключён — отказываем до запросов в clients и резерва лимита
+        backend_breakers.check(SECOND_SERVER_URL)
 
         body = request.get_json()
-        if not body:
-            return jsonify({"error": "Missing JSON body"}), 400
-
-        sum_value = body.get("sum")
-        client_id = body.get("client_id")
+        error = validate_order_body(body)
+        if error:
+            return jsonify({"error": error}), 400
 
-        if not isinstance(sum_value, (int, float)) or sum_value <= 0:
-            return jsonify({"error": "Invalid sum: must be positive number"}), 400
-
-        if not client_id:
-            return jsonify({"error": "Missing client_id in request body"}), 400
-
-        amount = sum_value
+        amount = body["sum"]
+        client_id = body["client_id"]
         now = datetime.datetime.utcnow().isoformat()
-
-        # Проверяем клиента
-        existing_client = supabase.table("clients").select("*").eq("client_id", client_id).maybe_single().execute().data
-
-        # =============== 1️⃣ Клиент существует ===============
-        if existing_client:
-            new_total = (existing_client.get("total_amount", 0) or 0) + amount / 100
-            new_period = (existing_client.get("period_amount", 0) or 0) + amount / 100
-
-            if new_period > 10000 or new_total > 100000:
-                exceeded_type = "день" if new_period > 10000 else "месяц"
-                remaining = (
-                    10000 - existing_client.get("period_amount", 0)
-                    if new_period > 10000
-                    else 100000 - existing_client.get("total_amount", 0)
+        respond_async = wants_async(request.headers)
+
+        # Клиент, которого движок лимитов уже знает, обходится без запроса в clients
+        known_client = limit_engine.client(client_id)
+        if known_client is None:
+            existing_client = supabase.table("clients").select("*").eq("client_id", client_id).maybe_single().execute()
+            existing_client = existing_client.data if existing_client else None
+            if existing_client:
+                known_client = limit_engine.seed(existing_client)
+
+        # =============== 1️⃣ Клиент существует (или None — новый) ===============
+        steam_login = known_client["steam_login"] if known_client else None
+
+        # 💳 Атомарно проверяем и резервируем сумму в дневном и месячном окне —
+        # до выдачи логина: заказ сверх лимита не тратит логин и не оставляет строку в clients
+        reservation, cancelled = limit_engine.reserve(supabase, client_id, amount / 100)
+        if cancelled:
+            return jsonify(cancelled), 200
+
+        if respond_async:
+            try:
+                job_id = enqueue_qr_job(
+                    current_app.extensions["supabase"], api_login, client_id, amount, steam_login, reservation, now,
                 )
-                return jsonify({
-                    "status": "cancelled",
-                    "info": f"Превышен лимит суммы операций за {exceeded_type}. Остаточный лимит {max(0, remaining)} рублей."
-                }), 200
-
-            # обновляем клиента
-            supabase.table("clients").update({
-                "total_amount": new_total,
-                "period_amount": new_period,
-                "updated_at": now
-            }).eq("client_id", client_id).execute()
+            except Exception:
+                limit_engine.release(reservation)
+                raise
+            accepted, headers = job_accepted(job_id)
+            return jsonify(accepted), 202, headers
 
-            steam_login = existing_client["steam_login"]
+        try:
+            if steam_login is None:
+                # =============== 2️⃣ Клиента нет — создаём (в асинхронном режиме это делает задание) ===============
+                steam_login = create_client(supabase, client_id, api_login, now)
 
             backend_data = send_to_steam_backend(steam_login, amount, api_login, api_key, SECOND_SERVER_URL)
-            result = backend_data["result"]
-
-            return jsonify({
-                "results": {
-                    "operation_id": result["operation_id"],
-                    "qr_id": result["qr_id"],
-                    "qr_link": result["qr_payload"]
-                }
-            }), 200
-
-        # =============== 2️⃣ Клиента нет — создаём ===============
-        chosen_login = get_available_login()
-        new_id = generate_numeric_id()
-
-        supabase.table("clients").insert({
-            "id": new_id,
-            "client_id": client_id,
-            "api_login": api_login,
-            "created_at": now,
-            "updated_at": now,
-            "total_amount": amount / 100,
-            "period_amount": amount / 100,
-            "steam_login": chosen_login,
-        }).execute()
-
-        backend_data = send_to_steam_backend(chosen_login, amount, api_login, api_key, SECOND_SERVER_URL)
-        result = backend_data["result"]
-
-        return jsonify({
-            "results": {
-                "operation_id": result["operation_id"],
-                "qr_id": result["qr_id"],
-                "qr_link": result["qr_payload"]
-            }
-        }), 200
+        except Exception:
+            # QR не создан — сумма не должна съедать лимит
+            limit_engine.release(reservation)
+            raise
+
+        return jsonify(qr_results(backend_data)), 200
+
+    except BackendUnavailable as e:
+        return backend_unavailable(e)
 
     except Exception as e:
-        import traceback
-        print("Error:", e)
-        traceback.print_exc()
+        logger.exception("💥 Ошибка создания QR")
         return jsonify({"error": str(e)}), 500
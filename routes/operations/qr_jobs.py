@@ -0,0 +1,36 @@
+import logging
+
+from flask import Blueprint, jsonify
+from services.supabase_client import get_supabase
+from services.qr_jobs import DONE, FAILED, qr_jobs
+from .qr_status import authenticate_status
+
+qr_jobs_bp = Blueprint("qr_jobs", __name__)
+logger = logging.getLogger(__name__)
+
+
+# GET /qr-jobs/<job_id> — состояние задания асинхронного /qr-code
+@qr_jobs_bp.route("/<job_id>", methods=["GET"])
+def get_qr_job(job_id):
+    try:
+        supabase = get_supabase()
+
+        client, api_login, error = authenticate_status(supabase)
+        if error:
+            return error
+
+        # Чужое задание — как несуществующее
+        job = qr_jobs.get(job_id)
+        if not job or job["api_login"] != api_login:
+            return jsonify({"error": "Job not found"}), 404
+
+        response = {"job_id": job["id"], "status": job["state"], "attempts": job["attempts"]}
+        if job["state"] == DONE:
+            response["results"] = job["result"]
+        elif job["state"] == FAILED:
+            response["error"] = job["error"]
+        return jsonify(response), 200
+
+    except Exception as e:
+        logger.exception("❌ Ошибка проверки задания")
+        return jsonify({"error": str(e)}), 500
@@ -1,87 +1,74 @@
+import logging
+
 from flask import Blueprint, request, jsonify
-from supabase import create_client, Client
-import os
+from services.supabase_client import get_supabase
+from services.credentials import find_api_client, find_api_client_by_key
+from services.statuses import operation_status
+from services.status_cache import get_purchase
+from services.sandbox import sandbox_store
+from services.status_lookup import STATUS_LOOKUP_RPC, lookup_status
 
 qr_status_bp = Blueprint("qr_status", __name__)
+logger = logging.getLogger(__name__)
+
+
+# 🔐 Проверка ключей для status-роутов: (client, api_login, None) или (None, None, ответ с ошибкой)
+def authenticate_status(supabase):
+    # Получаем API-данные из заголовков
+    api_key = request.headers.get("X-Api-Key")
+    api_login = request.headers.get("X-Api-Login")
+
+    if not api_key and not api_login:
+        return None, None, (jsonify({"error": "Missing API credentials"}), 400)
+
+    # Если есть только ключ — ищем логин
+    if not api_login and api_key:
+        client_by_key = find_api_client_by_key(supabase, api_key)
+
+        if not client_by_key:
+            return None, None, (jsonify({"error": "Invalid API key"}), 401)
+
+        api_login = client_by_key["api_login"]
+
+    # Проверяем API-клиента (через общий кэш api_clients)
+    client = find_api_client(supabase, api_login, api_key)
+    if not client:
+        return None, None, (jsonify({"error": "Forbidden: invalid API credentials"}), 403)
+
+    return client, api_login, None
 
-# 🔑 Инициализация Supabase
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
 # GET /<opId>/qr-status
 @qr_status_bp.route("", methods=["GET"])
 def get_qr_status(opId):
     try:
-        # Получаем API-данные из заголовков
-        api_key = request.headers.get("X-Api-Key")
-        api_login = request.headers.get("X-Api-Login")
-
-        if not api_key and not api_login:
-            return jsonify({"error": "Missing API credentials"}), 400
-
-        # Если есть только ключ — ищем логин
-        if not api_login and api_key:
-            client_by_key = (
-                supabase.table("api_clients")
-                .select("api_login, test")
-                .eq("api_key", api_key)
-                .maybe_single()
-                .execute()
-                .data
-            )
+        supabase = get_supabase()
 
-            if not client_by_key:
-                return jsonify({"error": "Invalid API key"}), 401
-
-            api_login = client_by_key["api_login"]
-
-        # Проверяем API-клиента
-        client_resp = (
-            supabase.table("api_clients")
-            .select("api_login, api_key, test")
-            .eq("api_login", api_login)
-            .eq("api_key", api_key)
-            .maybe_single()
-            .execute()
-        )
-
-        client = client_resp.data
-        if not client:
-            return jsonify({"error": "Forbidden: invalid API credentials"}), 403
-
-        # 🔹 Определяем таблицу по режиму
-        table_name = "purchases_test" if client.get("test") else "purchases"
-
-        # 🔍 Ищем запись по opId и api_login
-        purchase_resp = (
-            supabase.table(table_name)
-            .select("status, commit")
-            .eq("api_login", api_login)
-            .eq("id", opId)
-            .maybe_single()
-            .execute()
-        )
-
-        purchase = purchase_resp.data
-        if not purchase:
+        # ⚡ Ключи, таблица и покупка одним запросом (sql/qr_status_lookup.sql)
+        if STATUS_LOOKUP_RPC:
+            _, purchase, error = lookup_status(
+                supabase, request.headers.get("X-Api-Login"), request.headers.get("X-Api-Key"), opId
+            )
+            if error:
+                status, message = error
+                return jsonify({"error": message}), status
+            return jsonify({"results": operation_status(purchase)}), 200
+
+        client, api_login, error = authenticate_status(supabase)
+        if error:
+            return error
+
+        # 🔍 Ищем запись по opId (тестовые — в sandbox, боевые — через кэш статусов) и сверяем api_login
+        if client.get("test"):
+            purchase = sandbox_store.get(supabase, opId)
+        else:
+            purchase = get_purchase(supabase, "purchases", opId)
+        if not purchase or purchase.get("api_login") != api_login:
             return jsonify({"error": "Purchase not found"}), 404
 
         # ✅ Определяем operation_status_code
-        status = purchase.get("status", "").lower() if purchase.get("status") else ""
-        commit_info = purchase.get("commit")
-
-        operation_status_code = 1  # По умолчанию "в процессе"
-        info = None
-
-        if status == "success":
-            operation_status_code = 5
-        elif status == "refund":
-            operation_status_code = 3
-            info = commit_info
-
-        return jsonify({"results": {"operation_status_code": operation_status_code, "info": info}}), 200
+        return jsonify({"results": operation_status(purchase)}), 200
 
     except Exception as e:
-        print("❌ Ошибка проверки статуса:", e)
+        logger.exception("❌ Ошибка проверки статуса")
         return jsonify({"error": str(e)}), 500
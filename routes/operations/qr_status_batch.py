@@ -0,0 +1,55 @@
+import logging
+
+from flask import Blueprint, request, jsonify
+from services.supabase_client import get_supabase
+from services.statuses import operation_status
+from services.status_cache import STATUS_BATCH_MAX, get_purchases
+from services.sandbox import sandbox_store
+from .qr_status import authenticate_status
+
+qr_status_batch_bp = Blueprint("qr_status_batch", __name__)
+logger = logging.getLogger(__name__)
+
+
+# POST /qr-status/batch  {"ids": ["opId1", "opId2", ...]}
+# Одна проверка ключей и один запрос WHERE id IN (...) вместо N вызовов /qr-status
+@qr_status_batch_bp.route("", methods=["POST"])
+def get_qr_status_batch():
+    try:
+        supabase = get_supabase()
+
+        client, api_login, error = authenticate_status(supabase)
+        if error:
+            return error
+
+        body = request.get_json(silent=True) or {}
+        ids = body.get("ids")
+        if not isinstance(ids, list) or not ids:
+            return jsonify({"error": "Field 'ids' must be a non-empty list"}), 400
+        if any(not isinstance(op_id, (str, int)) or isinstance(op_id, bool) for op_id in ids):
+            return jsonify({"error": "Field 'ids' must contain strings or numbers"}), 400
+
+        # Дубликаты убираем, порядок сохраняем
+        ids = list(dict.fromkeys(str(op_id) for op_id in ids))
+        if len(ids) > STATUS_BATCH_MAX:
+            return jsonify({"error": f"Too many ids: max {STATUS_BATCH_MAX}"}), 400
+
+        if client.get("test"):
+            purchases = sandbox_store.get_many(supabase, ids)
+        else:
+            purchases = get_purchases(supabase, "purchases", ids)
+
+        # Чужие операции отдаём как ненайденные — так же, как 404 в /qr-status
+        results, not_found = [], []
+        for op_id in ids:
+            purchase = purchases.get(op_id)
+            if not purchase or purchase.get("api_login") != api_login:
+                not_found.append(op_id)
+                continue
+            results.append({"operation_id": op_id, **operation_status(purchase)})
+
+        return jsonify({"results": results, "not_found": not_found}), 200
+
+    except Exception as e:
+        logger.exception("❌ Ошибка пакетной проверки статусов")
+        return jsonify({"error": str(e)}), 500
@@ -1,24 +1,27 @@
 from flask import Blueprint, request, jsonify
-from supabase import create_client, Client
+from services.supabase_client import get_supabase
+from services.http_client import outbound
+from services.idempotency import idempotent
+import logging
 import os
 import requests
 import uuid
 from datetime import datetime
 
 pikmi_bp = Blueprint("pikmi", __name__)
-
-# 🔑 Настройки Supabase
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+logger = logging.getLogger(__name__)
 
 # 🔐 API-ключ для запроса к Birs
 BIRS_API_KEY = os.environ.get("BIRS_API_KEY")  # Хранится в Render env vars
+BIRS_API_URL = os.environ.get("BIRS_API_URL", "https://admin.birs.app/v2.1/payment-test/create-link-payment")
 
 
 @pikmi_bp.route("/", methods=["POST"])
+@idempotent("order")
 def create_order():
     try:
+        supabase = get_supabase()
+
         data = request.get_json()
         if not data:
             return jsonify({"error": "Missing JSON body"}), 400
@@ -48,19 +51,17 @@ def create_order():
         }
 
         # 🌍 Отправляем запрос к Birs API
-        response = requests.post(
-            "https://admin.birs.app/v2.1/payment-test/create-link-payment",
+        response = outbound.post(
+            BIRS_API_URL,
             json=payload,
             headers=headers,
-            timeout=20,
         )
 
         birs_data = response.json()
 
         # 🚨 Обрабатываем неуспешные ответы
         if not birs_data.get("success", False):
-            print("❌ Ошибка при создании платежа через Birs API:")
-            print(birs_data)
+            logger.warning("❌ Ошибка при создании платежа через Birs API", extra={"birs_response": birs_data})
             return jsonify({"error": birs_data.get("message", "Unknown error")}), 400
 
         # ✅ Успешный ответ
@@ -90,12 +91,8 @@ def create_order():
             "commit": None,
         }
 
-        # 💾 Добавляем запись в Supabase
-        result = supabase.table("purchases").insert(insert_data).execute()
-
-        if result.error:
-            print("❌ Ошибка при вставке в purchases:", result.error)
-            return jsonify({"error": "Database insert failed"}), 500
+        # 💾 Добавляем запись в Supabase (ошибка PostgREST — исключение, ловится ниже)
+        supabase.table("purchases").insert(insert_data).execute()
 
         # 📦 Возвращаем успешный ответ
         return (
@@ -112,9 +109,9 @@ def create_order():
         )
 
     except requests.exceptions.RequestException as e:
-        print("🌐 Ошибка соединения с Birs API:", e)
+        logger.warning("🌐 Ошибка соединения с Birs API: %s", e)
         return jsonify({"error": "Failed to connect to Birs API"}), 502
 
     except Exception as e:
-        print("💥 Неожиданная ошибка:", e)
+        logger.exception("💥 Неожиданная ошибка")
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,127 @@
+import datetime
+import logging
+
+from flask import Blueprint, Response, request, jsonify
+from services.profiling import CPROFILE, MODES, PROFILING_MAX_DURATION, SAMPLE, profiler
+from services.admin import admin_only
+
+# 🔐 Все маршруты — только с X-Admin-Token (services/admin.py); без ADMIN_TOKEN их как будто нет
+profiling_bp = Blueprint("profiling", __name__)
+logger = logging.getLogger(__name__)
+
+
+def _rule_view(rule):
+    expires_at = datetime.datetime.utcfromtimestamp(rule["expires_at"]).isoformat()
+    return {**rule, "expires_at": expires_at}
+
+
+# POST /profiling/rules {"route": "/api/operations/qr-code/", "api_login": "...", "sample_rate": 0.1,
+#                        "mode": "cprofile|sample", "duration": 300}
+@profiling_bp.route("/rules", methods=["POST"])
+@admin_only
+def add_rule():
+    try:
+        body = request.get_json(silent=True) or {}
+
+        route, api_login = body.get("route") or None, body.get("api_login") or None
+        if route is None and api_login is None:
+            return jsonify({"error": "Rule needs 'route' and/or 'api_login'"}), 400
+
+        sample_rate = body.get("sample_rate", 1.0)
+        if not isinstance(sample_rate, (int, float)) or isinstance(sample_rate, bool) or not 0 < sample_rate <= 1:
+            return jsonify({"error": "Invalid sample_rate: must be in (0, 1]"}), 400
+
+        mode = body.get("mode", CPROFILE)
+        if mode not in MODES:
+            return jsonify({"error": f"Invalid mode: expected one of {', '.join(MODES)}"}), 400
+
+        duration = body.get("duration", 300)
+        if not isinstance(duration, (int, float)) or isinstance(duration, bool) or not 0 < duration <= PROFILING_MAX_DURATION:
+            return jsonify({"error": f"Invalid duration: must be in (0, {PROFILING_MAX_DURATION:g}] seconds"}), 400
+
+        rule = profiler.add_rule(route, api_login, float(sample_rate), mode, float(duration))
+        logger.info("🔬 Правило профилирования", extra={"rule": rule})
+        return jsonify(_rule_view(rule)), 201
+
+    except Exception as e:
+        logger.exception("❌ Ошибка профилирования")
+        return jsonify({"error": str(e)}), 500
+
+
+@profiling_bp.route("/rules", methods=["GET"])
+@admin_only
+def list_rules():
+    try:
+        return jsonify({"rules": [_rule_view(rule) for rule in profiler.list_rules()]}), 200
+
+    except Exception as e:
+        logger.exception("❌ Ошибка профилирования")
+        return jsonify({"error": str(e)}), 500
+
+
+# DELETE /profiling/rules — все правила, /profiling/rules/<id> — одно
+@profiling_bp.route("/rules", methods=["DELETE"], defaults={"rule_id": None})
+@profiling_bp.route("/rules/<rule_id>", methods=["DELETE"])
+@admin_only
+def delete_rule(rule_id):
+    try:
+        deleted = profiler.delete_rule(rule_id)
+        if rule_id is not None and not deleted:
+            return jsonify({"error": "Rule not found"}), 404
+        return jsonify({"deleted": deleted}), 200
+
+    except Exception as e:
+        logger.exception("❌ Ошибка профилирования")
+        return jsonify({"error": str(e)}), 500
+
+
+@profiling_bp.route("/profiles", methods=["GET"])
+@admin_only
+def list_profiles():
+    try:
+        profiles = profiler.list_profiles(request.args.get("route"))
+        for profile in profiles:
+            profile["created"] = datetime.datetime.utcfromtimestamp(profile["created"]).isoformat()
+            profile["format"] = MODES[profile["mode"]]
+        return jsonify({"profiles": profiles}), 200
+
+    except Exception as e:
+        logger.exception("❌ Ошибка профилирования")
+        return jsonify({"error": str(e)}), 500
+
+
+def _download(data, fmt, name):
+    if fmt == "pstats":
+        return Response(data, mimetype="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{name}.pstats"'})
+    return Response(data, mimetype="text/plain",
+                    headers={"Content-Disposition": f'attachment; filename="{name}.collapsed.txt"'})
+
+
+# GET /profiling/profiles/<id> — профиль в формате своего режима (cprofile -> pstats, sample -> collapsed)
+# GET /profiling/profiles/all?format=pstats|collapsed[&route=...] — сумма по кольцевому буферу
+@profiling_bp.route("/profiles/<profile_id>", methods=["GET"])
+@admin_only
+def download_profile(profile_id):
+    try:
+        route = request.args.get("route")
+        if profile_id == "all":
+            fmt = request.args.get("format", "pstats")
+            if fmt not in MODES.values():
+                return jsonify({"error": "Invalid format: expected pstats or collapsed"}), 400
+            data = profiler.export_pstats(route=route) if fmt == "pstats" else profiler.export_collapsed(route=route)
+            if data is None:
+                return jsonify({"error": "No profiles"}), 404
+            return _download(data, fmt, "profiles")
+
+        data = profiler.export_pstats(profile_id)
+        fmt = MODES[CPROFILE]
+        if data is None:
+            data, fmt = profiler.export_collapsed(profile_id), MODES[SAMPLE]
+        if data is None:
+            return jsonify({"error": "Profile not found"}), 404
+        return _download(data, fmt, profile_id)
+
+    except Exception as e:
+        logger.exception("❌ Ошибка профилирования")
+        return jsonify({"error": str(e)}), 500
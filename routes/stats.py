@@ -0,0 +1,40 @@
+from flask import Blueprint, jsonify
+from services.credentials import credentials_cache
+from services.status_cache import status_cache
+from services.http_client import outbound
+from services.webhook_queue import webhook_queue
+from services.status_hub import status_hub
+from services.limits import limit_engine
+from services.idempotency import idempotency_store
+from services.circuit_breaker import backend_breakers
+from services.rate_limit import rate_limiter
+from services.sandbox import sandbox_store
+from services.reconciler import reconciler
+from services.qr_jobs import qr_jobs
+from services.profiling import profiler
+from services import log
+from services.admin import admin_only
+
+stats_bp = Blueprint("stats", __name__)
+
+
+# 📊 Счётчики кэшей и исходящих запросов текущего воркера (X-Admin-Token)
+@stats_bp.route("/", methods=["GET"])
+@admin_only
+def get_stats():
+    return jsonify({
+        "credentials_cache": credentials_cache.stats(),
+        "status_cache": status_cache.stats(),
+        "outbound": outbound.stats(),
+        "webhook_queue": webhook_queue.stats(),
+        "status_hub": status_hub.stats(),
+        "limits": limit_engine.stats(),
+        "idempotency": idempotency_store.stats(),
+        "backends": backend_breakers.stats(),
+        "admission": rate_limiter.stats(),
+        "sandbox": sandbox_store.stats(),
+        "reconciler": reconciler.stats(),
+        "qr_jobs": qr_jobs.stats(),
+        "profiling": profiler.stats(),
+        "logging": log.stats(),
+    }), 200
@@ -1,15 +1,12 @@
 from flask import Blueprint, request, jsonify
-from supabase import create_client, Client
-import os
+from services.supabase_client import get_supabase
+from services.sandbox import sandbox_store
+import logging
 import uuid
 from datetime import datetime
 
 test_bp = Blueprint("test", __name__)
-
-# 🔑 Настройки Supabase
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+logger = logging.getLogger(__name__)
 
 
 # ✅ Проверка, что сервер работает
@@ -22,8 +19,11 @@ def root_check():
 @test_bp.route("/", methods=["POST"])
 def test_order():
     try:
+        supabase = get_supabase()
+
         data = request.get_json()
-        print("📥 Incoming request body:", data)
+        # Тела запроса/ответа — только на DEBUG, api_key вырезается при форматировании
+        logger.debug("📥 Incoming request body", extra={"body": data})
 
         if not data:
             return jsonify({"error": "Missing JSON body"}), 400
@@ -39,7 +39,7 @@ def test_order():
 
         # 🔹 Если ping → вернуть pong
         if steam_id == "ping":
-            print("Ping received, returning pong")
+            logger.debug("Ping received, returning pong")
             return jsonify({"pong": True}), 200
 
         # 💰 Делим сумму на 100
@@ -51,7 +51,7 @@ def test_order():
         qr_payload = f"https://fake-qr.com/{qr_id}"
         now = datetime.utcnow().isoformat()
 
-        # 💾 Вставляем тестовую запись
+        # 💾 Вставляем тестовую запись (sandbox: в памяти хоста или purchases_test)
         insert_data = {
             "id": operation_id,
             "amount": amount_rub,
@@ -64,11 +64,7 @@ def test_order():
             "commit": None,
         }
 
-        result = supabase.table("purchases_test").insert(insert_data).execute()
-
-        if result.error:
-            print("❌ Supabase insert error:", result.error)
-            return jsonify({"error": "Database error"}), 500
+        sandbox_store.create(supabase, insert_data)
 
         response_payload = {
             "result": {
@@ -78,9 +74,9 @@ def test_order():
             }
         }
 
-        print("📤 Response payload:", response_payload)
+        logger.debug("📤 Response payload", extra={"body": response_payload})
         return jsonify(response_payload), 201
 
     except Exception as e:
-        print("💥 Server error:", e)
+        logger.exception("💥 Server error")
         return jsonify({"error": "Internal server error"}), 500
@@ -1,18 +1,22 @@
+import logging
+
 from flask import Blueprint, request, jsonify
-from supabase import create_client, Client
-import os
+from services.supabase_client import get_supabase
+from services.webhook_queue import webhook_queue
+from services.status_cache import remember_purchase
+from services.statuses import provider_status
+from services.sandbox import sandbox_store
+from services.admin import admin_only
 
 webhook_bp = Blueprint("webhook", __name__)
-
-# 🔑 Настройки Supabase
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+logger = logging.getLogger(__name__)
 
 
 @webhook_bp.route("/", methods=["POST"])
 def handle_webhook():
     try:
+        supabase = get_supabase()
+
         data = request.get_json()
         if not data:
             return jsonify({"error": "Missing JSON body"}), 400
@@ -23,16 +27,20 @@ def handle_webhook():
         if not payment_id or not status:
             return jsonify({"error": "Missing required fields (id, status)"}), 400
 
-        # 🧩 Приводим статус к нижнему регистру для надёжности
-        normalized_status = status.strip().lower()
-
-        if normalized_status == "settlement":
-            new_status = "success"
-        elif normalized_status in ["failed", "expired"]:
-            new_status = "cancelled"
-        else:
+        # 🧩 settlement -> success, failed/expired -> cancelled (та же таблица, что у сверки)
+        new_status = provider_status(status)
+        if new_status is None:
             return jsonify({"error": f"Unknown status value: {status}"}), 400
 
+        # 🧪 Тестовая покупка: обновляем sandbox, в БД не ходим
+        if sandbox_store.update_status(supabase, payment_id, new_status):
+            return jsonify({"success": True, "id": payment_id, "new_status": new_status, "sandbox": True}), 200
+
+        # 📦 Пакетный режим: подтверждаем после записи в локальный журнал, в БД — пачкой
+        if webhook_queue.enabled:
+            webhook_queue.append(supabase, payment_id, new_status)
+            return jsonify({"success": True, "id": payment_id, "new_status": new_status, "queued": True}), 202
+
         # 💾 Обновляем запись в Supabase
         update_result = (
             supabase.table("purchases")
@@ -45,10 +53,21 @@ def handle_webhook():
         if not update_result.data:
             return jsonify({"error": "Purchase not found"}), 404
 
-        print(f"✅ Webhook: updated {payment_id} → {new_status}")
+        # ♻️ Освежаем кэш статусов для /qr-status
+        for row in update_result.data:
+            remember_purchase(row)
+
+        logger.info("✅ Webhook: purchase updated", extra={"payment_id": payment_id, "new_status": new_status})
 
         return jsonify({"success": True, "id": payment_id, "new_status": new_status}), 200
 
     except Exception as e:
-        print("💥 Ошибка обработки webhook:", e)
+        logger.exception("💥 Ошибка обработки webhook")
         return jsonify({"error": str(e)}), 500
+
+
+# 📋 Состояние пакетного режима и id, для которых не нашлось покупки (X-Admin-Token)
+@webhook_bp.route("/unmatched", methods=["GET"])
+@admin_only
+def webhook_unmatched():
+    return jsonify({"stats": webhook_queue.stats(), "unmatched": webhook_queue.recent_unmatched()}), 200
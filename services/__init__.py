@@ -0,0 +1 @@
+# Общие сервисы для маршрутов: кэши, клиенты внешних систем и т.п.
@@ -0,0 +1,23 @@
+import functools
+import hmac
+import os
+
+from flask import jsonify, request
+
+# 🔐 Служебные маршруты (статистика, отчёты, профилирование) — только с X-Admin-Token.
+# Без ADMIN_TOKEN они отвечают 404, как будто их нет
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+ADMIN_HEADER = "X-Admin-Token"
+
+
+def admin_allowed(token, expected=ADMIN_TOKEN):
+    return bool(expected) and hmac.compare_digest((token or "").encode(), expected.encode())
+
+
+def admin_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not admin_allowed(request.headers.get(ADMIN_HEADER)):
+            return jsonify({"error": "Endpoint not found"}), 404
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+# Маркер "в кэше ничего нет" (None — это валидное отрицательное значение)
+MISSING = object()
+
+
+# 🧠 Потокобезопасный TTL + LRU кэш с отрицательными записями
+class TTLCache:
+    def __init__(self, maxsize, ttl, negative_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return MISSING
+
+            self._data.move_to_end(key)
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+    # 👀 Значение без учёта в статистике и без продления LRU (MISSING, если нет или истекло)
+    def peek(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return MISSING
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl if value is not None else self.negative_ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            stale = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+            for key in stale:
+                del self._data[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.negative_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            }
+
+
+# 🚦 Один запрос на ключ: параллельные промахи по тому же ключу ждут первый.
+# Только для кода в event loop (async-пути ASGI-режима).
+class InFlight:
+    def __init__(self):
+        self._futures = {}
+
+    async def run(self, key, load):
+        future = self._futures.get(key)
+        if future is None:
+            future = asyncio.ensure_future(load())
+            self._futures[key] = future
+            future.add_done_callback(lambda _: self._futures.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(future)
+
+    def __len__(self):
+        return len(self._futures)
@@ -0,0 +1,306 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+
+from prometheus_client import Counter, Gauge
+
+from .http_client import OUTBOUND_CONNECT_TIMEOUT, OUTBOUND_POOL_SIZE, backend_label
+from .local_store import shared_path
+
+# 🔌 Предохранитель на каждый second_server_url мерчанта: зависший backend одного клиента
+# не должен занимать воркеры и ломать создание QR всем остальным.
+# closed — вызовы идут; open — отказ сразу, без сети; half_open — пробные вызовы решают, закрыться ли.
+
+# Скользящее окно: доля ошибок и доля медленных вызовов за последние WINDOW секунд
+BACKEND_BREAKER_WINDOW = int(os.environ.get("BACKEND_BREAKER_WINDOW", 30))
+BACKEND_BREAKER_MIN_CALLS = int(os.environ.get("BACKEND_BREAKER_MIN_CALLS", 10))
+BACKEND_BREAKER_ERROR_RATE = float(os.environ.get("BACKEND_BREAKER_ERROR_RATE", 0.5))
+BACKEND_BREAKER_SLOW_CALL = float(os.environ.get("BACKEND_BREAKER_SLOW_CALL", 1))
+BACKEND_BREAKER_SLOW_RATE = float(os.environ.get("BACKEND_BREAKER_SLOW_RATE", 0.8))
+
+# Сколько держим open до пробных вызовов и сколько проб пускаем одновременно
+BACKEND_BREAKER_OPEN_TIME = float(os.environ.get("BACKEND_BREAKER_OPEN_TIME", 15))
+BACKEND_BREAKER_PROBES = int(os.environ.get("BACKEND_BREAKER_PROBES", 1))
+
+# ⏱ Таймаут ответа backend'а мерчанта: зависший backend набирает ошибки и медленные вызовы
+# за 1–2 с и открывает предохранитель, а не держит поток OUTBOUND_READ_TIMEOUT
+BACKEND_READ_TIMEOUT = float(os.environ.get("BACKEND_READ_TIMEOUT", 2))
+BACKEND_TIMEOUT = (min(OUTBOUND_CONNECT_TIMEOUT, BACKEND_READ_TIMEOUT), BACKEND_READ_TIMEOUT)
+
+# 🚧 Bulkhead: одновременных вызовов одного backend'а на весь хост (все воркеры).
+# По умолчанию — четверть потоков обработки запросов хоста (SERVER_THREADS: gunicorn.conf.py выставляет
+# workers × threads в post_fork): пока зависший backend не отключён, остальным мерчантам остаются 3/4 потоков.
+# Без gunicorn (uvicorn, ASGI) потоки не занимаются — предел как у пула соединений на хост.
+def backend_max_concurrency():
+    if os.environ.get("BACKEND_MAX_CONCURRENCY"):
+        return int(os.environ["BACKEND_MAX_CONCURRENCY"])
+    if os.environ.get("SERVER_THREADS"):
+        return max(2, int(os.environ["SERVER_THREADS"]) // 4)
+    return OUTBOUND_POOL_SIZE
+
+BACKEND_BULKHEAD_DIR = os.environ.get("BACKEND_BULKHEAD_DIR", shared_path("phantom-bulkheads"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = Gauge(
+    "phantom_backend_breaker_state", "Состояние предохранителя backend'а (метка — хэш URL): 0 closed, 1 half_open, 2 open",
+    ["backend"], multiprocess_mode="max",
+)
+BREAKER_REJECTED = Counter(
+    "phantom_backend_rejected_total", "Вызовы backend'а, отклонённые без сети",
+    ["backend", "reason"],
+)
+
+
+# ⛔ Backend недоступен: предохранитель открыт или все слоты bulkhead'а заняты
+class BackendUnavailable(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# 🧮 Счётчики по секундам: окно любой длины за O(WINDOW) памяти
+class RollingWindow:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._buckets = deque()
+
+    def _trim(self, now):
+        while self._buckets and self._buckets[0][0] <= now - self.seconds:
+            self._buckets.popleft()
+
+    def add(self, failed, slow, now):
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0, 0])
+        bucket = self._buckets[-1]
+        bucket[1] += 1
+        bucket[2] += failed
+        bucket[3] += slow
+        self._trim(now)
+
+    def totals(self, now):
+        self._trim(now)
+        calls = failures = slow = 0
+        for _, bucket_calls, bucket_failures, bucket_slow in self._buckets:
+            calls += bucket_calls
+            failures += bucket_failures
+            slow += bucket_slow
+        return calls, failures, slow
+
+    def clear(self):
+        self._buckets.clear()
+
+
+# 🚧 Слоты bulkhead'а — файлы с flock: общие для всех воркеров хоста,
+# слот упавшего процесса ядро освобождает само
+class Bulkhead:
+    def __init__(self, name, size, directory=BACKEND_BULKHEAD_DIR):
+        self.size = size
+        self._paths = [os.path.join(directory, f"{name}-{slot}.lock") for slot in range(size)]
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self):
+        for path in self._paths:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @staticmethod
+    def release(fd):
+        # Закрытие дескриптора снимает flock
+        os.close(fd)
+
+
+class CircuitBreaker:
+    def __init__(self, backend, window=BACKEND_BREAKER_WINDOW, min_calls=BACKEND_BREAKER_MIN_CALLS,
+                 error_rate=BACKEND_BREAKER_ERROR_RATE, slow_call=BACKEND_BREAKER_SLOW_CALL,
+                 slow_rate=BACKEND_BREAKER_SLOW_RATE, open_time=BACKEND_BREAKER_OPEN_TIME,
+                 probes=BACKEND_BREAKER_PROBES, max_concurrency=None):
+        self.backend = backend
+        self.label = backend_label(backend)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_time = open_time
+        self.probes = probes
+
+        # Предохранители создаются при первом вызове в воркере — SERVER_THREADS к этому времени известен
+        self.bulkhead = Bulkhead(
+            hashlib.sha1(backend.encode()).hexdigest()[:16], max_concurrency or backend_max_concurrency()
+        )
+        self._window = RollingWindow(window)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._in_flight = 0
+
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    # 🚦 Пускаем вызов? (probe, None) или (None, причина отказа)
+    def _admit(self, now):
+        with self._lock:
+            if self._state == OPEN:
+                if now - self._opened_at < self.open_time:
+                    return None, OPEN
+                self._set_state(HALF_OPEN)
+
+            if self._state == HALF_OPEN:
+                if self._probes_in_flight >= self.probes:
+                    return None, HALF_OPEN
+                self._probes_in_flight += 1
+                return True, None
+
+            return False, None
+
+    def _set_state(self, state):
+        self._state = state
+        BREAKER_STATE.labels(self.label).set(_STATE_VALUES[state])
+
+    # ⚡ Дешёвая проверка до любой работы с БД: открытый предохранитель — отказ сразу
+    def check(self):
+        if self._state != OPEN:
+            return
+        elapsed = time.monotonic() - self._opened_at
+        if elapsed < self.open_time:
+            self._reject(OPEN, f"Backend {self.backend} is unavailable (circuit open)", self.open_time - elapsed)
+
+    def _reject(self, reason, message, retry_after=None):
+        with self._lock:
+            self.rejected += 1
+        BREAKER_REJECTED.labels(self.label, reason).inc()
+        raise BackendUnavailable(message, retry_after)
+
+    def _acquire(self, wait):
+        now = time.monotonic()
+        probe, refused = self._admit(now)
+        if refused:
+            retry_after = max(0.0, self.open_time - (now - self._opened_at))
+            self._reject(refused, f"Backend {self.backend} is unavailable (circuit {refused})", retry_after)
+
+        deadline = now + wait
+        while True:
+            fd = self.bulkhead.try_acquire()
+            if fd is not None:
+                break
+            if time.monotonic() >= deadline:
+                if probe:
+                    with self._lock:
+                        self._probes_in_flight -= 1
+                self._reject(
+                    "bulkhead",
+                    f"Backend {self.backend} is busy: {self.bulkhead.size} requests already in flight",
+                    1,
+                )
+            time.sleep(0.01)
+
+        with self._lock:
+            self._in_flight += 1
+        return probe, fd
+
+    def _finish(self, probe, fd, started, failed):
+        self.bulkhead.release(fd)
+        now = time.monotonic()
+        slow = now - started >= self.slow_call
+
+        with self._lock:
+            self._in_flight -= 1
+            self.calls += 1
+            self.failures += failed
+
+            if probe:
+                self._probes_in_flight -= 1
+                if failed or slow:
+                    self._trip(now)
+                elif self._state == HALF_OPEN:
+                    # Проба прошла — закрываемся с чистым окном
+                    self._window.clear()
+                    self._set_state(CLOSED)
+                return
+
+            if self._state != CLOSED:
+                return
+            self._window.add(failed, slow, now)
+            calls, failures, slow_calls = self._window.totals(now)
+            if calls >= self.min_calls and (
+                failures / calls >= self.error_rate or slow_calls / calls >= self.slow_rate
+            ):
+                self._trip(now)
+
+    def _trip(self, now):
+        self._opened_at = now
+        self.opened += 1
+        self._set_state(OPEN)
+
+    # 🛡 with breaker.call(): ...  — исключение внутри блока считается ошибкой backend'а.
+    # wait — сколько ждать свободный слот bulkhead'а (пакетная рассылка), по умолчанию отказ сразу.
+    @contextlib.contextmanager
+    def call(self, wait=0.0):
+        probe, fd = self._acquire(wait)
+        started = time.monotonic()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self._finish(probe, fd, started, failed)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            calls, failures, slow = self._window.totals(now)
+            return {
+                "state": self._state,
+                "window_calls": calls,
+                "window_failures": failures,
+                "window_slow": slow,
+                "in_flight": self._in_flight,
+                "calls": self.calls,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "opened": self.opened,
+            }
+
+
+# 🗂 Предохранители по URL, создаются при первом вызове
+class BreakerRegistry:
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, backend):
+        breaker = self._breakers.get(backend)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(backend)
+                if breaker is None:
+                    breaker = self._breakers[backend] = CircuitBreaker(backend)
+        return breaker
+
+    def call(self, backend, wait=0.0):
+        return self.get(backend).call(wait)
+
+    def check(self, backend):
+        self.get(backend).check()
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {breaker.label: breaker.stats() for breaker in breakers.values()}
+
+
+backend_breakers = BreakerRegistry()
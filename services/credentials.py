@@ -0,0 +1,136 @@
+import hashlib
+import os
+
+from .cache import MISSING, InFlight, TTLCache
+from .metrics import timed
+
+# ⚙️ Настройки кэша API-клиентов (TTL в секундах, 0 — кэш выключен)
+CREDENTIALS_CACHE_TTL = float(os.environ.get("CREDENTIALS_CACHE_TTL", 60))
+CREDENTIALS_NEGATIVE_TTL = float(os.environ.get("CREDENTIALS_NEGATIVE_TTL", 10))
+CREDENTIALS_CACHE_SIZE = int(os.environ.get("CREDENTIALS_CACHE_SIZE", 1024))
+
+# Все колонки api_clients, которые нужны маршрутам — одна запись на оба роута
+API_CLIENT_COLUMNS = "id, api_login, api_key, second_server_url, test"
+
+# 🔑 Общий кэш: (api_login, api_key) -> строка api_clients или None
+credentials_cache = TTLCache(
+    maxsize=CREDENTIALS_CACHE_SIZE,
+    ttl=CREDENTIALS_CACHE_TTL,
+    negative_ttl=CREDENTIALS_NEGATIVE_TTL,
+)
+_inflight = InFlight()
+
+# 🪪 Отпечатки пар логин + ключ, уже прошедших проверку: по ним лимит частоты (services/rate_limit.py)
+# ведёт корзину мерчанта. Это не кэш авторизации — от CREDENTIALS_CACHE_TTL не зависит
+CREDENTIALS_VERIFIED_TTL = float(os.environ.get("CREDENTIALS_VERIFIED_TTL", 3600))
+verified_credentials = TTLCache(maxsize=max(CREDENTIALS_CACHE_SIZE, 1024), ttl=CREDENTIALS_VERIFIED_TTL)
+
+
+def credentials_fingerprint(api_login, api_key):
+    return hashlib.sha256(f"{api_login or ''}\0{api_key}".encode()).hexdigest()[:16]
+
+
+# 🧱 Запрос к api_clients (одинаковый для sync и async клиентов PostgREST)
+def _client_query(db, api_login, api_key):
+    query = db.table("api_clients").select(API_CLIENT_COLUMNS).eq("api_key", api_key)
+    if api_login:
+        query = query.eq("api_login", api_login)
+    return query.maybe_single()
+
+
+# 💾 Строка api_clients (или None) под ключом (api_login, api_key) / (None, api_key)
+def remember_client(key, client):
+    credentials_cache.set(key, client)
+    if client:
+        verified_credentials.set(credentials_fingerprint(*key), True)
+    if client and key[0] is None:
+        # Найденная по ключу строка заодно подтверждает пару логин + ключ
+        credentials_cache.set((client["api_login"], key[1]), client)
+        verified_credentials.set(credentials_fingerprint(client["api_login"], key[1]), True)
+    return client
+
+
+def _remember(key, resp):
+    return remember_client(key, (resp.data if resp else None) or None)
+
+
+# 🔍 Проверка пары логин + ключ
+@timed("credentials", "login_key")
+def find_api_client(supabase, api_login, api_key):
+    if not api_login or not api_key:
+        return None
+
+    key = (api_login, api_key)
+    cached = credentials_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    return _remember(key, _client_query(supabase, api_login, api_key).execute())
+
+
+# 🔍 Поиск клиента только по ключу (когда X-Api-Login не передан)
+@timed("credentials", "key")
+def find_api_client_by_key(supabase, api_key):
+    if not api_key:
+        return None
+
+    key = (None, api_key)
+    cached = credentials_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    return _remember(key, _client_query(supabase, None, api_key).execute())
+
+
+# 🔍 Строка api_clients по одному логину — для фоновых заданий, которые не хранят ключ мерчанта
+@timed("credentials", "login")
+def find_api_client_by_login(supabase, api_login):
+    resp = supabase.table("api_clients").select(API_CLIENT_COLUMNS).eq("api_login", api_login).maybe_single().execute()
+    return (resp.data if resp else None) or None
+
+
+# ⚡ Те же проверки для async-режима (AsyncPostgrestClient);
+# параллельные промахи по одной паре ключей ждут один общий запрос
+async def find_api_client_async(postgrest, api_login, api_key):
+    if not api_login or not api_key:
+        return None
+
+    key = (api_login, api_key)
+    cached = credentials_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    async def load():
+        return _remember(key, await _client_query(postgrest, api_login, api_key).execute())
+
+    return await _inflight.run(key, load)
+
+
+async def find_api_client_by_key_async(postgrest, api_key):
+    if not api_key:
+        return None
+
+    key = (None, api_key)
+    cached = credentials_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    async def load():
+        return _remember(key, await _client_query(postgrest, None, api_key).execute())
+
+    return await _inflight.run(key, load)
+
+
+# 🧹 Явная инвалидация (смена ключа, удаление клиента и т.п.)
+def invalidate_credentials(api_login=None, api_key=None):
+    verified_credentials.clear()
+    if api_login is None and api_key is None:
+        credentials_cache.clear()
+        return
+
+    def matches(key, client):
+        cached_login, cached_key = key
+        login = cached_login or (client or {}).get("api_login")
+        return (api_login is None or login == api_login) and (api_key is None or cached_key == api_key)
+
+    credentials_cache.invalidate_where(matches)
@@ -0,0 +1,216 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.retry import Retry
+
+from .metrics import observe_stage
+
+# ⚙️ Таймауты и пулы исходящих запросов (Birs, second_server_url клиентов)
+OUTBOUND_CONNECT_TIMEOUT = float(os.environ.get("OUTBOUND_CONNECT_TIMEOUT", 3.05))
+OUTBOUND_READ_TIMEOUT = float(os.environ.get("OUTBOUND_READ_TIMEOUT", 15))
+OUTBOUND_POOL_SIZE = int(os.environ.get("OUTBOUND_POOL_SIZE", 32))
+OUTBOUND_RETRIES = int(os.environ.get("OUTBOUND_RETRIES", 2))
+OUTBOUND_BACKOFF = float(os.environ.get("OUTBOUND_BACKOFF", 0.1))
+OUTBOUND_ASYNC_POOL_SIZE = int(os.environ.get("OUTBOUND_ASYNC_POOL_SIZE", 100))
+
+# Сколько последних замеров держим на каждый хост для перцентилей
+LATENCY_WINDOW = 1000
+
+
+# 🎲 Экспоненциальная пауза между повторами с полным джиттером
+class JitterRetry(Retry):
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff else backoff
+
+
+def _make_retry():
+    # connect — запрос ещё не ушёл, повтор безопасен даже для POST;
+    # read/status повторяются только для идемпотентных методов (GET, PUT, DELETE...)
+    return JitterRetry(
+        total=OUTBOUND_RETRIES,
+        connect=OUTBOUND_RETRIES,
+        read=OUTBOUND_RETRIES,
+        status=OUTBOUND_RETRIES,
+        other=0,
+        status_forcelist=(502, 503, 504),
+        backoff_factor=OUTBOUND_BACKOFF,
+        raise_on_status=False,
+    )
+
+
+# 🚫 Запрос точно не ушёл: соединение так и не установлено — повтор безопасен даже для POST
+def request_not_sent(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", None), (ConnectTimeoutError, NewConnectionError))
+    return False
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+# 🏷 Короткое имя backend'а для метрик и /api/stats: URL мерчанта не публикуем
+def backend_label(backend):
+    return hashlib.sha1(backend.encode()).hexdigest()[:12]
+
+
+# 📈 Статистика по одному хосту (в метриках и stats — под backend_label хоста)
+class TargetStats:
+    def __init__(self, label):
+        self.label = label
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, elapsed_ms, ok):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.latencies.append(elapsed_ms)
+
+    def snapshot(self):
+        window = sorted(self.latencies)
+        pick = lambda q: window[min(len(window) - 1, int(len(window) * q))] if window else 0.0
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_ms": self.total_ms / self.requests if self.requests else 0.0,
+            "p50_ms": pick(0.5),
+            "p99_ms": pick(0.99),
+            "max_ms": self.max_ms,
+        }
+
+
+# 🌍 Исходящий HTTP-клиент: отдельная keep-alive сессия на каждый хост
+class OutboundClient:
+    def __init__(self, pool_size=OUTBOUND_POOL_SIZE, timeout=(OUTBOUND_CONNECT_TIMEOUT, OUTBOUND_READ_TIMEOUT)):
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self._sessions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _session(self, origin):
+        session = self._sessions.get(origin)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(origin)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=_make_retry())
+                    session.mount(origin, adapter)
+                    self._sessions[origin] = session
+                    self._stats[origin] = TargetStats(backend_label(origin))
+        return session
+
+    def request(self, method, url, timeout=None, **kwargs):
+        origin = _origin(url)
+        session = self._session(origin)
+
+        started = time.perf_counter()
+        ok = False
+        try:
+            response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            ok = response.status_code < 500
+            return response
+        finally:
+            self._record(origin, started, ok)
+
+    def _record(self, origin, started, ok):
+        stats = self._stats[origin]
+        observe_stage("outbound", stats.label, started, ok)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            stats.record(elapsed_ms, ok)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {stats.label: stats.snapshot() for stats in self._stats.values()}
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# ⚡ То же для ASGI-режима: отдельный httpx.AsyncClient на каждый хост
+class AsyncOutboundClient(OutboundClient):
+    def __init__(self, pool_size=OUTBOUND_ASYNC_POOL_SIZE, **kwargs):
+        super().__init__(pool_size=pool_size, **kwargs)
+
+    @staticmethod
+    def _timeout(timeout):
+        import httpx
+
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        return httpx.Timeout(read, connect=connect)
+
+    def _session(self, origin):
+        session = self._sessions.get(origin)
+        if session is None:
+            import httpx
+
+            # httpx повторяет только ошибки соединения — запрос при этом не уходил
+            transport = httpx.AsyncHTTPTransport(
+                retries=OUTBOUND_RETRIES,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+            session = httpx.AsyncClient(timeout=self._timeout(self.timeout), transport=transport)
+            with self._lock:
+                self._sessions[origin] = session
+                self._stats[origin] = TargetStats(backend_label(origin))
+        return session
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        origin = _origin(url)
+        session = self._session(origin)
+
+        started = time.perf_counter()
+        ok = False
+        try:
+            response = await session.request(method, url, timeout=self._timeout(timeout or self.timeout), **kwargs)
+            ok = response.status_code < 500
+            return response
+        finally:
+            self._record(origin, started, ok)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def aclose(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            await session.aclose()
+
+
+outbound = OutboundClient()
+async_outbound = AsyncOutboundClient()
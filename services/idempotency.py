@@ -0,0 +1,300 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+
+from .local_store import LocalStore, shared_path
+from .metrics import timed
+
+# 🔁 Idempotency-Key для создания заказов: повтор запроса мерчантом (после таймаута) получает
+# сохранённый ответ, а не второй вызов Birs/backend'а, вторую строку purchases и второй резерв лимита.
+# Хранилище — общий SQLite-файл хоста (как у лимитов): дубликат может прийти в другой воркер.
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_DB_PATH = os.environ.get("IDEMPOTENCY_DB_PATH", shared_path("phantom-idempotency.sqlite"))
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", 24 * 3600))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", 100000))
+
+# Запрос-оригинал "держит" ключ не дольше LOCK_TTL (упавший воркер не блокирует ключ навсегда);
+# дубликат ждёт его результата не дольше WAIT, опрашивая хранилище с шагом POLL_INTERVAL
+IDEMPOTENCY_LOCK_TTL = float(os.environ.get("IDEMPOTENCY_LOCK_TTL", 60))
+IDEMPOTENCY_WAIT = float(os.environ.get("IDEMPOTENCY_WAIT", 30))
+IDEMPOTENCY_POLL_INTERVAL = float(os.environ.get("IDEMPOTENCY_POLL_INTERVAL", 0.05))
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Чистка просроченных и лишних записей — раз в столько новых ключей
+_PRUNE_EVERY = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    state TEXT NOT NULL,
+    status INTEGER,
+    content_type TEXT,
+    body BLOB,
+    lease_until REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires_at);
+"""
+
+# Исходы begin(): запрос выполняем сами / отдаём сохранённый ответ / ждём оригинал / ключ с другим телом
+OWNER, REPLAY, PENDING, CONFLICT = "owner", "replay", "pending", "conflict"
+
+
+def _digest(*parts):
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, path=IDEMPOTENCY_DB_PATH, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES,
+                 lock_ttl=IDEMPOTENCY_LOCK_TTL, wait=IDEMPOTENCY_WAIT, poll_interval=IDEMPOTENCY_POLL_INTERVAL):
+        self.store = LocalStore(path, SCHEMA)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock_ttl = lock_ttl
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self.started = 0
+        self.replayed = 0
+        self.waited = 0
+        self.conflicts = 0
+        self.timeouts = 0
+
+    # 🔑 Ключ в хранилище: маршрут + учётные данные мерчанта + Idempotency-Key.
+    # Повтор с чужими ключами API не получит чужой ответ, и для этого не нужен запрос в api_clients.
+    @staticmethod
+    def scope_key(scope, api_login, api_key, key):
+        return _digest(scope, api_login or "", api_key or "", key)
+
+    @staticmethod
+    def fingerprint(body):
+        return hashlib.sha256(body or b"").hexdigest()
+
+    # 🚦 Одна атомарная попытка: (исход, (status, content_type, body) для REPLAY)
+    @timed("idempotency", "begin")
+    def begin(self, key, fingerprint):
+        now = time.time()
+        with self.store.transaction() as conn:
+            row = conn.execute(
+                "SELECT fingerprint, state, status, content_type, body, lease_until, expires_at "
+                "FROM idempotency WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+            if row is not None and row["expires_at"] <= now:
+                conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                conn.execute(
+                    "INSERT INTO idempotency (key, fingerprint, state, lease_until, expires_at) "
+                    "VALUES (?, ?, 'pending', ?, ?)",
+                    (key, fingerprint, now + self.lock_ttl, now + self.ttl),
+                )
+                return OWNER, None
+
+            if row["fingerprint"] != fingerprint:
+                return CONFLICT, None
+
+            if row["state"] == "done":
+                return REPLAY, (row["status"], row["content_type"], row["body"])
+
+            # Оригинал не отчитался за lock_ttl (воркер упал) — выполняем запрос заново
+            if row["lease_until"] <= now:
+                conn.execute("UPDATE idempotency SET lease_until = ? WHERE key = ?", (now + self.lock_ttl, key))
+                return OWNER, None
+
+            return PENDING, None
+
+    # ⏳ begin() с ожиданием оригинала: (исход, сохранённый ответ); PENDING — не дождались
+    def acquire(self, key, fingerprint):
+        deadline = time.monotonic() + self.wait
+        waited = False
+        while True:
+            outcome, stored = self.begin(key, fingerprint)
+            if outcome != PENDING or time.monotonic() >= deadline:
+                return self._count(outcome, stored, waited)
+            waited = True
+            time.sleep(self.poll_interval)
+
+    async def acquire_async(self, key, fingerprint):
+        import asyncio
+
+        deadline = time.monotonic() + self.wait
+        waited = False
+        while True:
+            # Запись в SQLite может ждать блокировку другого воркера — не в event loop
+            outcome, stored = await asyncio.to_thread(self.begin, key, fingerprint)
+            if outcome != PENDING or time.monotonic() >= deadline:
+                return self._count(outcome, stored, waited)
+            waited = True
+            await asyncio.sleep(self.poll_interval)
+
+    def _count(self, outcome, stored, waited):
+        with self._lock:
+            if waited:
+                self.waited += 1
+            if outcome == OWNER:
+                self.started += 1
+                prune = self.started % _PRUNE_EVERY == 0
+            else:
+                prune = False
+            if outcome == REPLAY:
+                self.replayed += 1
+            elif outcome == CONFLICT:
+                self.conflicts += 1
+            elif outcome == PENDING:
+                self.timeouts += 1
+
+        if prune:
+            self.prune()
+        return outcome, stored
+
+    # ✅ Ответ готов. 5xx не сохраняем: ключ освобождается, повтор выполнит запрос заново
+    @timed("idempotency", "complete")
+    def complete(self, key, status, content_type, body):
+        with self.store.transaction() as conn:
+            if status >= 500:
+                conn.execute("DELETE FROM idempotency WHERE key = ? AND state = 'pending'", (key,))
+            else:
+                conn.execute(
+                    "UPDATE idempotency SET state = 'done', status = ?, content_type = ?, body = ? WHERE key = ?",
+                    (status, content_type, body, key),
+                )
+
+    def release(self, key):
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM idempotency WHERE key = ? AND state = 'pending'", (key,))
+
+    # 🧹 Просроченные ключи + самые старые сверх max_entries
+    def prune(self):
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM idempotency WHERE expires_at <= ?", (time.time(),))
+            excess = conn.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM idempotency WHERE key IN ("
+                    "SELECT key FROM idempotency WHERE state = 'done' ORDER BY expires_at LIMIT ?)",
+                    (excess,),
+                )
+
+    def stats(self):
+        entries = self.store.connection().execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+        with self._lock:
+            return {
+                "entries": entries,
+                "started": self.started,
+                "replayed": self.replayed,
+                "waited": self.waited,
+                "conflicts": self.conflicts,
+                "timeouts": self.timeouts,
+            }
+
+
+idempotency_store = IdempotencyStore()
+
+
+def _credentials(headers, body):
+    body = body if isinstance(body, dict) else {}
+    return (
+        headers.get("X-Api-Login") or body.get("api_login"),
+        headers.get("X-Api-Key") or body.get("api_key"),
+    )
+
+
+KEY_TOO_LONG = {"error": f"{IDEMPOTENCY_HEADER} is too long: max {IDEMPOTENCY_KEY_MAX_LENGTH}"}
+
+
+# Отказ по исходу acquire(): (status, body) или None, если запрос можно выполнять
+def _rejection(outcome):
+    if outcome == CONFLICT:
+        return 422, {"error": f"{IDEMPOTENCY_HEADER} was already used with a different request body"}
+    if outcome == PENDING:
+        return 409, {"error": f"Request with this {IDEMPOTENCY_HEADER} is still in progress"}
+    return None
+
+
+# 🌐 Flask: @idempotent("order") под @bp.route(...). Без заголовка — обычный запрос.
+def idempotent(scope):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import Response, jsonify, make_response, request
+
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+
+            if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return jsonify(KEY_TOO_LONG), 400
+
+            api_login, api_key = _credentials(request.headers, request.get_json(silent=True))
+            store_key = idempotency_store.scope_key(scope, api_login, api_key, key)
+            outcome, stored = idempotency_store.acquire(store_key, idempotency_store.fingerprint(request.get_data()))
+
+            if outcome == REPLAY:
+                status, content_type, body = stored
+                return Response(body, status=status, content_type=content_type, headers={"Idempotent-Replayed": "true"})
+            rejected = _rejection(outcome)
+            if rejected:
+                return jsonify(rejected[1]), rejected[0]
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                idempotency_store.release(store_key)
+                raise
+            idempotency_store.complete(store_key, response.status_code, response.content_type, response.get_data())
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+# ⚡ То же для Starlette-обработчиков ASGI-режима
+def idempotent_async(scope, handler):
+    async def wrapper(request):
+        import asyncio
+
+        from starlette.responses import JSONResponse, Response
+
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return await handler(request)
+
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return JSONResponse(KEY_TOO_LONG, status_code=400)
+
+        raw = await request.body()
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        api_login, api_key = _credentials(request.headers, body)
+        store_key = idempotency_store.scope_key(scope, api_login, api_key, key)
+        outcome, stored = await idempotency_store.acquire_async(store_key, idempotency_store.fingerprint(raw))
+
+        if outcome == REPLAY:
+            status, content_type, body = stored
+            return Response(body, status_code=status, headers={"Content-Type": content_type, "Idempotent-Replayed": "true"})
+        rejected = _rejection(outcome)
+        if rejected:
+            return JSONResponse(rejected[1], status_code=rejected[0])
+
+        try:
+            response = await handler(request)
+        except BaseException:
+            await asyncio.to_thread(idempotency_store.release, store_key)
+            raise
+        await asyncio.to_thread(
+            idempotency_store.complete, store_key, response.status_code, response.headers.get("content-type"), response.body
+        )
+        return response
+
+    return wrapper
@@ -0,0 +1,396 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from .local_store import LocalStore, shared_path
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# ⚙️ Лимиты клиента (в рублях) и скользящие окна (в секундах)
+LIMIT_DAY_AMOUNT = float(os.environ.get("LIMIT_DAY_AMOUNT", 10000))
+LIMIT_MONTH_AMOUNT = float(os.environ.get("LIMIT_MONTH_AMOUNT", 100000))
+LIMIT_DAY_WINDOW = float(os.environ.get("LIMIT_DAY_WINDOW", 24 * 3600))
+LIMIT_MONTH_WINDOW = float(os.environ.get("LIMIT_MONTH_WINDOW", 30 * 24 * 3600))
+
+# Общий для воркеров файл счётчиков и пакетная запись сумм в clients
+LIMITS_DB_PATH = os.environ.get("LIMITS_DB_PATH", shared_path("phantom-limits.sqlite"))
+LIMITS_FLUSH_INTERVAL = float(os.environ.get("LIMITS_FLUSH_INTERVAL", 5))
+LIMITS_FLUSH_BATCH = int(os.environ.get("LIMITS_FLUSH_BATCH", 500))
+# Как часто перечитываем из clients строки, изменённые после нашей записи (правка оператора), 0 — никогда
+LIMITS_REFRESH_INTERVAL = float(os.environ.get("LIMITS_REFRESH_INTERVAL", 30))
+
+# Колонки clients с суммами (sql/clients_limit_windows.sql):
+# period_amount — за скользящий день, month_amount — за скользящий месяц, total_amount — за всё время
+AMOUNT_COLUMNS = ("period_amount", "month_amount", "total_amount")
+
+# Колонки clients, которые храним локально и отправляем обратно при upsert
+CLIENT_COLUMNS = ("id", "client_id", "api_login", "steam_login", "created_at")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS limit_clients (
+    client_id TEXT PRIMARY KEY,
+    row TEXT NOT NULL,
+    dirty INTEGER NOT NULL DEFAULT 0,
+    lifetime REAL NOT NULL DEFAULT 0,
+    synced TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS limit_clients_dirty ON limit_clients (dirty) WHERE dirty = 1;
+CREATE TABLE IF NOT EXISTS limit_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_id TEXT NOT NULL,
+    at REAL NOT NULL,
+    day_amount REAL NOT NULL,
+    month_amount REAL NOT NULL,
+    synced INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS limit_events_client ON limit_events (client_id, at);
+"""
+
+
+# 🚫 Ответ мерчанту при превышении лимита (формат прежний)
+def limit_exceeded(period, remaining):
+    return {
+        "status": "cancelled",
+        "info": f"Превышен лимит суммы операций за {period}. Остаточный лимит {round(max(0, remaining), 2)} рублей.",
+    }
+
+
+def _timestamp(value, default):
+    if not value:
+        return default
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return default
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)  # utcnow().isoformat() без зоны
+    return parsed.timestamp()
+
+
+# 🧾 Суммы строки clients; month_amount пуст у строк до миграции — как раньше, берём total_amount
+def _amounts(client_row):
+    total = float(client_row.get("total_amount") or 0)
+    month = client_row.get("month_amount")
+    return {
+        "period_amount": float(client_row.get("period_amount") or 0),
+        "month_amount": total if month is None else float(month),
+        "total_amount": total,
+    }
+
+
+# 💳 Лимиты по клиентам: атомарная проверка + резерв суммы.
+# Каждая операция — событие (время, сумма); сумма за день/месяц — события в окне.
+# Счётчики живут в общем SQLite-файле хоста, в clients уходят пачками.
+# synced у клиента — суммы и updated_at, которые последними записали в clients или прочитали оттуда;
+# synced у события — оно уже учтено в этих суммах. Правка строки оператором заменяет учтённые события.
+class LimitEngine:
+    def __init__(self, path=LIMITS_DB_PATH, day_limit=LIMIT_DAY_AMOUNT, month_limit=LIMIT_MONTH_AMOUNT,
+                 day_window=LIMIT_DAY_WINDOW, month_window=LIMIT_MONTH_WINDOW,
+                 flush_interval=LIMITS_FLUSH_INTERVAL, flush_batch=LIMITS_FLUSH_BATCH,
+                 refresh_interval=LIMITS_REFRESH_INTERVAL):
+        self.store = LocalStore(path, SCHEMA)
+        self.day_limit = day_limit
+        self.month_limit = month_limit
+        self.day_window = day_window
+        self.month_window = month_window
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.Lock()
+        self._supabase = None
+        self._thread = None
+        self._seen = None  # updated_at, до которого изменения clients уже просмотрены
+
+        self.reserved = 0
+        self.rejected = 0
+        self.released = 0
+        self.flushed = 0
+        self.refreshed = 0
+
+    # 🔍 Клиент, уже известный движку (без запроса в БД), или None
+    @timed("limits", "client")
+    def client(self, client_id):
+        row = self.store.connection().execute(
+            "SELECT row FROM limit_clients WHERE client_id = ?", (str(client_id),)
+        ).fetchone()
+        return json.loads(row["row"]) if row else None
+
+    # 🌱 Первое знакомство со строкой clients: её суммы становятся событием на момент updated_at
+    @timed("limits", "seed")
+    def seed(self, client_row):
+        client_id = str(client_row["client_id"])
+        row = {column: client_row.get(column) for column in CLIENT_COLUMNS}
+        at = _timestamp(client_row.get("updated_at"), time.time())
+        amounts = _amounts(client_row)
+        synced = {**amounts, "updated_at": client_row.get("updated_at")}
+
+        with self.store.transaction() as conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO limit_clients (client_id, row, synced) VALUES (?, ?, ?)",
+                (client_id, json.dumps(row), json.dumps(synced)),
+            ).rowcount
+            if not inserted:
+                # Другой воркер успел раньше — его данные и используем
+                return json.loads(
+                    conn.execute("SELECT row FROM limit_clients WHERE client_id = ?", (client_id,)).fetchone()["row"]
+                )
+
+            # Резервы, сделанные до знакомства (асинхронный /qr-code резервирует лимит
+            # до выдачи логина новому клиенту), ещё не записаны в clients
+            conn.execute(
+                "UPDATE limit_clients SET dirty = 1 WHERE client_id = ? "
+                "AND EXISTS (SELECT 1 FROM limit_events WHERE client_id = ?)",
+                (client_id, client_id),
+            )
+            self._replace_synced(conn, client_id, amounts, at)
+        return row
+
+    # 📥 Суммы из clients вместо учтённых событий; неучтённые резервы остаются сверху
+    def _replace_synced(self, conn, client_id, amounts, at):
+        conn.execute("DELETE FROM limit_events WHERE client_id = ? AND synced = 1", (client_id,))
+        if amounts["period_amount"] or amounts["month_amount"]:
+            conn.execute(
+                "INSERT INTO limit_events (client_id, at, day_amount, month_amount, synced) VALUES (?, ?, ?, ?, 1)",
+                (client_id, at, amounts["period_amount"], amounts["month_amount"]),
+            )
+        pending = conn.execute(
+            "SELECT COALESCE(SUM(month_amount), 0) FROM limit_events WHERE client_id = ? AND synced = 0", (client_id,)
+        ).fetchone()[0]
+        conn.execute(
+            "UPDATE limit_clients SET lifetime = ? WHERE client_id = ?", (amounts["total_amount"] + pending, client_id)
+        )
+
+    def _window_sums(self, conn, client_id, now):
+        day, month = conn.execute(
+            "SELECT COALESCE(SUM(CASE WHEN at > ? THEN day_amount END), 0), COALESCE(SUM(month_amount), 0) "
+            "FROM limit_events WHERE client_id = ? AND at > ?",
+            (now - self.day_window, client_id, now - self.month_window),
+        ).fetchone()
+        return day, month
+
+    def _reserve(self, conn, client_id, amount, now):
+        day, month = self._window_sums(conn, client_id, now)
+
+        if day + amount > self.day_limit:
+            return None, limit_exceeded("день", self.day_limit - day)
+        if month + amount > self.month_limit:
+            return None, limit_exceeded("месяц", self.month_limit - month)
+
+        reservation = conn.execute(
+            "INSERT INTO limit_events (client_id, at, day_amount, month_amount) VALUES (?, ?, ?, ?)",
+            (client_id, now, amount, amount),
+        ).lastrowid
+        conn.execute(
+            "UPDATE limit_clients SET dirty = 1, lifetime = lifetime + ? WHERE client_id = ?", (amount, client_id)
+        )
+        return reservation, None
+
+    def _count(self, supabase, results):
+        reserved = sum(1 for reservation, _ in results if reservation is not None)
+        with self._lock:
+            self.reserved += reserved
+            self.rejected += len(results) - reserved
+            if reserved:
+                self._supabase = supabase
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    # ✅ (id резерва, None) или (None, ответ об отмене). Клиент обычно уже известен (seed);
+    # резерв до seed тоже учитывается — в clients его допишет seed
+    @timed("limits", "reserve")
+    def reserve(self, supabase, client_id, amount):
+        with self.store.transaction() as conn:
+            result = self._reserve(conn, str(client_id), amount, time.time())
+
+        self._count(supabase, [result])
+        return result
+
+    # 📦 Пачка [(client_id, сумма), ...] одной транзакцией; заказы одного клиента идут по порядку
+    @timed("limits", "reserve_many")
+    def reserve_many(self, supabase, orders):
+        now = time.time()
+        with self.store.transaction() as conn:
+            results = [self._reserve(conn, str(client_id), amount, now) for client_id, amount in orders]
+
+        self._count(supabase, results)
+        return results
+
+    # ↩️ Откат резервов (backend не создал QR)
+    @timed("limits", "release")
+    def release(self, *reservations):
+        released = 0
+        with self.store.transaction() as conn:
+            for reservation in reservations:
+                row = conn.execute(
+                    "SELECT client_id, month_amount FROM limit_events WHERE id = ?", (reservation,)
+                ).fetchone()
+                if row is None:
+                    continue
+                conn.execute("DELETE FROM limit_events WHERE id = ?", (reservation,))
+                conn.execute(
+                    "UPDATE limit_clients SET dirty = 1, lifetime = lifetime - ? WHERE client_id = ?",
+                    (row["month_amount"], row["client_id"]),
+                )
+                released += 1
+
+        with self._lock:
+            self.released += released
+
+    def usage(self, client_id):
+        return self._window_sums(self.store.connection(), str(client_id), time.time())
+
+    def _run(self):
+        next_refresh = time.monotonic() + self.refresh_interval
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("💥 Ошибка записи лимитов в clients")
+
+            if self.refresh_interval and time.monotonic() >= next_refresh:
+                next_refresh = time.monotonic() + self.refresh_interval
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("💥 Ошибка чтения изменений clients")
+
+    # 💾 Текущие суммы "грязных" клиентов — в clients одним upsert на пачку
+    def flush(self):
+        supabase = self._supabase
+        if supabase is None:
+            return 0
+
+        total = 0
+        while True:
+            now = time.time()
+            updated_at = datetime.datetime.utcnow().isoformat()
+
+            with self.store.transaction() as conn:
+                conn.execute("DELETE FROM limit_events WHERE at <= ?", (now - self.month_window,))
+                dirty = conn.execute(
+                    "SELECT client_id, row, lifetime FROM limit_clients WHERE dirty = 1 LIMIT ?", (self.flush_batch,)
+                ).fetchall()
+
+                rows = []
+                for entry in dirty:
+                    day, month = self._window_sums(conn, entry["client_id"], now)
+                    amounts = {"period_amount": day, "month_amount": month, "total_amount": entry["lifetime"]}
+                    rows.append({**json.loads(entry["row"]), **amounts, "updated_at": updated_at})
+                    # Если upsert не пройдёт, в clients останется прежний updated_at — refresh его не примет за правку
+                    conn.execute(
+                        "UPDATE limit_clients SET synced = ? WHERE client_id = ?",
+                        (json.dumps({**amounts, "updated_at": updated_at}), entry["client_id"]),
+                    )
+                    conn.execute("UPDATE limit_events SET synced = 1 WHERE client_id = ?", (entry["client_id"],))
+                # Новый резерв после этого момента снова пометит клиента
+                client_ids = [(entry["client_id"],) for entry in dirty]
+                conn.executemany("UPDATE limit_clients SET dirty = 0 WHERE client_id = ?", client_ids)
+
+            if not rows:
+                return total
+
+            try:
+                supabase.table("clients").upsert(rows, on_conflict="id").execute()
+            except Exception:
+                with self.store.transaction() as conn:
+                    conn.executemany("UPDATE limit_clients SET dirty = 1 WHERE client_id = ?", client_ids)
+                raise
+
+            total += len(rows)
+            with self._lock:
+                self.flushed += len(rows)
+
+            if len(rows) < self.flush_batch:
+                return total
+
+    # 🔄 Строки clients, изменённые не нами после последней записи (оператор поправил суммы или обнулил
+    # лимит) — их суммы заменяют учтённые события. Правка должна обновить updated_at
+    def refresh(self):
+        supabase = self._supabase
+        if supabase is None:
+            return 0
+
+        if self._seen is None:
+            started = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.refresh_interval)
+            self._seen = started.isoformat()
+
+        limit = max(1000, self.flush_batch * 2)
+        rows = (
+            supabase.table("clients")
+            .select("client_id, updated_at, " + ", ".join(AMOUNT_COLUMNS))
+            .gt("updated_at", self._seen)
+            .order("updated_at")
+            .limit(limit)
+            .execute()
+            .data
+        ) or []
+        if len(rows) == limit and rows[0]["updated_at"] != rows[-1]["updated_at"]:
+            # Строки с последним updated_at могли не поместиться целиком — дочитаем их в следующий раз
+            rows = [row for row in rows if row["updated_at"] != rows[-1]["updated_at"]]
+        if not rows:
+            return 0
+
+        replaced = 0
+        now = time.time()
+        with self.store.transaction() as conn:
+            for client_row in rows:
+                client_id = str(client_row["client_id"])
+                entry = conn.execute("SELECT synced FROM limit_clients WHERE client_id = ?", (client_id,)).fetchone()
+                if entry is None:
+                    continue  # клиент воркерам хоста не знаком — прочитают при seed
+
+                synced = json.loads(entry["synced"])
+                if _timestamp(client_row["updated_at"], 0) <= _timestamp(synced.get("updated_at"), 0):
+                    continue  # наша запись или более старая
+
+                amounts = _amounts(client_row)
+                if any(round(amounts[column] - synced.get(column, 0), 6) for column in AMOUNT_COLUMNS):
+                    self._replace_synced(conn, client_id, amounts, now)
+                    replaced += 1
+                conn.execute(
+                    "UPDATE limit_clients SET synced = ? WHERE client_id = ?",
+                    (json.dumps({**amounts, "updated_at": client_row["updated_at"]}), client_id),
+                )
+
+        self._seen = rows[-1]["updated_at"]
+        if replaced:
+            logger.info("🔄 Суммы лимитов перечитаны из clients", extra={"clients": replaced})
+        with self._lock:
+            self.refreshed += replaced
+        return replaced
+
+    def stats(self):
+        conn = self.store.connection()
+        clients, dirty = conn.execute("SELECT COUNT(*), COALESCE(SUM(dirty), 0) FROM limit_clients").fetchone()
+        with self._lock:
+            return {
+                "clients": clients,
+                "dirty": dirty,
+                "reserved": self.reserved,
+                "rejected": self.rejected,
+                "released": self.released,
+                "flushed": self.flushed,
+                "refreshed": self.refreshed,
+            }
+
+
+limit_engine = LimitEngine()
+
+
+# При остановке воркера дописываем суммы; не вышло — допишет другой воркер
+@atexit.register
+def _flush_on_exit():
+    if limit_engine._supabase is None:
+        return
+    try:
+        limit_engine.flush()
+    except Exception:
+        logger.exception("⚠️ Лимиты не записаны в clients при остановке")
@@ -0,0 +1,79 @@
+import contextlib
+import os
+import sqlite3
+import tempfile
+import threading
+
+# 📁 Каталог для состояния, общего между воркерами одного хоста:
+# /dev/shm (файл в памяти), иначе обычный tmp
+SHARED_STATE_DIR = os.environ.get("SHARED_STATE_DIR") or (
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+
+
+def shared_path(name):
+    return os.path.join(SHARED_STATE_DIR, name)
+
+
+# 💾 Каталог для данных, которые должны пережить рестарт хоста (на Render — смонтированный диск)
+DATA_DIR = os.environ.get("DATA_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"
+)
+
+
+def data_path(name):
+    return os.path.join(DATA_DIR, name)
+
+
+# 🗄 SQLite-файл, который делят все воркеры хоста (WAL: читатели не ждут писателя).
+# Соединение своё у каждого потока и у каждого процесса (после fork — новое).
+class LocalStore:
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Файл только для владельца (-wal и -shm SQLite создаёт с теми же правами): в нём данные мерчантов
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            os.fchmod(fd, 0o600)
+        except OSError:
+            pass  # чужой файл — права не наши
+        os.close(fd)
+        # isolation_level=None — транзакциями управляем сами (BEGIN IMMEDIATE)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._schema_lock:
+            conn.executescript(self.schema)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    # 🔒 Запись с блокировкой сразу (BEGIN IMMEDIATE): "проверить и записать" атомарно между процессами
+    @contextlib.contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
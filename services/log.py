@@ -0,0 +1,240 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+# 📝 Структурные логи: JSON-строка на запись, в stdout пишет отдельный поток (QueueListener),
+# обработчик запроса только кладёт запись в очередь и никогда не ждёт pipe платформы.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# 🎲 Доля записей уровня, которая доходит до вывода: "INFO=0.1,DEBUG=0.01". По умолчанию пусто — пишем всё
+# (логи webhook'ов и заказов — журнал операций), сэмплинг включается только явно.
+# WARNING и выше не сэмплируются. Решение принимается один раз на запрос — его записи идут целиком или никак.
+LOG_SAMPLE_RATES = {
+    level.strip().upper(): float(rate)
+    for level, rate in (
+        item.split("=", 1) for item in os.environ.get("LOG_SAMPLE_RATES", "").split(",") if "=" in item
+    )
+}
+
+# 🔒 Поля, значения которых не попадают в лог (ищутся рекурсивно в extra)
+REDACTED_FIELDS = {
+    "api_key", "x-api-key", "apikey", "authorization", "password", "token", "secret",
+    "supabase_service_role_key", "birs_api_key",
+} | {field.strip().lower() for field in os.environ.get("LOG_REDACT_FIELDS", "").split(",") if field.strip()}
+REDACTED = "***"
+
+# Клиентские библиотеки пишут INFO на каждый HTTP-запрос — время запросов уже есть в stages_ms
+QUIET_LOGGERS = ("httpx", "httpcore", "hpack", "urllib3")
+
+# Атрибуты самой LogRecord — всё остальное пришло через extra
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "route"}
+
+# Контекст текущего запроса: request id, маршрут, решение сэмплинга и время этапов (см. metrics.observe_stage)
+_request = contextvars.ContextVar("log_request", default=None)
+
+access_logger = logging.getLogger("phantom.access")
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if str(key).lower() in REDACTED_FIELDS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+# ⏱ Время этапа в пределах текущего запроса; вне запроса ничего не делает
+def add_stage(stage, target, elapsed):
+    ctx = _request.get()
+    if ctx is not None:
+        key = f"{stage}:{target}" if target else stage
+        stages = ctx["stages"]
+        stages[key] = stages.get(key, 0.0) + elapsed
+
+
+def _sampled(level):
+    rate = LOG_SAMPLE_RATES.get(logging.getLevelName(level))
+    return rate is None or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("request_id", "route"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = REDACTED if key.lower() in REDACTED_FIELDS else redact(value)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# 📬 Обработчик в потоке запроса: фильтр сэмплинга + контекст запроса, без форматирования.
+# Очередь переполнена (stdout не успевает) — запись отбрасывается и считается, запрос не блокируется.
+class QueueLogHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            ctx = _request.get()
+            sampled = ctx["sampled"].get(record.levelno) if ctx is not None else None
+            if sampled is None:
+                sampled = _sampled(record.levelno)
+                if ctx is not None:
+                    ctx["sampled"][record.levelno] = sampled
+            if not sampled:
+                self.sampled_out += 1
+                return False
+        return super().filter(record)
+
+    def prepare(self, record):
+        ctx = _request.get()
+        if ctx is not None:
+            record.request_id = ctx["request_id"]
+            record.route = ctx["route"]
+        # Аргументы подставляем сразу (объекты могут измениться), traceback — строкой
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+
+
+def configure_logging():
+    global _handler, _listener
+    if _handler is not None:
+        return _handler
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    _handler = QueueLogHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_handler)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+    # Дописываем очередь при остановке воркера
+    atexit.register(_listener.stop)
+    return _handler
+
+
+def stats():
+    if _handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queued": _handler.queue.qsize(),
+        "dropped": _handler.dropped,
+        "sampled_out": _handler.sampled_out,
+    }
+
+
+def start_request(route, request_id=None):
+    ctx = {
+        "request_id": request_id or uuid.uuid4().hex,
+        "route": route,
+        "started": time.perf_counter(),
+        "stages": {},
+        "sampled": {},
+    }
+    return ctx, _request.set(ctx)
+
+
+# 🧾 Одна access-запись на запрос: статус, длительность и время этапов (БД, внешний HTTP, лимиты...)
+def finish_request(ctx, token, method, status):
+    try:
+        level = logging.ERROR if status >= 500 else logging.INFO
+        if access_logger.isEnabledFor(level):
+            access_logger.log(
+                level,
+                "request",
+                extra={
+                    "method": method,
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - ctx["started"]) * 1000, 2),
+                    "stages_ms": {key: round(value * 1000, 2) for key, value in ctx["stages"].items()},
+                },
+            )
+    finally:
+        _request.reset(token)
+
+
+# 🌐 Flask: request id из X-Request-Id (или новый), он же возвращается в ответе
+def init_logging(app):
+    from flask import g, request
+
+    configure_logging()
+
+    @app.before_request
+    def _start_request():
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        g.log_request = start_request(route, request.headers.get("X-Request-Id"))
+
+    @app.after_request
+    def _request_id(response):
+        started = g.get("log_request")
+        if started is not None:
+            response.headers["X-Request-Id"] = started[0]["request_id"]
+            g.log_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_request(exc):
+        started = g.pop("log_request", None)
+        if started is not None:
+            finish_request(*started, request.method, g.pop("log_status", 500))
+
+
+# ⚡ То же для Starlette-обработчиков ASGI-режима
+def log_requests(route, handler):
+    async def wrapper(request):
+        ctx, token = start_request(route, request.headers.get("x-request-id"))
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status_code
+            response.headers["X-Request-Id"] = ctx["request_id"]
+            return response
+        finally:
+            finish_request(ctx, token, request.method, status)
+
+    return wrapper
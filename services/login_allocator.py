@@ -0,0 +1,158 @@
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# ⚙️ Размер локального резерва steam-логинов и порог фонового пополнения
+LOGIN_RESERVE_SIZE = int(os.environ.get("LOGIN_RESERVE_SIZE", 20))
+LOGIN_RESERVE_LOW_WATERMARK = int(os.environ.get("LOGIN_RESERVE_LOW_WATERMARK", 5))
+LOGIN_CLAIM_ATTEMPTS = int(os.environ.get("LOGIN_CLAIM_ATTEMPTS", 5))
+
+
+# 🔒 Пакетный захват свободных логинов из available_logins
+def claim_logins(supabase, count):
+    claimed = []
+
+    for _ in range(LOGIN_CLAIM_ATTEMPTS):
+        need = count - len(claimed)
+        if need <= 0:
+            break
+
+        candidates = [
+            row["login"]
+            for row in supabase.table("available_logins").select("login").eq("used", False).limit(need * 2).execute().data
+        ]
+        if not candidates:
+            break
+
+        # Одним запросом отсекаем логины, которые уже выданы клиентам
+        taken = {
+            row["steam_login"]
+            for row in supabase.table("clients").select("steam_login").in_("steam_login", candidates).execute().data
+        }
+        if taken:
+            # Чтобы они больше не попадались среди кандидатов
+            supabase.table("available_logins").update({"used": True}).in_("login", list(taken)).execute()
+
+        free = [login for login in candidates if login not in taken][:need]
+        if not free:
+            continue
+
+        # Атомарно: UPDATE ... WHERE used = false — вернутся только строки, которые захватили мы,
+        # поэтому два воркера не получат один и тот же логин
+        rows = (
+            supabase.table("available_logins")
+            .update({"used": True})
+            .in_("login", free)
+            .eq("used", False)
+            .execute()
+            .data
+        )
+        claimed.extend(row["login"] for row in rows)
+
+    return claimed
+
+
+# 🎟 Выдача логинов из заранее захваченного резерва
+class LoginAllocator:
+    def __init__(self, reserve_size=LOGIN_RESERVE_SIZE, low_watermark=LOGIN_RESERVE_LOW_WATERMARK):
+        self.reserve_size = reserve_size
+        self.low_watermark = low_watermark
+
+        self._reserve = deque()
+        self._lock = threading.Lock()
+        self._refill_lock = threading.Lock()
+        self._supabase = None
+
+    @timed("login", "acquire")
+    def acquire(self, supabase):
+        self._supabase = supabase
+
+        login = self._pop()
+        if login is None:
+            # Резерв пуст — пополняем синхронно (редкий путь)
+            self.refill(supabase)
+            login = self._pop()
+            if login is None:
+                raise Exception("No available logins left")
+
+        if len(self._reserve) < self.low_watermark:
+            self._refill_in_background(supabase)
+
+        return login
+
+    # 📦 Пачка логинов для bulk-заказов: сначала из резерва, недостающее — одним захватом.
+    # Может вернуть меньше, чем просили, если свободные логины закончились
+    @timed("login", "acquire_many")
+    def acquire_many(self, supabase, count):
+        self._supabase = supabase
+
+        with self._lock:
+            logins = [self._reserve.popleft() for _ in range(min(count, len(self._reserve)))]
+
+        if len(logins) < count:
+            logins.extend(claim_logins(supabase, count - len(logins)))
+
+        if len(self._reserve) < self.low_watermark:
+            self._refill_in_background(supabase)
+
+        return logins
+
+    def _pop(self):
+        with self._lock:
+            return self._reserve.popleft() if self._reserve else None
+
+    def refill(self, supabase):
+        with self._refill_lock:
+            with self._lock:
+                need = self.reserve_size - len(self._reserve)
+            if need <= 0:
+                return
+
+            claimed = claim_logins(supabase, need)
+            with self._lock:
+                self._reserve.extend(claimed)
+
+    def _refill_in_background(self, supabase):
+        if self._refill_lock.locked():
+            return
+
+        def run():
+            try:
+                self.refill(supabase)
+            except Exception:
+                logger.exception("⚠️ Ошибка фонового пополнения логинов")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # ↩️ Захваченные, но не доставшиеся клиенту логины — обратно в available_logins.
+    # Не в локальный резерв: claim_logins заново проверит, не занят ли логин в clients
+    def return_logins(self, supabase, logins):
+        if not logins:
+            return
+        try:
+            supabase.table("available_logins").update({"used": False}).in_("login", list(logins)).execute()
+        except Exception:
+            logger.exception("⚠️ Не удалось вернуть логины в пул")
+
+    # ♻️ Возвращаем невыданные логины в пул (при остановке воркера)
+    def release(self):
+        with self._lock:
+            logins = list(self._reserve)
+            self._reserve.clear()
+
+        if self._supabase is not None:
+            self.return_logins(self._supabase, logins)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._reserve)
+
+
+login_allocator = LoginAllocator()
+atexit.register(login_allocator.release)
@@ -0,0 +1,179 @@
+import contextlib
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+from services.log import add_stage
+
+# 📈 Метрики Prometheus. Под gunicorn счётчики каждого воркера пишутся в mmap-файлы
+# каталога PROMETHEUS_MULTIPROC_DIR (см. gunicorn.conf.py), /metrics складывает их вместе.
+# Без этой переменной — обычный реестр одного процесса.
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# Границы корзин: от миллисекунды (кэш, SQLite) до таймаута backend'а
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+
+REQUEST_LATENCY = Histogram(
+    "phantom_request_duration_seconds", "Время обработки запроса по маршруту",
+    ["route", "method", "status"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "phantom_requests_in_flight", "Запросы в обработке",
+    ["route"], multiprocess_mode="livesum",
+)
+STAGE_LATENCY = Histogram(
+    "phantom_stage_duration_seconds", "Время этапа запроса: БД, внешний HTTP, кэши, лимиты",
+    ["stage", "target"], buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "phantom_stage_errors_total", "Ошибки по этапам",
+    ["stage", "target"],
+)
+
+# Методы PostgREST -> операция над таблицей
+_DB_OPERATIONS = {"GET": "select", "HEAD": "select", "POST": "insert", "PATCH": "update", "DELETE": "delete"}
+
+
+def observe_stage(stage, target, started, ok=True):
+    elapsed = time.perf_counter() - started
+    STAGE_LATENCY.labels(stage, target).observe(elapsed)
+    # Этапы попадают и в access-лог текущего запроса
+    add_stage(stage, target, elapsed)
+    if not ok:
+        STAGE_ERRORS.labels(stage, target).inc()
+
+
+# ⏱ with timed("limits", "reserve"): ... — время этапа + ошибка, если вылетело исключение
+@contextlib.contextmanager
+def timed(stage, target=""):
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        observe_stage(stage, target, started, ok)
+
+
+# /rest/v1/clients -> "clients.select", /rest/v1/rpc/fn -> "rpc.fn"
+def _db_target(request):
+    parts = request.url.path.rstrip("/").split("/")
+    if len(parts) >= 2 and parts[-2] == "rpc":
+        return f"rpc.{parts[-1]}"
+    return f"{parts[-1]}.{_DB_OPERATIONS.get(request.method, request.method.lower())}"
+
+
+# 🔌 Обёртки над httpx-транспортом PostgREST: каждый запрос в БД — этап "db".
+# Тело ответа дочитываем внутри, чтобы время включало загрузку данных.
+class TimedTransport:
+    def __init__(self, transport, stage="db"):
+        self._transport = transport
+        self.stage = stage
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        ok = False
+        try:
+            response = self._transport.handle_request(request)
+            response.read()
+            ok = response.status_code < 500
+            return response
+        finally:
+            observe_stage(self.stage, _db_target(request), started, ok)
+
+    def close(self):
+        self._transport.close()
+
+    def __enter__(self):
+        self._transport.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self._transport.__exit__(*args)
+
+
+class AsyncTimedTransport(TimedTransport):
+    async def handle_async_request(self, request):
+        started = time.perf_counter()
+        ok = False
+        try:
+            response = await self._transport.handle_async_request(request)
+            await response.aread()
+            ok = response.status_code < 500
+            return response
+        finally:
+            observe_stage(self.stage, _db_target(request), started, ok)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+    async def __aenter__(self):
+        await self._transport.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self._transport.__aexit__(*args)
+
+
+# 🌐 Flask: латентность по шаблону маршрута (/api/operations/<opId>/qr-status, а не по каждому opId)
+def init_metrics(app):
+    from flask import Response, g, request
+
+    def route_label():
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_route = route_label()
+        g.metrics_in_flight = REQUESTS_IN_FLIGHT.labels(g.metrics_route)
+        g.metrics_in_flight.inc()
+
+    @app.after_request
+    def _observe(response):
+        started = g.get("metrics_started")
+        if started is not None:
+            REQUEST_LATENCY.labels(g.metrics_route, request.method, str(response.status_code)).observe(
+                time.perf_counter() - started
+            )
+        return response
+
+    @app.teardown_request
+    def _finish(exc):
+        in_flight = g.pop("metrics_in_flight", None)
+        if in_flight is not None:
+            in_flight.dec()
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
+
+def render_metrics():
+    if not MULTIPROCESS:
+        return generate_latest(REGISTRY)
+
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+# ⚡ То же для Starlette-обработчиков ASGI-режима (их запросы мимо Flask)
+def instrument_async(route, handler):
+    async def wrapper(request):
+        started = time.perf_counter()
+        in_flight = REQUESTS_IN_FLIGHT.labels(route)
+        in_flight.inc()
+        status = "500"
+        try:
+            response = await handler(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            in_flight.dec()
+            REQUEST_LATENCY.labels(route, request.method, status).observe(time.perf_counter() - started)
+
+    return wrapper
@@ -0,0 +1,381 @@
+import collections
+import cProfile
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+
+from .admin import ADMIN_TOKEN, admin_allowed
+from .local_store import LocalStore, shared_path
+
+logger = logging.getLogger(__name__)
+
+# 🔬 Профилирование запросов по требованию: админ включает правило (маршрут и/или api_login,
+# доля запросов, срок) или шлёт X-Profile с админ-токеном для одного запроса.
+# Профили — в общем кольцевом буфере хоста, скачиваются как pstats или collapsed stacks (flamegraph.pl, speedscope).
+# Доступ — по общему X-Admin-Token (services/admin.py); без ADMIN_TOKEN хуки не регистрируются вовсе.
+PROFILING_DB_PATH = os.environ.get("PROFILING_DB_PATH", shared_path("phantom-profiling.sqlite"))
+
+# Сколько профилей храним (старые вытесняются) и максимальный срок правила
+PROFILING_RING_SIZE = int(os.environ.get("PROFILING_RING_SIZE", 50))
+PROFILING_MAX_DURATION = float(os.environ.get("PROFILING_MAX_DURATION", 3600))
+# Как часто воркер перечитывает правила (правило, заведённое через другой воркер, вступит в силу не позже)
+PROFILING_RULES_REFRESH = float(os.environ.get("PROFILING_RULES_REFRESH", 1.0))
+# Период сэмплера (режим sample): стек профилируемого потока раз в N секунд
+PROFILING_SAMPLE_INTERVAL = float(os.environ.get("PROFILING_SAMPLE_INTERVAL", 0.005))
+
+PROFILE_HEADER = "X-Profile"  # в хуках читается из environ как HTTP_X_PROFILE (X-Admin-Token — HTTP_X_ADMIN_TOKEN)
+
+CPROFILE, SAMPLE = "cprofile", "sample"
+MODES = {CPROFILE: "pstats", SAMPLE: "collapsed"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiling_rules (
+    id TEXT PRIMARY KEY,
+    route TEXT,
+    api_login TEXT,
+    sample_rate REAL NOT NULL,
+    mode TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    route TEXT,
+    method TEXT,
+    api_login TEXT,
+    status INTEGER,
+    duration_ms REAL,
+    mode TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profiles_created ON profiles (created);
+"""
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+
+# 🏷 Имя кадра для collapsed stacks: путь от корня проекта или site-packages
+def _frame_name(code):
+    filename = code.co_filename
+    if filename.startswith(_ROOT):
+        filename = filename[len(_ROOT):]
+    else:
+        filename = filename.rsplit("site-packages" + os.sep, 1)[-1]
+    return f"{filename}:{code.co_name}"
+
+
+# 📸 Статистический сэмплер: один поток на воркер снимает стеки только профилируемых потоков
+class StackSampler:
+    def __init__(self, interval=PROFILING_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._targets = {}  # ident потока -> Counter стеков
+        self._active = threading.Event()  # без профилируемых запросов поток спит и не будит GIL
+        self._thread = None
+        self._pid = None
+
+    def start(self, ident):
+        stacks = collections.Counter()
+        with self._lock:
+            self._targets[ident] = stacks
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+                self._thread.start()
+            self._active.set()
+        return stacks
+
+    def stop(self, ident):
+        with self._lock:
+            return self._targets.pop(ident, collections.Counter())
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._targets:
+                    self._active.clear()
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self._targets.items():
+                    frame = frames.get(ident)
+                    names = []
+                    while frame is not None:
+                        names.append(_frame_name(frame.f_code))
+                        frame = frame.f_back
+                    if names:
+                        stacks[";".join(reversed(names))] += 1
+
+
+# ⏱ Профиль одного запроса (cProfile или сэмплер).
+# cProfile — не больше одного на процесс: с Python 3.12 он работает через sys.monitoring, общий для
+# всех потоков, и второй enable() падает с ValueError. Занят (или профилировщик уже включил кто-то ещё) —
+# этот запрос снимаем сэмплером. На 3.12+ профиль cProfile — весь процесс за время запроса,
+# вместе с соседними потоками; только свой поток снимает сэмплер
+class RequestProfile:
+    def __init__(self, profiler, mode):
+        self.profiler = profiler
+        self.mode = mode
+        self.started = time.perf_counter()
+        self._ident = threading.get_ident()
+        self.status = 500  # ответа не было — исключение до after_request
+        if mode == CPROFILE and not self._enable_cprofile():
+            self.mode = SAMPLE
+            profiler.count_fallback()
+        if self.mode == SAMPLE:
+            profiler.sampler.start(self._ident)
+
+    def _enable_cprofile(self):
+        if not self.profiler.cprofile_lock.acquire(blocking=False):
+            return False
+        try:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        except ValueError:
+            self.profiler.cprofile_lock.release()
+            return False
+        return True
+
+    def finish(self, route, method, api_login):
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        if self.mode == CPROFILE:
+            try:
+                self._profile.disable()
+            finally:
+                self.profiler.cprofile_lock.release()
+            self._profile.create_stats()
+            data = marshal.dumps(self._profile.stats)
+        else:
+            data = json.dumps(self.profiler.sampler.stop(self._ident)).encode()
+        self.profiler.save(route, method, api_login, self.status, duration_ms, self.mode, data)
+
+
+class Profiler:
+    def __init__(self, path=PROFILING_DB_PATH, ring_size=PROFILING_RING_SIZE, refresh=PROFILING_RULES_REFRESH):
+        self.store = LocalStore(path, SCHEMA)
+        self.ring_size = ring_size
+        self.refresh = refresh
+        self.sampler = StackSampler()
+        self.cprofile_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self._rules = []
+        self._next_refresh = 0.0
+
+        self.profiled = 0
+        self.saved = 0
+        self.fallbacks = 0
+
+    # 📋 Действующие правила; из SQLite — не чаще раза в refresh секунд
+    def rules(self):
+        now = time.monotonic()
+        if now < self._next_refresh:
+            return self._rules
+        with self._lock:
+            if now >= self._next_refresh:
+                self._rules = self.list_rules()
+                self._next_refresh = now + self.refresh
+        return self._rules
+
+    def list_rules(self):
+        rows = self.store.connection().execute(
+            "SELECT id, route, api_login, sample_rate, mode, expires_at FROM profiling_rules WHERE expires_at > ?",
+            (time.time(),),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def add_rule(self, route, api_login, sample_rate, mode, duration):
+        rule = {
+            "id": uuid.uuid4().hex,
+            "route": route,
+            "api_login": api_login,
+            "sample_rate": sample_rate,
+            "mode": mode,
+            "expires_at": time.time() + duration,
+        }
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM profiling_rules WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "INSERT INTO profiling_rules (id, route, api_login, sample_rate, mode, expires_at) "
+                "VALUES (:id, :route, :api_login, :sample_rate, :mode, :expires_at)",
+                rule,
+            )
+        self._next_refresh = 0.0
+        return rule
+
+    def delete_rule(self, rule_id=None):
+        with self.store.transaction() as conn:
+            if rule_id is None:
+                deleted = conn.execute("DELETE FROM profiling_rules").rowcount
+            else:
+                deleted = conn.execute("DELETE FROM profiling_rules WHERE id = ?", (rule_id,)).rowcount
+        self._next_refresh = 0.0
+        return deleted
+
+    # 🎯 Режим профилирования для запроса или None. api_login — функция: тело читаем, только если есть правило
+    def choose(self, route, api_login, forced=None):
+        if forced:
+            return forced
+
+        for rule in self.rules():
+            if rule["route"] and rule["route"] != route:
+                continue
+            if rule["api_login"] and rule["api_login"] != api_login():
+                continue
+            if random.random() < rule["sample_rate"]:
+                return rule["mode"]
+        return None
+
+    def begin(self, mode):
+        with self._lock:
+            self.profiled += 1
+        return RequestProfile(self, mode)
+
+    def count_fallback(self):
+        with self._lock:
+            self.fallbacks += 1
+
+    # 💾 В кольцевой буфер: сверх ring_size удаляем самые старые
+    def save(self, route, method, api_login, status, duration_ms, mode, data):
+        with self.store.transaction() as conn:
+            conn.execute(
+                "INSERT INTO profiles (id, created, route, method, api_login, status, duration_ms, mode, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (uuid.uuid4().hex, time.time(), route, method, api_login, status, round(duration_ms, 2), mode, data),
+            )
+            conn.execute(
+                "DELETE FROM profiles WHERE id IN (SELECT id FROM profiles ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.ring_size,),
+            )
+        with self._lock:
+            self.saved += 1
+
+    def list_profiles(self, route=None):
+        query = "SELECT id, created, route, method, api_login, status, duration_ms, mode FROM profiles"
+        params = ()
+        if route:
+            query, params = query + " WHERE route = ?", (route,)
+        rows = self.store.connection().execute(query + " ORDER BY created DESC", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def _load(self, mode, profile_id=None, route=None):
+        query, params = "SELECT data FROM profiles WHERE mode = ?", [mode]
+        if profile_id:
+            query, params = query + " AND id = ?", params + [profile_id]
+        if route:
+            query, params = query + " AND route = ?", params + [route]
+        return [row["data"] for row in self.store.connection().execute(query, params).fetchall()]
+
+    # 📦 pstats-файл (pstats.Stats / snakeviz) по одному профилю или сумма по всем cProfile-профилям
+    def export_pstats(self, profile_id=None, route=None):
+        blobs = self._load(CPROFILE, profile_id, route)
+        if not blobs:
+            return None
+        stats = None
+        for blob in blobs:
+            holder = _StatsHolder(marshal.loads(blob))
+            if stats is None:
+                stats = pstats.Stats(holder, stream=io.StringIO())
+            else:
+                stats.add(holder)
+        return marshal.dumps(stats.stats)
+
+    # 🔥 Collapsed stacks ("a;b;c 42" на строку) по одному профилю или сумма по всем sample-профилям
+    def export_collapsed(self, profile_id=None, route=None):
+        blobs = self._load(SAMPLE, profile_id, route)
+        if not blobs:
+            return None
+        stacks = collections.Counter()
+        for blob in blobs:
+            stacks.update(json.loads(blob))
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def stats(self):
+        profiles = self.store.connection().execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+        with self._lock:
+            return {
+                "enabled": bool(ADMIN_TOKEN),
+                "rules": len(self._rules),
+                "profiles": profiles,
+                "profiled": self.profiled,
+                "saved": self.saved,
+                "cprofile_fallbacks": self.fallbacks,
+            }
+
+
+# pstats.Stats принимает объект с create_stats() и .stats
+class _StatsHolder:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+profiler = Profiler()
+
+
+# 🌐 Flask: решение в before_request (после лимитов частоты), запись профиля в teardown.
+# Профиль запроса — в request.environ, а не в g и не через request.headers: без правил хуки стоят доли микросекунды
+_ENVIRON_KEY = "phantom.profile"
+
+
+def init_profiling(app):
+    from flask import request
+
+    if not ADMIN_TOKEN:
+        return
+
+    def api_login():
+        body = request.get_json(silent=True)
+        return request.headers.get("X-Api-Login") or (body.get("api_login") if isinstance(body, dict) else None)
+
+    @app.before_request
+    def _start_profile():
+        environ = request.environ
+        # X-Profile: cprofile|sample — только вместе с верным X-Admin-Token, иначе заголовок игнорируем
+        forced = (environ.get("HTTP_X_PROFILE") or "").strip().lower()
+        if forced and admin_allowed(environ.get("HTTP_X_ADMIN_TOKEN")):
+            forced = forced if forced in MODES else CPROFILE
+        else:
+            forced = None
+            if not profiler.rules():
+                return
+
+        route = request.url_rule.rule if request.url_rule is not None else None
+        if route is None or route.startswith("/api/profiling"):
+            return
+
+        # Профилирование не должно ломать запрос: любая ошибка — запрос идёт без профиля
+        try:
+            mode = profiler.choose(route, api_login, forced)
+            if mode:
+                environ[_ENVIRON_KEY] = profiler.begin(mode)
+        except Exception:
+            logger.exception("💥 Ошибка запуска профиля")
+
+    @app.after_request
+    def _profile_status(response):
+        profile = request.environ.get(_ENVIRON_KEY)
+        if profile is not None:
+            profile.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        profile = request.environ.pop(_ENVIRON_KEY, None)
+        if profile is None:
+            return
+        try:
+            profile.finish(request.url_rule.rule, request.method, api_login())
+        except Exception:
+            logger.exception("💥 Ошибка записи профиля")
@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .local_store import LocalStore
+
+logger = logging.getLogger(__name__)
+
+# 📬 Фоновые задания /qr-code: мерчант получает 202 и id задания сразу,
+# выдача логина и вызов backend'а идут в пуле потоков воркера.
+# Очередь — SQLite-файл на диске (не /dev/shm): задания переживают перезапуск воркеров,
+# задание упавшего воркера подхватывается по истечении аренды.
+
+# off — только синхронно (по умолчанию: воркеры не держат исполнителей впустую);
+# prefer — по заголовку Prefer: respond-async; always — всегда 202
+QR_JOBS_MODES = ("off", "prefer", "always")
+QR_JOBS_MODE = os.environ.get("QR_JOBS_MODE", "off").lower()
+if QR_JOBS_MODE not in QR_JOBS_MODES:
+    raise ValueError(f"QR_JOBS_MODE must be one of {', '.join(QR_JOBS_MODES)}, got {QR_JOBS_MODE!r}")
+QR_JOBS_DB_PATH = os.environ.get("QR_JOBS_DB_PATH", os.path.join(tempfile.gettempdir(), "phantom-qr-jobs.sqlite"))
+
+# Потоков-исполнителей на воркер: столько вызовов backend'ов идёт одновременно
+QR_JOBS_CONCURRENCY = int(os.environ.get("QR_JOBS_CONCURRENCY", 8))
+# Попыток на задание и пауза перед повтором (удваивается с каждой попыткой)
+QR_JOBS_MAX_ATTEMPTS = int(os.environ.get("QR_JOBS_MAX_ATTEMPTS", 3))
+QR_JOBS_RETRY_DELAY = float(os.environ.get("QR_JOBS_RETRY_DELAY", 2))
+# Сколько исполнитель ждёт свободный слот bulkhead'а backend'а
+QR_JOBS_BULKHEAD_WAIT = float(os.environ.get("QR_JOBS_BULKHEAD_WAIT", 30))
+# Аренда выполняемого задания — дольше вызова backend'а со всеми таймаутами и повторами
+QR_JOBS_LEASE = float(os.environ.get("QR_JOBS_LEASE", 120))
+# Как часто простаивающий воркер смотрит в общую очередь (задания других воркеров и прошлых запусков)
+QR_JOBS_POLL_INTERVAL = float(os.environ.get("QR_JOBS_POLL_INTERVAL", 0.2))
+# Сколько хранить завершённые задания для GET /qr-jobs/<id>
+QR_JOBS_TTL = float(os.environ.get("QR_JOBS_TTL", 24 * 3600))
+
+_PRUNE_EVERY = 1000
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS qr_jobs (
+    id TEXT PRIMARY KEY,
+    api_login TEXT NOT NULL,
+    state TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS qr_jobs_ready ON qr_jobs (state, run_after);
+"""
+
+# Одним UPDATE: берём готовое задание или задание с истёкшей арендой (воркер умер)
+_CLAIM = """
+UPDATE qr_jobs SET state = 'running', attempts = attempts + 1, lease_until = :lease, updated = :now
+WHERE id = (
+    SELECT id FROM qr_jobs
+    WHERE (state = 'queued' AND run_after <= :now) OR (state = 'running' AND lease_until < :now)
+    ORDER BY run_after
+    LIMIT 1
+)
+RETURNING id, api_login, payload, attempts, created
+"""
+
+
+# ⛔ Повтор не поможет (4xx backend'а, нет логинов) или опасен (запрос мог дойти до backend'а
+# и создать QR) — задание сразу failed. Остальные ошибки повторяются с паузой
+class JobFailed(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, path=QR_JOBS_DB_PATH, concurrency=QR_JOBS_CONCURRENCY, max_attempts=QR_JOBS_MAX_ATTEMPTS,
+                 retry_delay=QR_JOBS_RETRY_DELAY, lease=QR_JOBS_LEASE, poll_interval=QR_JOBS_POLL_INTERVAL,
+                 ttl=QR_JOBS_TTL):
+        self.store = LocalStore(path, SCHEMA)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._slots = None
+        self._pool = None
+        self._running = 0
+
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    # 🚀 Исполнители в этом процессе (после fork — заново): один поток забирает задания из очереди,
+    # пул из concurrency потоков их выполняет. handler(supabase, job) -> результат;
+    # on_failure(supabase, job, error) — после последней попытки
+    def start(self, supabase_registry, handler, on_failure):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._slots = threading.Semaphore(self.concurrency)
+            self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="qr-job")
+            threading.Thread(
+                target=self._dispatch, args=(supabase_registry, handler, on_failure),
+                name="qr-jobs", daemon=True,
+            ).start()
+
+    def enqueue(self, api_login, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.store.connection().execute(
+            "INSERT INTO qr_jobs (id, api_login, state, payload, run_after, created, updated) "
+            "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, api_login, json.dumps(payload), now, now, now),
+        )
+        with self._lock:
+            self.enqueued += 1
+            prune = self.enqueued % _PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+        self._wakeup.set()
+        return job_id
+
+    def _claim(self):
+        now = time.time()
+        row = self.store.connection().execute(_CLAIM, {"now": now, "lease": now + self.lease}).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "api_login": row["api_login"],
+            "payload": json.loads(row["payload"]),
+            "attempts": row["attempts"],
+            "created": row["created"],
+        }
+
+    # Берём задание, только когда есть свободный исполнитель: лишние ждут в очереди, а не в памяти воркера
+    def _dispatch(self, supabase_registry, handler, on_failure):
+        while True:
+            self._slots.acquire()
+            # Сброс до чтения очереди: enqueue во время чтения не потеряется
+            self._wakeup.clear()
+            try:
+                job = self._claim()
+            except Exception:
+                logger.exception("💥 Ошибка чтения очереди QR-заданий")
+                job = None
+
+            if job is None:
+                self._slots.release()
+                self._wakeup.wait(self.poll_interval)
+                continue
+
+            self._pool.submit(self._work, supabase_registry, job, handler, on_failure)
+
+    def _work(self, supabase_registry, job, handler, on_failure):
+        with self._lock:
+            self._running += 1
+        try:
+            if job["attempts"] > self.max_attempts:
+                # Аренда истекала на каждой попытке (воркер падал на этом задании) — больше не берём
+                self._fail(supabase_registry.client, job, on_failure, Exception("Job lease expired"))
+            else:
+                self._execute(supabase_registry.client, job, handler, on_failure)
+        except Exception:
+            logger.exception("💥 Ошибка обработки QR-задания", extra={"job_id": job["id"]})
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+
+    def _execute(self, supabase, job, handler, on_failure):
+        try:
+            result = handler(supabase, job)
+        except Exception as e:
+            if isinstance(e, JobFailed) or job["attempts"] >= self.max_attempts:
+                self._fail(supabase, job, on_failure, e)
+                return
+
+            # Повтор с паузой: 2, 4, 8... секунд
+            delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+            self.store.connection().execute(
+                "UPDATE qr_jobs SET state = 'queued', run_after = ?, lease_until = NULL, error = ?, updated = ? "
+                "WHERE id = ?",
+                (time.time() + delay, str(e), time.time(), job["id"]),
+            )
+            with self._lock:
+                self.retried += 1
+            return
+
+        self._finish(job["id"], DONE, result=result)
+        with self._lock:
+            self.completed += 1
+
+    def _fail(self, supabase, job, on_failure, error):
+        on_failure(supabase, job, error)
+        self._finish(job["id"], FAILED, error=str(error))
+        with self._lock:
+            self.failed += 1
+        logger.warning("⚠️ QR-задание не выполнено", extra={"job_id": job["id"], "error": str(error)})
+
+    # Завершённому заданию payload не нужен — не храним его до конца TTL
+    def _finish(self, job_id, state, result=None, error=None):
+        self.store.connection().execute(
+            "UPDATE qr_jobs SET state = ?, payload = '{}', result = ?, error = ?, lease_until = NULL, updated = ? "
+            "WHERE id = ?",
+            (state, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+
+    # 🔍 Задание для GET /qr-jobs/<id> или None
+    def get(self, job_id):
+        row = self.store.connection().execute(
+            "SELECT id, api_login, state, attempts, result, error, created, updated FROM qr_jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # 🧹 Завершённые задания старше TTL
+    def prune(self):
+        with self.store.transaction() as conn:
+            conn.execute(
+                "DELETE FROM qr_jobs WHERE state IN ('done', 'failed') AND updated < ?", (time.time() - self.ttl,)
+            )
+
+    def stats(self):
+        counts = dict(self.store.connection().execute("SELECT state, COUNT(*) FROM qr_jobs GROUP BY state").fetchall())
+        with self._lock:
+            return {
+                "mode": QR_JOBS_MODE,
+                "queued": counts.get(QUEUED, 0),
+                "running": counts.get(RUNNING, 0),
+                "done": counts.get(DONE, 0),
+                "failed": counts.get(FAILED, 0),
+                "running_here": self._running,
+                "enqueued": self.enqueued,
+                "completed": self.completed,
+                "failed_here": self.failed,
+                "retried": self.retried,
+            }
+
+
+qr_jobs = JobQueue()
+
+
+# 🙋 Мерчант просит асинхронный ответ (RFC 7240) или режим "always"
+def wants_async(headers):
+    if QR_JOBS_MODE == "always":
+        return True
+    return QR_JOBS_MODE == "prefer" and "respond-async" in (headers.get("Prefer") or "").lower()
@@ -0,0 +1,231 @@
+import math
+import os
+import threading
+import time
+
+from prometheus_client import Counter
+
+from .credentials import credentials_fingerprint, verified_credentials
+from .local_store import LocalStore, shared_path
+from .metrics import timed
+
+# 🚦 Допуск запросов до любой работы с БД:
+# 1) token bucket на каждую пару (мерчант, маршрут) — общий для воркеров хоста SQLite-файл;
+# 2) потолок одновременных запросов воркера — лишние сразу получают 503 (load shedding).
+RATE_LIMIT_DB_PATH = os.environ.get("RATE_LIMIT_DB_PATH", shared_path("phantom-rate-limits.sqlite"))
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") != "0"
+
+# Маршрут (шаблон, как в метриках) -> (токенов в секунду, размер корзины)
+RATE_LIMITS = {
+    "/api/operations/qr-code/": (50, 100),
+    "/api/operations/qr-code/bulk": (2, 4),
+    "/api/operations/<opId>/qr-status": (200, 400),
+    "/api/operations/qr-status/batch": (20, 40),
+    "/api/operations/qr-jobs/<job_id>": (200, 400),
+    "/api/operations/status-stream": (5, 20),
+    "/api/operations/export": (1, 3),
+    "/api/order/": (50, 100),
+}
+# Переопределение: RATE_LIMITS="/api/operations/qr-code/=20:40,/api/order/=5:10"
+for _item in os.environ.get("RATE_LIMITS", "").split(","):
+    if "=" in _item:
+        _route, _limit = _item.rsplit("=", 1)
+        _rate, _burst = _limit.split(":")
+        RATE_LIMITS[_route.strip()] = (float(_rate), float(_burst))
+
+# Сколько прокси перед приложением дописывают X-Forwarded-For (Render — один); 0 — адрес соединения
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))
+
+# Потолок одновременных запросов на воркер (0 — без потолка); long-poll и SSE не считаются
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 256))
+
+# Корзины, не тронутые столько секунд, удаляются (полная корзина = отсутствующая)
+_IDLE_TTL = 3600
+_PRUNE_EVERY = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    allowed INTEGER NOT NULL DEFAULT 1
+);
+"""
+
+# Пополнение и списание одним UPSERT: атомарно между процессами без BEGIN IMMEDIATE
+_TAKE = """
+INSERT INTO rate_buckets (key, tokens, updated, allowed) VALUES (:key, :burst - 1, :now, 1)
+ON CONFLICT (key) DO UPDATE SET
+    allowed = min(:burst, tokens + max(0, :now - updated) * :rate) >= 1,
+    tokens = min(:burst, tokens + max(0, :now - updated) * :rate)
+             - (min(:burst, tokens + max(0, :now - updated) * :rate) >= 1),
+    updated = max(updated, :now)
+RETURNING allowed, tokens
+"""
+
+ADMISSION_REJECTED = Counter(
+    "phantom_admission_rejected_total", "Запросы, отклонённые до обработки",
+    ["route", "reason"],
+)
+
+
+# Кто шлёт запрос: мерчант, чьи логин и ключ уже проходили проверку в этом воркере, — отпечаток
+# пары; иначе адрес клиента. Чужой логин без ключа не тратит корзину мерчанта, выдуманные логины
+# не дают новых корзин. /api/order передаёт ключи в теле (body)
+def identity(headers, remote_addr, body=None):
+    api_login, api_key = headers.get("X-Api-Login"), headers.get("X-Api-Key")
+    if not api_key and isinstance(body, dict):
+        api_login, api_key = body.get("api_login"), body.get("api_key")
+
+    if isinstance(api_key, str) and api_key and (api_login is None or isinstance(api_login, str)):
+        fingerprint = credentials_fingerprint(api_login, api_key)
+        if verified_credentials.peek(fingerprint) is True:
+            return f"cred:{fingerprint}"
+    return f"addr:{remote_addr}"
+
+
+# 🌍 Адрес клиента за TRUSTED_PROXY_HOPS прокси — как ProxyFix(x_for=...) у Flask, для Starlette-обработчиков
+def client_address(headers, remote_addr, hops=TRUSTED_PROXY_HOPS):
+    forwarded = [value.strip() for value in (headers.get("X-Forwarded-For") or "").split(",") if value.strip()]
+    if hops and len(forwarded) >= hops:
+        return forwarded[-hops]
+    return remote_addr
+
+
+class RateLimiter:
+    def __init__(self, path=RATE_LIMIT_DB_PATH, limits=None, max_in_flight=ADMISSION_MAX_IN_FLIGHT):
+        self.store = LocalStore(path, SCHEMA)
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.max_in_flight = max_in_flight
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.checked = 0
+        self.limited = 0
+        self.shed = 0
+
+    # 🪣 (True, None) — токен списан; (False, секунд до следующего токена) — отказ
+    @timed("admission", "take")
+    def take(self, route, who):
+        rate, burst = self.limits[route]
+        allowed, tokens = self.store.connection().execute(
+            _TAKE, {"key": f"{route}|{who}", "rate": rate, "burst": burst, "now": time.time()}
+        ).fetchone()
+
+        with self._lock:
+            self.checked += 1
+            prune = self.checked % _PRUNE_EVERY == 0
+            if not allowed:
+                self.limited += 1
+        if prune:
+            self.prune()
+
+        if allowed:
+            return True, None
+        return False, (1 - tokens) / rate
+
+    def prune(self):
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM rate_buckets WHERE updated < ?", (time.time() - _IDLE_TTL,))
+
+    # 🧮 Потолок одновременных запросов воркера
+    def enter(self):
+        with self._lock:
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                self.shed += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    # ⛔ (status, body, retry_after) отказа или None — запрос допущен (и учтён в in-flight, если count)
+    def admit(self, route, who, count=True):
+        if route not in self.limits:
+            return None
+
+        if count and not self.enter():
+            ADMISSION_REJECTED.labels(route, "overloaded").inc()
+            return 503, {"error": "Server is overloaded, retry later"}, 1
+
+        allowed, retry_after = self.take(route, who)
+        if not allowed:
+            if count:
+                self.leave()
+            ADMISSION_REJECTED.labels(route, "rate_limited").inc()
+            return 429, {"error": f"Rate limit exceeded for {route}"}, retry_after
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": RATE_LIMIT_ENABLED,
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "checked": self.checked,
+                "rate_limited": self.limited,
+                "shed": self.shed,
+            }
+
+
+rate_limiter = RateLimiter()
+
+
+def _retry_after(seconds):
+    return str(max(1, math.ceil(seconds)))
+
+
+# 🌐 Flask: проверка в before_request — раньше аутентификации и запросов в БД
+def init_rate_limits(app):
+    from flask import g, jsonify, request
+
+    if not RATE_LIMIT_ENABLED:
+        return
+
+    @app.before_request
+    def _admit():
+        route = request.url_rule.rule if request.url_rule is not None else None
+        if route not in rate_limiter.limits:
+            return
+        # remote_addr — уже адрес клиента из X-Forwarded-For (ProxyFix в app.py)
+        body = request.get_json(silent=True) if not request.headers.get("X-Api-Key") else None
+        rejected = rate_limiter.admit(route, identity(request.headers, request.remote_addr, body))
+        if rejected:
+            status, body, retry_after = rejected
+            return jsonify(body), status, {"Retry-After": _retry_after(retry_after)}
+        g.admitted = True
+
+    @app.teardown_request
+    def _leave(exc):
+        if g.pop("admitted", False):
+            rate_limiter.leave()
+
+
+# ⚡ То же для Starlette-обработчиков ASGI-режима.
+# long_lived(request) — запрос ждёт событий (long-poll, SSE): лимит частоты есть, в потолок не входит
+def rate_limited(route, handler, long_lived=None):
+    async def wrapper(request):
+        import asyncio
+
+        from starlette.responses import JSONResponse
+
+        if not RATE_LIMIT_ENABLED:
+            return await handler(request)
+
+        count = not (long_lived and long_lived(request))
+        who = identity(request.headers, client_address(request.headers, request.client.host if request.client else None))
+        # Общий SQLite может ждать блокировку другого воркера — не в event loop
+        rejected = await asyncio.to_thread(rate_limiter.admit, route, who, count)
+        if rejected:
+            status, body, retry_after = rejected
+            return JSONResponse(body, status_code=status, headers={"Retry-After": _retry_after(retry_after)})
+
+        try:
+            return await handler(request)
+        finally:
+            if count:
+                rate_limiter.leave()
+
+    return wrapper
@@ -0,0 +1,241 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from .http_client import outbound
+from .local_store import shared_path
+from .status_cache import remember_purchase
+from .statuses import provider_status
+
+logger = logging.getLogger(__name__)
+
+# 🔄 Сверка зависших pending-покупок с Birs: webhook мог потеряться, а мерчант
+# так и будет опрашивать /qr-status. Фоновый поток одного воркера на хост
+# (flock-файл) раз в RECONCILE_INTERVAL проходит по старым pending-строкам.
+RECONCILE_ENABLED = os.environ.get("RECONCILE_ENABLED", "").lower() in ("1", "true", "yes")
+RECONCILE_INTERVAL = float(os.environ.get("RECONCILE_INTERVAL", 300))
+RECONCILE_LOCK_PATH = os.environ.get("RECONCILE_LOCK_PATH", shared_path("phantom-reconciler.lock"))
+
+# Какие покупки сверяем: pending дольше STALE_AFTER секунд, но не старше MAX_AGE
+RECONCILE_STALE_AFTER = float(os.environ.get("RECONCILE_STALE_AFTER", 900))
+RECONCILE_MAX_AGE = float(os.environ.get("RECONCILE_MAX_AGE", 7 * 24 * 3600))
+
+# Страница keyset-выборки, одновременных запросов к Birs и их потолок в секунду
+RECONCILE_PAGE_SIZE = int(os.environ.get("RECONCILE_PAGE_SIZE", 1000))
+RECONCILE_CONCURRENCY = int(os.environ.get("RECONCILE_CONCURRENCY", 8))
+RECONCILE_RATE = float(os.environ.get("RECONCILE_RATE", 20))
+# id в одном UPDATE ... WHERE id IN (...) — уходят в URL PostgREST
+RECONCILE_UPDATE_CHUNK = int(os.environ.get("RECONCILE_UPDATE_CHUNK", 200))
+
+# 🔐 Статус платежа у Birs: {id} заменяется на id покупки
+BIRS_API_KEY = os.environ.get("BIRS_API_KEY")
+BIRS_STATUS_URL = os.environ.get("BIRS_STATUS_URL", "https://admin.birs.app/v2.1/payment-test/payment/{id}")
+
+
+# ⏱ Равномерный темп запросов: не больше rate в секунду на все потоки
+class Pacer:
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            slot = max(time.monotonic(), self._next)
+            self._next = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Reconciler:
+    def __init__(self, interval=RECONCILE_INTERVAL, stale_after=RECONCILE_STALE_AFTER, max_age=RECONCILE_MAX_AGE,
+                 page_size=RECONCILE_PAGE_SIZE, concurrency=RECONCILE_CONCURRENCY, rate=RECONCILE_RATE,
+                 update_chunk=RECONCILE_UPDATE_CHUNK, status_url=BIRS_STATUS_URL, lock_path=RECONCILE_LOCK_PATH):
+        self.interval = interval
+        self.stale_after = stale_after
+        self.max_age = max_age
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.rate = rate
+        self.update_chunk = update_chunk
+        self.status_url = status_url
+        self.lock_path = lock_path
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.leader = False
+
+        self.runs = 0
+        self.scanned = 0
+        self.queried = 0
+        self.updated = 0
+        self.still_pending = 0
+        self.errors = 0
+        self.last_run_seconds = None
+
+    # 🚀 Поток сверки в этом процессе (после fork — заново); supabase_registry.client создаётся лениво
+    def ensure_started(self, supabase_registry):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, args=(supabase_registry,), daemon=True)
+            self._thread.start()
+
+    def _run(self, supabase_registry):
+        lock_file = None
+        while True:
+            # Лидер держит flock до конца жизни процесса; умер — подхватит другой воркер
+            if lock_file is None:
+                lock_file = self._try_lead()
+            if lock_file is not None:
+                try:
+                    self.run_once(supabase_registry.client)
+                except Exception:
+                    logger.exception("💥 Ошибка сверки pending-покупок")
+            time.sleep(self.interval)
+
+    def _try_lead(self):
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        self.leader = True
+        return lock_file
+
+    # 📄 Keyset-страницы id: WHERE id > последний ORDER BY id — без OFFSET, память — одна страница
+    def _pages(self, supabase):
+        now = datetime.utcnow()
+        stale_before = (now - timedelta(seconds=self.stale_after)).isoformat()
+        created_after = (now - timedelta(seconds=self.max_age)).isoformat()
+
+        last_id = None
+        while True:
+            query = (
+                supabase.table("purchases")
+                .select("id")
+                .eq("status", "pending")
+                .lt("created_at", stale_before)
+                .gt("created_at", created_after)
+            )
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            rows = query.order("id").limit(self.page_size).execute().data or []
+            if not rows:
+                return
+            yield [row["id"] for row in rows]
+            if len(rows) < self.page_size:
+                return
+            last_id = rows[-1]["id"]
+
+    # 🌍 Статус у Birs -> (id, новый статус или None — ещё не финальный)
+    def _query(self, pacer, payment_id):
+        pacer.wait()
+        response = outbound.get(
+            self.status_url.format(id=payment_id),
+            headers={"accept": "application/json", "X-Api-Key": BIRS_API_KEY},
+        )
+        response.raise_for_status()
+        payment = response.json().get("data") or {}
+        return payment_id, provider_status(payment.get("status"))
+
+    def _safe_query(self, pacer, payment_id):
+        try:
+            return self._query(pacer, payment_id)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return payment_id, None
+
+    # 💾 Один UPDATE на статус и пачку id; status=pending в условии — webhook, успевший раньше, не затираем
+    def _apply(self, supabase, updates):
+        by_status = {}
+        for payment_id, status in updates:
+            by_status.setdefault(status, []).append(payment_id)
+
+        updated = 0
+        for status, ids in by_status.items():
+            for start in range(0, len(ids), self.update_chunk):
+                rows = (
+                    supabase.table("purchases")
+                    .update({"status": status})
+                    .in_("id", ids[start:start + self.update_chunk])
+                    .eq("status", "pending")
+                    .execute()
+                    .data
+                ) or []
+                for row in rows:
+                    remember_purchase(row)
+                updated += len(rows)
+        return updated
+
+    def run_once(self, supabase):
+        started = time.monotonic()
+        pacer = Pacer(self.rate)
+        scanned = updated = 0
+
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="reconcile") as pool:
+            for ids in self._pages(supabase):
+                results = pool.map(lambda payment_id: self._safe_query(pacer, payment_id), ids)
+                updates = [(payment_id, status) for payment_id, status in results if status]
+                page_updated = self._apply(supabase, updates) if updates else 0
+
+                scanned += len(ids)
+                updated += page_updated
+                with self._lock:
+                    self.scanned += len(ids)
+                    self.queried += len(ids)
+                    self.updated += page_updated
+                    self.still_pending += len(ids) - len(updates)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.runs += 1
+            self.last_run_seconds = round(elapsed, 3)
+        if scanned:
+            logger.info("🔄 Reconciled pending purchases", extra={
+                "scanned": scanned, "updated": updated, "seconds": round(elapsed, 3),
+            })
+        return {"scanned": scanned, "updated": updated, "seconds": elapsed}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": RECONCILE_ENABLED,
+                "leader": self.leader,
+                "runs": self.runs,
+                "scanned": self.scanned,
+                "queried": self.queried,
+                "updated": self.updated,
+                "still_pending": self.still_pending,
+                "errors": self.errors,
+                "last_run_seconds": self.last_run_seconds,
+            }
+
+
+reconciler = Reconciler()
+
+
+# 🌐 Поток стартует с первым запросом воркера — так он переживает fork при gunicorn --preload
+def init_reconciler(app):
+    if not RECONCILE_ENABLED:
+        return
+
+    registry = app.extensions["supabase"]
+
+    @app.before_request
+    def _start_reconciler():
+        reconciler.ensure_started(registry)
@@ -0,0 +1,208 @@
+import os
+import threading
+import time
+
+from .local_store import LocalStore, shared_path
+from .status_cache import get_purchase, get_purchase_async, get_purchases, status_listeners
+
+# 🧪 Хранилище тестовых покупок (клиенты с test=true и /api/test):
+# table — по умолчанию, как раньше: таблица purchases_test, общая для всех хостов;
+# host-local — SQLite-файл в /dev/shm, общий для воркеров ОДНОГО хоста, ноль запросов в Supabase.
+# host-local только для развёртывания в один экземпляр: покупку, созданную на другом хосте,
+# /qr-status и webhook не найдут, а рестарт хоста её стирает.
+SANDBOX_BACKENDS = ("table", "host-local")
+SANDBOX_BACKEND = os.environ.get("SANDBOX_BACKEND", "table")
+if SANDBOX_BACKEND not in SANDBOX_BACKENDS:
+    raise ValueError(f"SANDBOX_BACKEND must be one of {', '.join(SANDBOX_BACKENDS)}, got {SANDBOX_BACKEND!r}")
+SANDBOX_DB_PATH = os.environ.get("SANDBOX_DB_PATH", shared_path("phantom-sandbox.sqlite"))
+SANDBOX_TABLE = "purchases_test"
+
+# Сколько живёт тестовая покупка и сколько их держим максимум (старые вытесняются)
+SANDBOX_TTL = float(os.environ.get("SANDBOX_TTL", 24 * 3600))
+SANDBOX_MAX_SIZE = int(os.environ.get("SANDBOX_MAX_SIZE", 100000))
+
+# ⏱ Расписание статусов: "pending:10,success" — 10 секунд pending, потом success навсегда.
+# Webhook на тестовую покупку выставляет статус сам и останавливает расписание.
+SANDBOX_SCHEDULE = os.environ.get("SANDBOX_SCHEDULE", "pending:10,success")
+
+# Чистка просроченных и лишних записей — раз в столько созданий на воркер
+_PRUNE_EVERY = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sandbox_purchases (
+    id TEXT PRIMARY KEY,
+    api_login TEXT NOT NULL,
+    amount REAL,
+    qr_id TEXT,
+    qr_payload TEXT,
+    status TEXT,
+    commit_info TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sandbox_purchases_created ON sandbox_purchases (created);
+"""
+
+
+# "pending:10,success" -> [("pending", 10.0), ("success", None)]
+def parse_schedule(value):
+    steps = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        status, _, seconds = item.partition(":")
+        steps.append((status.strip().lower(), float(seconds) if seconds else None))
+    if not steps:
+        raise ValueError("SANDBOX_SCHEDULE is empty")
+    return steps
+
+
+def scheduled_status(schedule, age):
+    for status, seconds in schedule:
+        if seconds is None or age < seconds:
+            return status
+        age -= seconds
+    return schedule[-1][0]
+
+
+# 🖥 Тестовые покупки в SQLite хоста (SANDBOX_BACKEND=host-local): только один экземпляр сервиса
+class HostLocalSandbox:
+    persistent = False
+
+    def __init__(self, path=SANDBOX_DB_PATH, ttl=SANDBOX_TTL, max_size=SANDBOX_MAX_SIZE, schedule=SANDBOX_SCHEDULE):
+        self.store = LocalStore(path, SCHEMA)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.schedule = parse_schedule(schedule)
+
+        self._lock = threading.Lock()
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.webhooks = 0
+        self.evicted = 0
+
+    def _count(self, field, value=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + value)
+
+    # 💾 Покупка из /api/test: поля как у строки purchases_test
+    def create(self, supabase, purchase):
+        self.store.connection().execute(
+            "INSERT OR REPLACE INTO sandbox_purchases (id, api_login, amount, qr_id, qr_payload, status, commit_info, created) "
+            "VALUES (?, ?, ?, ?, ?, NULL, NULL, ?)",
+            (purchase["id"], purchase["api_login"], purchase.get("amount"), purchase.get("qr_id"),
+             purchase.get("qr_payload"), time.time()),
+        )
+        with self._lock:
+            self.created += 1
+            prune = self.created % _PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    # 🧹 Просроченные — по TTL, лишние сверх max_size — самые старые
+    def prune(self):
+        with self.store.transaction() as conn:
+            expired = conn.execute("DELETE FROM sandbox_purchases WHERE created < ?", (time.time() - self.ttl,)).rowcount
+            excess = conn.execute(
+                "DELETE FROM sandbox_purchases WHERE id IN "
+                "(SELECT id FROM sandbox_purchases ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            ).rowcount
+        self._count("evicted", expired + excess)
+
+    def _purchase(self, row, now):
+        age = now - row["created"]
+        if age >= self.ttl:
+            return None
+        return {
+            "id": row["id"],
+            "status": row["status"] or scheduled_status(self.schedule, age),
+            "commit": row["commit_info"],
+            "api_login": row["api_login"],
+        }
+
+    # 🔍 Та же форма, что у status_cache.get_purchase: {id, status, commit, api_login} или None
+    def get(self, supabase, op_id):
+        row = self.store.connection().execute(
+            "SELECT id, api_login, status, commit_info, created FROM sandbox_purchases WHERE id = ?", (str(op_id),)
+        ).fetchone()
+        purchase = self._purchase(row, time.time()) if row else None
+        self._count("hits" if purchase else "misses")
+        return purchase
+
+    # Чтение из WAL не ждёт писателей — можно прямо в event loop
+    async def get_async(self, postgrest, op_id):
+        return self.get(None, op_id)
+
+    def get_many(self, supabase, op_ids):
+        op_ids = [str(op_id) for op_id in op_ids]
+        rows = self.store.connection().execute(
+            f"SELECT id, api_login, status, commit_info, created FROM sandbox_purchases "
+            f"WHERE id IN ({','.join('?' * len(op_ids))})",
+            op_ids,
+        ).fetchall()
+        now = time.time()
+        found = {row["id"]: self._purchase(row, now) for row in rows}
+        purchases = {op_id: found.get(op_id) for op_id in op_ids}
+        hits = sum(1 for purchase in purchases.values() if purchase)
+        self._count("hits", hits)
+        self._count("misses", len(op_ids) - hits)
+        return purchases
+
+    # 🔔 Webhook на тестовую покупку: обновлённая покупка или None (это не тестовая покупка)
+    def update_status(self, supabase, op_id, status):
+        row = self.store.connection().execute(
+            "UPDATE sandbox_purchases SET status = ? WHERE id = ? AND created >= ? "
+            "RETURNING id, api_login, status, commit_info, created",
+            (status, str(op_id), time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+
+        self._count("webhooks")
+        purchase = self._purchase(row, time.time())
+        for listener in status_listeners:
+            listener(SANDBOX_TABLE, purchase)
+        return purchase
+
+    def stats(self):
+        size = self.store.connection().execute("SELECT count(*) FROM sandbox_purchases").fetchone()[0]
+        with self._lock:
+            return {
+                "backend": "host-local",
+                "size": size,
+                "max_size": self.max_size,
+                "created": self.created,
+                "hits": self.hits,
+                "misses": self.misses,
+                "webhooks": self.webhooks,
+                "evicted": self.evicted,
+            }
+
+
+# 🗄 Постоянное хранение в purchases_test (через общий кэш статусов)
+class TableSandbox:
+    persistent = True
+
+    def create(self, supabase, purchase):
+        supabase.table(SANDBOX_TABLE).insert(purchase).execute()
+
+    def get(self, supabase, op_id):
+        return get_purchase(supabase, SANDBOX_TABLE, op_id)
+
+    async def get_async(self, postgrest, op_id):
+        return await get_purchase_async(postgrest, SANDBOX_TABLE, op_id)
+
+    def get_many(self, supabase, op_ids):
+        return get_purchases(supabase, SANDBOX_TABLE, op_ids)
+
+    # Webhook'и по purchases_test не обновлялись и не обновляются
+    def update_status(self, supabase, op_id, status):
+        return None
+
+    def stats(self):
+        return {"backend": "table"}
+
+
+sandbox_store = HostLocalSandbox() if SANDBOX_BACKEND == "host-local" else TableSandbox()
@@ -0,0 +1,107 @@
+import os
+
+from .cache import MISSING, InFlight, TTLCache
+
+# ⚙️ TTL кэша статусов: финальные статусы почти не меняются, pending — часто
+STATUS_CACHE_TERMINAL_TTL = float(os.environ.get("STATUS_CACHE_TERMINAL_TTL", 300))
+STATUS_CACHE_PENDING_TTL = float(os.environ.get("STATUS_CACHE_PENDING_TTL", 2))
+STATUS_CACHE_SIZE = int(os.environ.get("STATUS_CACHE_SIZE", 10000))
+# Сколько opId можно спросить одним batch-запросом (ids уходят в URL PostgREST)
+STATUS_BATCH_MAX = int(os.environ.get("STATUS_BATCH_MAX", 300))
+
+TERMINAL_STATUSES = {"success", "refund", "cancelled"}
+PURCHASE_COLUMNS = "id, status, commit, api_login"
+
+# Подписчики на обновления статусов (например, StatusHub в ASGI-режиме)
+status_listeners = []
+
+# 🧠 (таблица, opId) -> {status, commit, api_login} или None (покупки нет)
+status_cache = TTLCache(maxsize=STATUS_CACHE_SIZE, ttl=STATUS_CACHE_PENDING_TTL)
+_inflight = InFlight()
+
+
+def is_terminal(purchase):
+    return ((purchase or {}).get("status") or "").lower() in TERMINAL_STATUSES
+
+
+def _ttl(purchase):
+    return STATUS_CACHE_TERMINAL_TTL if is_terminal(purchase) else STATUS_CACHE_PENDING_TTL
+
+
+def _key(table, op_id):
+    return table, str(op_id)
+
+
+def _purchase_query(db, table, op_id):
+    # api_login сверяем уже в коде — так одна запись кэша служит любому запросу по opId
+    return db.table(table).select(PURCHASE_COLUMNS).eq("id", op_id).maybe_single()
+
+
+# 💾 Прочитанная покупка (или None) в кэш — без оповещения подписчиков, это не смена статуса
+def cache_purchase(table, op_id, purchase):
+    status_cache.set(_key(table, op_id), purchase, ttl=_ttl(purchase))
+    return purchase
+
+
+def _remember(table, op_id, resp):
+    return cache_purchase(table, op_id, (resp.data if resp else None) or None)
+
+
+# 🔍 Покупка по opId (read-through)
+def get_purchase(supabase, table, op_id):
+    cached = status_cache.get(_key(table, op_id))
+    if cached is not MISSING:
+        return cached
+    return _remember(table, op_id, _purchase_query(supabase, table, op_id).execute())
+
+
+# Тысячи long-poll'ов на один opId дают один запрос в БД, а не тысячу
+async def get_purchase_async(postgrest, table, op_id):
+    key = _key(table, op_id)
+    cached = status_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    async def load():
+        return _remember(table, op_id, await _purchase_query(postgrest, table, op_id).execute())
+
+    return await _inflight.run(key, load)
+
+
+def _purchases_query(db, table, op_ids):
+    return db.table(table).select(PURCHASE_COLUMNS).in_("id", op_ids)
+
+
+# 📦 Пачка покупок: что есть в кэше — из кэша, остальное одним WHERE id IN (...).
+# Возвращает {opId: покупка или None}
+def get_purchases(supabase, table, op_ids):
+    purchases, missing = {}, []
+    for op_id in op_ids:
+        cached = status_cache.get(_key(table, op_id))
+        if cached is MISSING:
+            missing.append(op_id)
+        else:
+            purchases[str(op_id)] = cached
+
+    if missing:
+        rows = _purchases_query(supabase, table, missing).execute().data or []
+        found = {str(row["id"]): row for row in rows}
+        for op_id in missing:
+            purchase = found.get(str(op_id))
+            status_cache.set(_key(table, op_id), purchase, ttl=_ttl(purchase))
+            purchases[str(op_id)] = purchase
+
+    return purchases
+
+
+# ♻️ Обновление из webhook: кладём свежую строку, которую вернул UPDATE
+def remember_purchase(row, table="purchases"):
+    purchase = {column: row.get(column) for column in ("id", "status", "commit", "api_login")}
+    status_cache.set(_key(table, row["id"]), purchase, ttl=_ttl(purchase))
+
+    for listener in status_listeners:
+        listener(table, purchase)
+
+
+def invalidate_purchase(op_id, table="purchases"):
+    status_cache.invalidate(_key(table, op_id))
@@ -0,0 +1,72 @@
+import asyncio
+import os
+
+# ⚙️ Ограничения long-poll / SSE
+LONGPOLL_MAX_WAIT = float(os.environ.get("LONGPOLL_MAX_WAIT", 30))
+STATUS_RECHECK_INTERVAL = float(os.environ.get("STATUS_RECHECK_INTERVAL", 5))
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", 15))
+SSE_MAX_IDS = int(os.environ.get("SSE_MAX_IDS", 500))
+
+
+# 📡 In-process pub/sub для смены статусов: ждущие запросы — это asyncio.Queue,
+# а не потоки, поэтому десятки тысяч наблюдателей стоят лишь памяти.
+# Все структуры трогаем только из потока event loop'а.
+class StatusHub:
+    def __init__(self):
+        self._loop = None
+        self._subscribers = {}  # (table, opId) -> set(asyncio.Queue)
+
+        self.published = 0
+        self.delivered = 0
+
+    def bind(self, loop):
+        self._loop = loop
+
+    def subscribe(self, table, op_ids):
+        queue = asyncio.Queue()
+        for op_id in op_ids:
+            self._subscribers.setdefault((table, str(op_id)), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, table, op_ids, queue):
+        for op_id in op_ids:
+            key = (table, str(op_id))
+            queues = self._subscribers.get(key)
+            if queues is None:
+                continue
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[key]
+
+    # Можно вызывать из любого потока (Flask-webhook крутится в пуле потоков)
+    def publish(self, table, purchase):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            self._deliver(table, purchase)
+        else:
+            loop.call_soon_threadsafe(self._deliver, table, purchase)
+
+    def _deliver(self, table, purchase):
+        self.published += 1
+        for queue in self._subscribers.get((table, str(purchase["id"])), ()):
+            queue.put_nowait(purchase)
+            self.delivered += 1
+
+    def stats(self):
+        return {
+            "watched_ids": len(self._subscribers),
+            "subscriptions": sum(len(queues) for queues in list(self._subscribers.values())),
+            "published": self.published,
+            "delivered": self.delivered,
+        }
+
+
+status_hub = StatusHub()
@@ -0,0 +1,118 @@
+import os
+
+from .cache import MISSING, InFlight
+from .credentials import credentials_cache, remember_client
+from .metrics import timed
+from .sandbox import SANDBOX_TABLE, sandbox_store
+from .status_cache import cache_purchase, get_purchase, get_purchase_async
+
+# ⚡ /qr-status за один запрос к БД вместо трёх (ключ -> логин, логин + ключ, покупка):
+# функция qr_status_lookup из sql/qr_status_lookup.sql. Включать после миграции.
+STATUS_LOOKUP_RPC = os.environ.get("STATUS_LOOKUP_RPC", "").lower() in ("1", "true", "yes")
+
+# Ошибки функции -> ответ маршрута (тексты — как в authenticate_status)
+AUTH_ERRORS = {
+    "missing_credentials": (400, "Missing API credentials"),
+    "invalid_key": (401, "Invalid API key"),
+    "forbidden": (403, "Forbidden: invalid API credentials"),
+}
+NOT_FOUND = (404, "Purchase not found")
+
+_inflight = InFlight()
+
+
+def _table(client):
+    return SANDBOX_TABLE if client.get("test") else "purchases"
+
+
+# 🧠 Клиент из кэша ключей: (клиент, None), (None, ошибка) или (MISSING, None) — нужен запрос
+def _cached_client(api_login, api_key):
+    if not api_login and not api_key:
+        return None, AUTH_ERRORS["missing_credentials"]
+    if not api_key:
+        # Как find_api_client: логин без ключа не проверяем в БД
+        return None, AUTH_ERRORS["forbidden"]
+
+    client = credentials_cache.get((api_login or None, api_key))
+    if client is MISSING:
+        return MISSING, None
+    if client is None:
+        return None, AUTH_ERRORS["forbidden" if api_login else "invalid_key"]
+    return client, None
+
+
+def _rpc(db, api_login, api_key, op_id):
+    return db.rpc("qr_status_lookup", {
+        "p_api_login": api_login or None,
+        "p_api_key": api_key,
+        "p_op_id": str(op_id),
+        "p_read_test": sandbox_store.persistent,
+    })
+
+
+# 💾 Ответ функции -> те же кэши, что у обычного пути: (клиент, покупка или MISSING, ошибка)
+def _remember(api_login, api_key, op_id, rows):
+    result = rows[0] if rows else {}
+    error = result.get("error")
+    if error:
+        if error != "missing_credentials":
+            remember_client((api_login or None, api_key), None)
+        return None, MISSING, AUTH_ERRORS.get(error, AUTH_ERRORS["forbidden"])
+
+    client = remember_client((api_login or None, api_key), result["client"])
+    if client.get("test") and not sandbox_store.persistent:
+        return client, MISSING, None
+    return client, cache_purchase(_table(client), op_id, result.get("purchase")), None
+
+
+def _check(client, purchase):
+    if not purchase or purchase.get("api_login") != client["api_login"]:
+        return client, None, NOT_FOUND
+    return client, purchase, None
+
+
+# 🔍 (клиент, покупка, None) или (клиент или None, None, (status, сообщение))
+@timed("status_lookup", "rpc")
+def lookup_status(supabase, api_login, api_key, op_id):
+    client, error = _cached_client(api_login, api_key)
+    if error:
+        return None, None, error
+
+    purchase = MISSING
+    if client is MISSING:
+        client, purchase, error = _remember(
+            api_login, api_key, op_id, _rpc(supabase, api_login, api_key, op_id).execute().data
+        )
+        if error:
+            return None, None, error
+
+    if client.get("test"):
+        if purchase is MISSING:
+            purchase = sandbox_store.get(supabase, op_id)
+    elif purchase is MISSING:
+        purchase = get_purchase(supabase, "purchases", op_id)
+    return _check(client, purchase)
+
+
+# ⚡ То же для ASGI-режима; одновременные промахи по одной тройке ждут один запрос
+async def lookup_status_async(postgrest, api_login, api_key, op_id):
+    client, error = _cached_client(api_login, api_key)
+    if error:
+        return None, None, error
+
+    purchase = MISSING
+    if client is MISSING:
+        async def load():
+            rows = (await _rpc(postgrest, api_login, api_key, op_id).execute()).data
+            return _remember(api_login, api_key, op_id, rows)
+
+        client, purchase, error = await _inflight.run((api_login, api_key, str(op_id)), load)
+        if error:
+            return None, None, error
+
+    if client.get("test"):
+        if purchase is MISSING:
+            purchase = await sandbox_store.get_async(postgrest, op_id)
+    elif purchase is MISSING:
+        purchase = await get_purchase_async(postgrest, "purchases", op_id)
+    return _check(client, purchase)
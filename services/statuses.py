@@ -0,0 +1,33 @@
+# 🔢 Коды статусов операций для мерчантов
+STATUS_IN_PROGRESS = 1
+STATUS_REFUND = 3
+STATUS_SUCCESS = 5
+
+# 🔁 Статус платежа у Birs (webhook или сверка) -> статус purchases.
+# Остальные значения (pending и т.п.) финальными не считаем
+PROVIDER_STATUSES = {
+    "settlement": "success",
+    "failed": "cancelled",
+    "expired": "cancelled",
+}
+
+
+def provider_status(value):
+    return PROVIDER_STATUSES.get((value or "").strip().lower())
+
+
+# ✅ operation_status_code + info по записи purchases / purchases_test
+def operation_status(purchase):
+    status = purchase.get("status", "").lower() if purchase.get("status") else ""
+    commit_info = purchase.get("commit")
+
+    operation_status_code = STATUS_IN_PROGRESS  # По умолчанию "в процессе"
+    info = None
+
+    if status == "success":
+        operation_status_code = STATUS_SUCCESS
+    elif status == "refund":
+        operation_status_code = STATUS_REFUND
+        info = commit_info
+
+    return {"operation_status_code": operation_status_code, "info": info}
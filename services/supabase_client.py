@@ -0,0 +1,123 @@
+import os
+import threading
+
+from flask import current_app
+
+from .metrics import AsyncTimedTransport, TimedTransport
+
+# ⚙️ Пул keep-alive соединений к PostgREST (один на воркер)
+SUPABASE_MAX_CONNECTIONS = int(os.environ.get("SUPABASE_MAX_CONNECTIONS", 20))
+SUPABASE_MAX_KEEPALIVE = int(os.environ.get("SUPABASE_MAX_KEEPALIVE", 10))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.environ.get("SUPABASE_KEEPALIVE_EXPIRY", 30))
+
+
+def _pool_limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=SUPABASE_MAX_CONNECTIONS,
+        max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+        keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+    )
+
+
+# 🔌 Меняем HTTP-сессию PostgREST на клиент с настроенным пулом и замером каждого запроса
+def _use_pooled_session(postgrest):
+    import httpx
+    from postgrest.utils import SyncClient
+
+    old = postgrest.session
+    postgrest.session = SyncClient(
+        base_url=old.base_url,
+        headers=old.headers,
+        timeout=old.timeout,
+        transport=TimedTransport(httpx.HTTPTransport(limits=_pool_limits())),
+    )
+    old.close()
+
+
+# 🗂 Реестр клиента Supabase: создаётся лениво, общий для всех потоков воркера
+class SupabaseRegistry:
+    def __init__(self, url=None, key=None):
+        self.url = url
+        self.key = key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create()
+                client = self._client
+        return client
+
+    def _create(self):
+        # Импорт supabase тяжёлый — откладываем его до первого запроса
+        from supabase import create_client
+
+        url = self.url or os.environ.get("SUPABASE_URL")
+        key = self.key or os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+
+        client = create_client(url, key)
+        _use_pooled_session(client.postgrest)
+        return client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.postgrest.session.close()
+                self._client = None
+
+
+# ⚡ Async-клиент PostgREST для ASGI-режима (один на event loop воркера)
+class AsyncPostgrestRegistry:
+    def __init__(self, url=None, key=None):
+        self.url = url
+        self.key = key
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._create()
+        return self._client
+
+    def _create(self):
+        import httpx
+        from postgrest import AsyncPostgrestClient
+        from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+        from postgrest.utils import AsyncClient
+
+        url = self.url or os.environ.get("SUPABASE_URL")
+        key = self.key or os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+
+        client = AsyncPostgrestClient(f"{url}/rest/v1", headers={**DEFAULT_POSTGREST_CLIENT_HEADERS, "apiKey": key})
+        client.auth(token=key)
+
+        # Сессия ещё не открывала соединений — просто подменяем её
+        old = client.session
+        client.session = AsyncClient(
+            base_url=old.base_url,
+            headers=old.headers,
+            timeout=old.timeout,
+            transport=AsyncTimedTransport(httpx.AsyncHTTPTransport(limits=_pool_limits())),
+        )
+        return client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def init_supabase(app, url=None, key=None):
+    app.extensions["supabase"] = SupabaseRegistry(url, key)
+    return app.extensions["supabase"]
+
+
+# 🔑 Клиент текущего приложения
+def get_supabase():
+    return current_app.extensions["supabase"].client
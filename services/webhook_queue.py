@@ -0,0 +1,273 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from .local_store import data_path
+from .status_cache import remember_purchase
+
+logger = logging.getLogger(__name__)
+
+# ⚙️ Режим отложенной записи webhook-статусов (по умолчанию выключен)
+WEBHOOK_BATCH_MODE = os.environ.get("WEBHOOK_BATCH_MODE", "").lower() in ("1", "true", "yes")
+# Журнал — единственная копия подтверждённых событий: каталог должен переживать рестарт (не /tmp)
+WEBHOOK_QUEUE_DIR = os.environ.get("WEBHOOK_QUEUE_DIR") or data_path("webhooks")
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 200))
+WEBHOOK_FLUSH_INTERVAL = float(os.environ.get("WEBHOOK_FLUSH_INTERVAL", 1.0))
+# Как часто искать журналы умерших воркеров
+WEBHOOK_ADOPT_INTERVAL = float(os.environ.get("WEBHOOK_ADOPT_INTERVAL", 30))
+
+# Сколько последних "не найденных" id держим для отчёта
+UNMATCHED_HISTORY = 1000
+
+
+# 📝 Сегмент журнала: файл, залоченный нашим процессом на всё время жизни
+class _Segment:
+    def __init__(self, path, file):
+        self.path = path
+        self.file = file
+
+    @classmethod
+    def create(cls, directory):
+        path = os.path.join(directory, f"{os.getpid()}-{time.time_ns()}.log")
+        file = open(path, "a+", encoding="utf-8")
+        fcntl.flock(file, fcntl.LOCK_EX)
+        return cls(path, file)
+
+    @classmethod
+    def adopt(cls, path):
+        # Сегмент "осиротел", если его владелец умер и не держит flock
+        try:
+            file = open(path, "r+", encoding="utf-8")
+        except FileNotFoundError:
+            return None  # владелец успел записать и удалить
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return None
+        return cls(path, file)
+
+    # Пишем в page cache и отдаём копию дескриптора: fsync по ней делаем уже без общего lock
+    # (копия остаётся рабочей, даже если сегмент тем временем запечатан и удалён)
+    def append(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        return os.dup(self.file.fileno())
+
+    def read(self):
+        self.file.seek(0)
+        records = []
+        for line in self.file:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass  # недописанная строка при падении процесса
+        return records
+
+    def discard(self):
+        os.remove(self.path)
+        self.file.close()
+
+
+# 📦 Очередь webhook-событий: подтверждаем после записи на диск,
+# в БД пишем пачками по размеру или по таймеру
+class WebhookQueue:
+    def __init__(self, enabled=WEBHOOK_BATCH_MODE, directory=WEBHOOK_QUEUE_DIR,
+                 batch_size=WEBHOOK_BATCH_SIZE, flush_interval=WEBHOOK_FLUSH_INTERVAL,
+                 adopt_interval=WEBHOOK_ADOPT_INTERVAL):
+        self.enabled = enabled
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.adopt_interval = adopt_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}  # payment_id -> new_status (последний статус побеждает)
+        self._segment = None
+        self._sealed = []
+        self._supabase = None
+        self._registry = None
+        self._thread = None
+        self._pid = None
+
+        self.appended = 0
+        self.deduplicated = 0
+        self.flushed = 0
+        self.batches = 0
+        self.adopted = 0
+        self.unmatched_total = 0
+        self.unmatched = deque(maxlen=UNMATCHED_HISTORY)
+
+    # 🚀 Поток записи в этом процессе (после fork — заново): пишет пачки и подбирает
+    # журналы умерших воркеров даже без новых webhook
+    def ensure_started(self, supabase_registry):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._registry = supabase_registry
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def append(self, supabase, payment_id, new_status):
+        with self._lock:
+            self._supabase = supabase
+            if self._segment is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._segment = _Segment.create(self.directory)
+
+            fd = self._segment.append({"id": payment_id, "status": new_status})
+            if payment_id in self._pending:
+                self.deduplicated += 1
+            self._pending[payment_id] = new_status
+            self.appended += 1
+
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+
+        # Подтверждаем только после fsync; параллельные запросы не ждут друг друга на lock
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _run(self):
+        next_adopt = 0.0
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if time.monotonic() >= next_adopt:
+                next_adopt = time.monotonic() + self.adopt_interval
+                try:
+                    self.adopt_orphans()
+                except Exception:
+                    logger.exception("💥 Ошибка подбора журналов webhook")
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("💥 Ошибка пакетной записи webhook-статусов")
+
+    # Подбираем журналы умерших воркеров: их события пишем вместе со своими
+    def adopt_orphans(self):
+        if not os.path.isdir(self.directory):
+            return
+        with self._lock:
+            own = {segment.path for segment in self._sealed}
+            if self._segment is not None:
+                own.add(self._segment.path)
+
+        for path in glob.glob(os.path.join(self.directory, "*.log")):
+            if path in own:
+                continue
+            segment = _Segment.adopt(path)
+            if segment is None:
+                continue
+            records = segment.read()
+            with self._lock:
+                # Свои события новее осиротевших
+                for record in records:
+                    self._pending.setdefault(record["id"], record["status"])
+                self._sealed.append(segment)
+                self.adopted += 1
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._sealed:
+                    return
+                batch, self._pending = self._pending, {}
+                # Новые события пишем в свежий сегмент, старый удалим после записи в БД
+                if self._segment is not None:
+                    self._sealed.append(self._segment)
+                    self._segment = _Segment.create(self.directory)
+                sealed, self._sealed = self._sealed, []
+                supabase = self._supabase if self._supabase is not None else self._registry.client
+
+            try:
+                self._write(supabase, batch)
+            except Exception:
+                with self._lock:
+                    for payment_id, status in batch.items():
+                        self._pending.setdefault(payment_id, status)
+                    self._sealed = sealed + self._sealed
+                raise
+
+            for segment in sealed:
+                segment.discard()
+
+    def _write(self, supabase, batch):
+        by_status = {}
+        for payment_id, status in batch.items():
+            by_status.setdefault(status, []).append(payment_id)
+
+        # Один UPDATE ... WHERE id IN (...) на каждый статус
+        for status, ids in by_status.items():
+            rows = supabase.table("purchases").update({"status": status}).in_("id", ids).execute().data
+            matched = {str(row["id"]) for row in rows}
+            for row in rows:
+                remember_purchase(row)
+            missing = [payment_id for payment_id in ids if str(payment_id) not in matched]
+
+            with self._lock:
+                self.flushed += len(ids)
+                self.unmatched_total += len(missing)
+                self.unmatched.extend(missing)
+
+            if missing:
+                logger.warning("⚠️ Webhook: purchases not found", extra={"count": len(missing), "ids": missing[:20]})
+
+        with self._lock:
+            self.batches += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending": len(self._pending),
+                "appended": self.appended,
+                "deduplicated": self.deduplicated,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "adopted": self.adopted,
+                "unmatched_total": self.unmatched_total,
+            }
+
+    def recent_unmatched(self):
+        with self._lock:
+            return list(self.unmatched)
+
+
+webhook_queue = WebhookQueue()
+
+
+# 🌐 Поток стартует с первым запросом воркера — так он переживает fork при gunicorn --preload
+def init_webhook_queue(app):
+    if not webhook_queue.enabled:
+        return
+
+    registry = app.extensions["supabase"]
+
+    @app.before_request
+    def _start_webhook_queue():
+        webhook_queue.ensure_started(registry)
+
+
+# При остановке воркера пробуем дописать хвост; не вышло — журнал подберёт другой воркер
+@atexit.register
+def _flush_on_exit():
+    if webhook_queue._segment is None and not webhook_queue._sealed:
+        return
+    try:
+        webhook_queue.flush()
+    except Exception:
+        logger.exception("⚠️ Webhook-очередь не сброшена при остановке")
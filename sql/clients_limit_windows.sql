@@ -0,0 +1,23 @@
+-- 💳 Окна лимитов для движка services/limits.py.
+-- До движка total_amount — сумма клиента за всё время, и именно её сравнивали с лимитом 100000.
+-- Теперь лимит 100000 — за скользящий месяц (LIMIT_MONTH_WINDOW), поэтому в clients три суммы:
+--   period_amount — сумма за скользящий день (LIMIT_DAY_WINDOW), как и раньше,
+--   month_amount  — сумма за скользящий месяц, новая колонка,
+--   total_amount  — сумма за всё время, смысл не меняется.
+-- Помесячной истории в clients нет, поэтому month_amount заполняем приближённо: для клиентов,
+-- активных за последние 30 дней, — их total_amount (окно не мягче прежнего лимита), для остальных — 0.
+-- Движок перечитывает строки с updated_at новее своей записи (LIMITS_REFRESH_INTERVAL):
+-- правка сумм оператором должна обновлять updated_at.
+
+alter table public.clients add column if not exists month_amount numeric;
+
+update public.clients
+   set month_amount = coalesce(total_amount, 0)
+ where month_amount is null
+   and updated_at::timestamptz > now() - interval '30 days';
+
+update public.clients
+   set month_amount = 0
+ where month_amount is null;
+
+create index if not exists clients_updated_at on public.clients (updated_at);
@@ -0,0 +1,11 @@
+-- 📤 Индекс для выгрузки истории покупок (GET /api/operations/export, routes/operations/export.py).
+-- Страница = api_login = X and (created_at, id) > (курсор) order by created_at, id limit N:
+-- с этим индексом каждая страница — короткий проход по индексу, без OFFSET и без сортировки,
+-- сколько бы строк ни было в выгрузке.
+-- concurrently — без блокировки записи в purchases; выполнять вне транзакции (по одной команде).
+
+create index concurrently if not exists purchases_api_login_created_at_id
+    on public.purchases (api_login, created_at, id);
+
+create index concurrently if not exists purchases_test_api_login_created_at_id
+    on public.purchases_test (api_login, created_at, id);
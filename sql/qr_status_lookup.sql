@@ -0,0 +1,78 @@
+-- 🔍 /qr-status одним запросом к PostgREST: проверка ключей, выбор таблицы, покупка.
+-- Вызов: POST /rest/v1/rpc/qr_status_lookup (services/status_lookup.py, STATUS_LOOKUP_RPC=1).
+--
+-- Ошибки — те же, что у маршрута:
+--   missing_credentials -> 400, invalid_key -> 401, forbidden -> 403.
+-- purchase = null — покупки нет; 404 (и сверку api_login) решает приложение,
+-- чтобы ответ ложился в тот же кэш статусов, что и обычное чтение по opId.
+-- p_read_test = false — тестовые покупки живут не в БД (sandbox), purchases_test не читаем.
+--
+-- id в purchases / purchases_test — text (id платежа Birs, uuid тестовых покупок строкой).
+
+create or replace function public.qr_status_lookup(
+    p_api_login text,
+    p_api_key text,
+    p_op_id text,
+    p_read_test boolean default true
+)
+returns table (error text, client json, purchase json)
+language plpgsql
+stable
+set search_path = public
+as $$
+#variable_conflict use_column
+declare
+    v_client api_clients%rowtype;
+    v_purchase json;
+begin
+    if p_api_login is null and p_api_key is null then
+        return query select 'missing_credentials'::text, null::json, null::json;
+        return;
+    end if;
+
+    if p_api_login is null then
+        -- Только ключ: логин берём из найденной строки
+        select * into v_client from api_clients c where c.api_key = p_api_key limit 1;
+        if not found then
+            return query select 'invalid_key'::text, null::json, null::json;
+            return;
+        end if;
+    else
+        select * into v_client from api_clients c
+        where c.api_login = p_api_login and c.api_key = p_api_key
+        limit 1;
+        if not found then
+            return query select 'forbidden'::text, null::json, null::json;
+            return;
+        end if;
+    end if;
+
+    if not coalesce(v_client.test, false) then
+        select json_build_object('id', p.id, 'status', p.status, 'commit', p."commit", 'api_login', p.api_login)
+        into v_purchase
+        from purchases p
+        where p.id = p_op_id;
+    elsif p_read_test then
+        select json_build_object('id', p.id, 'status', p.status, 'commit', p."commit", 'api_login', p.api_login)
+        into v_purchase
+        from purchases_test p
+        where p.id = p_op_id;
+    end if;
+
+    -- Колонки клиента — как API_CLIENT_COLUMNS в services/credentials.py
+    return query select
+        null::text,
+        json_build_object(
+            'id', v_client.id,
+            'api_login', v_client.api_login,
+            'api_key', v_client.api_key,
+            'second_server_url', v_client.second_server_url,
+            'test', v_client.test
+        ),
+        v_purchase;
+end;
+$$;
+
+-- Только для service_role: функция отвечает на вопрос "подходит ли ключ"
+revoke all on function public.qr_status_lookup(text, text, text, boolean) from public, anon, authenticated;
+grant execute on function public.qr_status_lookup(text, text, text, boolean) to service_role;